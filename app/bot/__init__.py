@@ -4,45 +4,38 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
-from aiogram_sqlite_storage.sqlitestore import SQLStorage
 from app.bot.middlewares import setup_middlewares
 from app.bot.handlers import register_routers
 from app.utils.logger import logger
-from app.db import stats, state
-from app.core.config import (bot_token_env, debug_mode, get_webhooks_setting,
-                             webhook_token_env, fsm_storage, state_storage, stats_storage)
+from app.db.backend import get_backend
+from app.core.config import bot_token_env, debug_mode, get_webhooks_setting, webhook_token_env
 
 
 # Инициализация бота и диспетчера
 bot = Bot(token=bot_token_env(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=SQLStorage(db_path=fsm_storage()))
-
-state.init(state_storage())
-stats.init(stats_storage())
+# Бэкенд хранения (DB_BACKEND): SQLite-файлы хоста или общий PostgreSQL, FSM — там же
+dp = Dispatcher(storage=get_backend().fsm_storage())
 
 # Инициализация middleware и роутеров один раз
 setup_middlewares(dp)
 register_routers(dp)
 
+# Типы апдейтов, на которые есть хендлеры: подписка вебхука и фильтр `app.webhooks.decode`
+ALLOWED_UPDATES = frozenset(dp.resolve_used_update_types())
+
 
 async def setup_webhook():
     """Настройка вебхука (для production)"""
     if not debug_mode():
         try:
             info = await bot.get_webhook_info()
-            if info.url != f"{get_webhooks_setting().WEBHOOK_URL}{get_webhooks_setting().WEBHOOK_PATH}":
+            if (info.url != f"{get_webhooks_setting().WEBHOOK_URL}{get_webhooks_setting().WEBHOOK_PATH}"
+                    or set(info.allowed_updates or ()) != ALLOWED_UPDATES):
                 await bot.set_webhook(
                     url=f"{get_webhooks_setting().WEBHOOK_URL}{get_webhooks_setting().WEBHOOK_PATH}",
                     secret_token=webhook_token_env(),
                     drop_pending_updates=True,
-                    allowed_updates=[
-                        "message",
-                        "edited_message",
-                        "callback_query",
-                        "inline_query",
-                        "chat_member",
-                        "my_chat_member",
-                    ]
+                    allowed_updates=sorted(ALLOWED_UPDATES),
                 )
             logger.info("✅ Webhook установлен успешно")
         except TelegramRetryAfter as e:
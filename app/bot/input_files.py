@@ -0,0 +1,33 @@
+# app/bot/input_files.py
+"""
+Файлы для загрузки в Telegram без лишних копий.
+
+`BufferedInputFile` оборачивает байты в `BytesIO` и на каждый кусок отдаёт
+новую копию; `MemoryInputFile` отдаёт срезы `memoryview` того же буфера.
+Большие финалы рендер пишет во временный файл — их читает `FSInputFile`.
+"""
+from __future__ import annotations
+from typing import AsyncGenerator, Union
+
+from aiogram import Bot
+from aiogram.types import FSInputFile, InputFile
+
+from app.render.service import Rendered
+
+
+class MemoryInputFile(InputFile):
+    def __init__(self, data: Union[bytes, bytearray, memoryview], filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.data = data
+
+    async def read(self, bot: Bot) -> AsyncGenerator[memoryview, None]:
+        view = memoryview(self.data)
+        for start in range(0, len(view), self.chunk_size):
+            yield view[start:start + self.chunk_size]
+
+
+def rendered_input_file(r: Rendered) -> InputFile:
+    """Финал для отправки: из временного файла потоком или из памяти."""
+    if r.path is not None:
+        return FSInputFile(r.path, filename=r.filename)
+    return MemoryInputFile(r.data, filename=r.filename)
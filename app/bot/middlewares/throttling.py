@@ -8,7 +8,8 @@ class ThrottlingMiddleware(BaseMiddleware):
         self.cache = TTLCache(maxsize=10_000, ttl=rate_limit)
 
     async def __call__(self, handler, event: Message, data):
-        if event.from_user.id in self.cache:
+        # Альбом приходит пачкой сообщений — это один запрос, его части не режем
+        if event.from_user.id in self.cache and not event.media_group_id:
             logger.warning(f"Throttling user: {event.from_user.id}")
             await event.answer("Слишком много запросов. Подождите...")
             return
@@ -0,0 +1,63 @@
+# app/db/aio.py
+"""
+Асинхронный доступ к SQLite: работа с БД — в отдельных потоках, не в event loop.
+
+Модули `state`/`stats`/`albums` синхронные; вызванные прямо из хендлера, они
+при заблокированной другим воркером БД останавливают весь event loop на время
+ожидания блокировки (до `SQLITE_BUSY_TIMEOUT`). Здесь:
+
+- запись — в одном потоке-писателе: записи процесса идут строго по очереди
+  и не соревнуются друг с другом за блокировку файла;
+- чтение — в пуле из `SQLITE_READERS` потоков: в режиме WAL читатели не ждут
+  писателя и друг друга.
+
+У каждого потока своё долгоживущее соединение (`app.db.connection`).
+Асинхронные версии модулей — `app.db.aio_state`, `app.db.aio_stats`.
+"""
+from __future__ import annotations
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, TypeVar
+
+from app.core.config import get_database_settings
+
+T = TypeVar("T")
+
+_EXECUTORS: Optional[Tuple[ThreadPoolExecutor, ThreadPoolExecutor]] = None
+_PID: Optional[int] = None
+
+
+def _executors() -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+    global _EXECUTORS, _PID
+    if _EXECUTORS is None or _PID != os.getpid():
+        # Потоки не переживают fork — в новом процессе пулы создаются заново
+        readers = max(1, get_database_settings().SQLITE_READERS)
+        _EXECUTORS = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer"),
+            ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader"),
+        )
+        _PID = os.getpid()
+    return _EXECUTORS
+
+
+async def write(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Выполнить `fn` в потоке-писателе (все записи процесса — по очереди)."""
+    call = functools.partial(fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executors()[0], call)
+
+
+async def read(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Выполнить `fn` (только чтение) в одном из потоков-читателей."""
+    call = functools.partial(fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executors()[1], call)
+
+
+def shutdown() -> None:
+    """Дождаться начатых операций и остановить потоки (при остановке приложения)."""
+    global _EXECUTORS
+    if _EXECUTORS is not None and _PID == os.getpid():
+        for executor in _EXECUTORS:
+            executor.shutdown(wait=True)
+    _EXECUTORS = None
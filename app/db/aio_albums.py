@@ -0,0 +1,26 @@
+# app/db/aio_albums.py
+"""Асинхронная версия `app.db.albums`: те же функции, работа с БД — через бэкенд хранения (`app.db.backend`)."""
+from __future__ import annotations
+from typing import Any, Dict, List
+
+from app.db.backend import get_backend
+
+
+async def add_item(media_group_id: str, message_id: int, user_id: int, file_id: str) -> float:
+    """Добавить элемент альбома; возвращает отметку времени добавления."""
+    return await get_backend().album_add_item(media_group_id, message_id, user_id, file_id)
+
+async def last_added(media_group_id: str) -> float:
+    return await get_backend().album_last_added(media_group_id)
+
+async def claim(media_group_id: str) -> bool:
+    """Атомарно забрать альбом на обработку: True только у одного из вызывающих."""
+    return await get_backend().album_claim(media_group_id)
+
+async def items(media_group_id: str) -> List[Dict[str, Any]]:
+    """Элементы альбома в порядке сообщений."""
+    return await get_backend().album_items(media_group_id)
+
+async def purge() -> None:
+    """Удалить старые альбомы."""
+    await get_backend().album_purge()
@@ -0,0 +1,67 @@
+# app/db/aio_events.py
+"""
+Асинхронная запись журнала использования (`app.db.events`) через бэкенд хранения.
+
+Как и статистика (`app.db.aio_stats`), события пишутся отложенно: `record`
+только добавляет событие в буфер, а пачка уходит в БД одной транзакцией —
+раз в `EVENTS_FLUSH_INTERVAL` секунд или по набору `EVENTS_FLUSH_SIZE`
+событий. Если БД недоступна, события копятся до `EVENTS_MAX_PENDING`, дальше
+самые старые отбрасываются: аналитика не должна съесть память воркера.
+Сам буфер — `app.db.write_behind`.
+"""
+from __future__ import annotations
+import atexit
+import time
+from typing import Any, Dict, List, Sequence
+
+from app.core.config import get_database_settings
+from app.db.backend import get_backend
+from app.db.events import Event
+from app.db.write_behind import WriteBehindBuffer
+from app.utils.logger import logger
+
+
+def _requeue(batch: List[Event], pending: List[Event]) -> List[Event]:
+    # Неудачная пачка — в начало буфера (порядок сохраняется), сверх лимита — без самых старых
+    events = batch + pending
+    limit = get_database_settings().EVENTS_MAX_PENDING
+    if len(events) > limit:
+        dropped = len(events) - limit
+        del events[:dropped]
+        logger.warning(f"usage events: dropped {dropped} oldest events")
+    return events
+
+async def _apply(batch: List[Event]) -> None:
+    await get_backend().append_events(batch)
+
+def _apply_sync(batch: List[Event]) -> None:
+    get_backend().append_events_sync(batch)
+
+def _new_buffer() -> WriteBehindBuffer[List[Event]]:
+    return WriteBehindBuffer(
+        "usage events", list, _requeue, _apply, _apply_sync,
+        interval=lambda: get_database_settings().EVENTS_FLUSH_INTERVAL,
+        size=lambda: get_database_settings().EVENTS_FLUSH_SIZE,
+    )
+
+
+_BUFFER = _new_buffer()
+atexit.register(_BUFFER.flush_sync)
+
+
+def record(kind: str, size: str, dpi: int, fmt: str, dither: str, status: str,
+           duration: float, user_id: int = 0) -> None:
+    """Событие рендеринга (`duration` — в секундах); вызывать из event loop."""
+    _BUFFER.add(lambda p: p.append(
+        (time.time(), user_id, kind, size, dpi, fmt, dither, status, duration * 1000.0)))
+
+async def rollups(grain: str, since: float, until: float, group_by: Sequence[str]) -> List[Dict[str, Any]]:
+    """Сводки за `[since, until)` (см. `app.db.events.rollups`)."""
+    return await get_backend().read_rollups(grain, since, until, group_by)
+
+async def flush() -> None:
+    await _BUFFER.flush()
+
+async def close() -> None:
+    """При остановке приложения: накопленные события — в БД."""
+    await _BUFFER.close()
@@ -0,0 +1,125 @@
+# app/db/aio_state.py
+"""
+Асинхронная версия `app.db.state`: те же функции, работа с БД — через бэкенд
+хранения (`app.db.backend`: SQLite в потоках `app.db.aio` или PostgreSQL).
+
+Скалярное состояние кешируется в общей для воркеров таблице
+(`app.db.state_cache`): изменения с RETURNING кладутся туда сквозной
+записью, остальные изменения сбрасывают запись пользователя.
+"""
+from __future__ import annotations
+import time
+from typing import Any, Dict, Literal, Optional, Sequence
+
+from app.core.config import get_database_settings
+from app.db import state_cache
+from app.db.backend import get_backend
+
+
+# Когда процесс последний раз отмечал использование фото пользователя (запись — не чаще IMAGE_TOUCH_INTERVAL)
+_TOUCHED: Dict[int, float] = {}
+_TOUCHED_MAX = 65536
+
+
+def _through(user_id: int, rec: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Сквозная запись: новое состояние из RETURNING — в общий кеш воркеров."""
+    cache = state_cache.get_cache()
+    if cache is not None and rec is not None:
+        cache.put(user_id, rec)
+    return rec
+
+def _invalidate(user_id: int) -> None:
+    cache = state_cache.get_cache()
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
+async def ensure_user(user_id: int) -> None:
+    await get_backend().ensure_user(user_id)
+
+async def get_state(user_id: int) -> Dict[str, Any]:
+    """Возвращает все поля состояния пользователя (создаёт запись при отсутствии)."""
+    rec = await get_backend().read_state(user_id)
+    if rec is None:
+        # Новый пользователь — единственный случай, когда чтению нужна запись
+        await ensure_user(user_id)
+        rec = await get_backend().read_state(user_id)
+    return rec
+
+async def save_state(
+    user_id: int,
+    *,
+    brightness: float,
+    contrast: float,
+    gamma: float,
+    sharpness: float,
+    invert: bool,
+    dither: Literal["fs","ordered","none"],
+    dpi: int,
+    denoise_size: int,
+    blur_radius: float,
+    last_image_bytes: Optional[bytes],
+    out_format: str = "bmp",
+) -> None:
+    await get_backend().save_state(
+        user_id,
+        brightness=brightness, contrast=contrast, gamma=gamma, sharpness=sharpness,
+        invert=invert, dither=dither, dpi=dpi, denoise_size=denoise_size,
+        blur_radius=blur_radius, last_image_bytes=last_image_bytes, out_format=out_format,
+    )
+    _invalidate(user_id)
+
+async def update_fields(user_id: int, **fields) -> None:
+    """Частичное обновление произвольных полей (без SELECT)."""
+    if fields:
+        await get_backend().update_fields(user_id, **fields)
+        _invalidate(user_id)
+
+async def get_scalars(user_id: int) -> Dict[str, Any]:
+    """Скалярное состояние (без фото) — из общего кеша воркеров, при промахе — из БД."""
+    cache = state_cache.get_cache()
+    token = -1
+    if cache is not None:
+        rec, token = cache.lookup(user_id)
+        if rec is not None:
+            return rec
+    rec = await get_backend().read_scalars(user_id)
+    if rec is None:
+        await ensure_user(user_id)
+        rec = await get_backend().read_scalars(user_id)
+    if cache is not None:
+        cache.fill(user_id, rec, token)
+    return rec
+
+async def adjust(user_id: int, column: str, delta: float, need_image: bool = True) -> Optional[Dict[str, Any]]:
+    """Атомарно прибавить `delta` к параметру (см. `state.adjust`); фото не перезаписывается."""
+    return _through(user_id, await get_backend().adjust(user_id, column, delta, need_image))
+
+async def cycle(user_id: int, column: str, choices: Sequence[Any], fallback: Any,
+                need_image: bool = True) -> Optional[Dict[str, Any]]:
+    return _through(user_id, await get_backend().cycle(user_id, column, choices, fallback, need_image))
+
+async def toggle(user_id: int, column: str, need_image: bool = True) -> Optional[Dict[str, Any]]:
+    return _through(user_id, await get_backend().toggle(user_id, column, need_image))
+
+async def set_scalars(user_id: int, **fields) -> Optional[Dict[str, Any]]:
+    return _through(user_id, await get_backend().set_scalars(user_id, **fields))
+
+async def get_image(user_id: int) -> Optional[bytes]:
+    """Фото пользователя; использование отмечается для сборки мусора (`app.db.maintenance`)."""
+    image = await get_backend().get_image(user_id)
+    if image is not None:
+        now = time.time()
+        if now - _TOUCHED.get(user_id, 0.0) >= get_database_settings().IMAGE_TOUCH_INTERVAL:
+            if len(_TOUCHED) >= _TOUCHED_MAX:
+                _TOUCHED.clear()
+            _TOUCHED[user_id] = now
+            await get_backend().touch_image(user_id, now)
+    return image
+
+async def evict_images(older_than: float, budget_bytes: int, limit: int) -> int:
+    """Пачка сборки мусора фото (см. `state.evict_images`); новое состояние — в общий кеш."""
+    rows = await get_backend().evict_images(older_than, budget_bytes, limit)
+    for user_id, rec in rows:
+        _through(user_id, rec)
+    return len(rows)
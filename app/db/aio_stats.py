@@ -0,0 +1,104 @@
+# app/db/aio_stats.py
+"""
+Асинхронная версия `app.db.stats`: те же функции, работа с БД — через бэкенд
+хранения (`app.db.backend`).
+
+Счётчики пишутся отложенно (write-behind): `record_*` только прибавляют
+приращение в памяти, а накопленное по всем пользователям сбрасывается в БД
+одной транзакцией (`apply_deltas` бэкенда) — раз в `STATS_FLUSH_INTERVAL`
+секунд или сразу, как только изменения набрались у `STATS_FLUSH_USERS`
+пользователей. Статистика больше не стоит столько же записей и fsync, сколько
+само состояние.
+
+`get_user_stats` добавляет к прочитанному ещё не сброшенные приращения —
+под блокировкой сброса, чтобы не посчитать пачку дважды. Буфер, повтор
+неудачного сброса и согласованность с чтением — `app.db.write_behind`.
+При остановке приложения буфер сбрасывается (`close`), на случай выхода
+без неё — ещё и в `atexit`.
+"""
+from __future__ import annotations
+import atexit
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from app.core.config import get_database_settings
+from app.db.backend import get_backend
+from app.db.write_behind import WriteBehindBuffer
+
+Delta = List[float]  # [outputs, settings_changes, last_seen (unix)]
+Deltas = Dict[int, Delta]
+
+
+def _bump(pending: Deltas, user_id: int, outputs: int, changes: int) -> None:
+    d = pending.get(user_id)
+    if d is None:
+        d = pending[user_id] = [0, 0, 0.0]
+    d[0] += outputs
+    d[1] += changes
+    d[2] = time.time()
+
+def _merge(batch: Deltas, pending: Deltas) -> Deltas:
+    for uid, (outputs, changes, seen) in batch.items():
+        d = pending.setdefault(uid, [0, 0, 0.0])
+        d[0] += outputs
+        d[1] += changes
+        d[2] = max(d[2], seen)
+    return pending
+
+def _rows(batch: Deltas) -> list:
+    return [(uid, int(o), int(c), t) for uid, (o, c, t) in batch.items()]
+
+async def _apply(batch: Deltas) -> None:
+    await get_backend().apply_deltas(_rows(batch))
+
+def _apply_sync(batch: Deltas) -> None:
+    get_backend().apply_deltas_sync(_rows(batch))
+
+def _new_buffer() -> WriteBehindBuffer[Deltas]:
+    """Приращения счётчиков по пользователям до сброса в БД."""
+    return WriteBehindBuffer(
+        "stats", dict, _merge, _apply, _apply_sync,
+        interval=lambda: get_database_settings().STATS_FLUSH_INTERVAL,
+        size=lambda: get_database_settings().STATS_FLUSH_USERS,
+    )
+
+
+_BUFFER = _new_buffer()
+atexit.register(_BUFFER.flush_sync)
+
+
+async def record_output(user_id: int, delta: int = 1) -> None:
+    """Вызывать после отправки финального файла (после выбора формата)."""
+    _BUFFER.add(lambda p: _bump(p, user_id, delta, 0))
+
+async def record_setting_change(user_id: int, delta: int = 1) -> None:
+    """Вызывать при любом изменении параметров/настройки."""
+    _BUFFER.add(lambda p: _bump(p, user_id, 0, delta))
+
+async def get_user_stats(user_id: int) -> dict:
+    async with _BUFFER.lock:
+        # Под блокировкой сброса: пачка либо ещё в буфере, либо уже в БД — не в обоих
+        s = await get_backend().read_user_stats(user_id)
+        if s is None:
+            await get_backend().stats_ensure_user(user_id)
+            s = await get_backend().read_user_stats(user_id)
+        d = _BUFFER.pending.get(user_id)
+    if d is not None:
+        # Ещё не сброшенное — поверх прочитанного
+        seen = datetime.fromtimestamp(d[2], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        s = {
+            **s,
+            "outputs_count": s["outputs_count"] + int(d[0]),
+            "settings_changes_count": s["settings_changes_count"] + int(d[1]),
+            "last_seen": max(s["last_seen"], seen),
+        }
+    return s
+
+async def flush() -> None:
+    """Сбросить накопленные счётчики в БД сейчас."""
+    await _BUFFER.flush()
+
+async def close() -> None:
+    """При остановке приложения: ничего из накопленного не теряется."""
+    await _BUFFER.close()
@@ -0,0 +1,39 @@
+# app/db/aio_updates.py
+"""
+Асинхронная версия `app.db.updates` через бэкенд хранения, с памятью процесса.
+
+Повтор, пришедший в тот же воркер, отсекается по словарю забранных им
+`update_id` без обращения к БД; в другой воркер — INSERT в общую таблицу.
+В словарь попадают только свои апдейты: `release` другого воркера (апдейт
+не принят к обработке) не должен упираться в память этого.
+"""
+from __future__ import annotations
+import time
+from typing import Dict
+
+from app.db.backend import get_backend
+
+_SEEN: Dict[int, float] = {}
+_SEEN_MAX = 65536
+
+
+async def claim(update_id: int) -> bool:
+    """True — апдейт доставлен впервые и забран этим воркером; False — повтор."""
+    if update_id in _SEEN:
+        return False
+    now = time.time()
+    if not await get_backend().claim_update(update_id, now):
+        return False
+    if len(_SEEN) >= _SEEN_MAX:
+        _SEEN.clear()
+    _SEEN[update_id] = now
+    return True
+
+async def release(update_id: int) -> None:
+    """Апдейт не принят к обработке (400/422/429): повторная доставка должна пройти."""
+    _SEEN.pop(update_id, None)
+    await get_backend().release_update(update_id)
+
+async def purge(ttl_sec: float) -> int:
+    """Забыть апдейты старше `ttl_sec` (фоновое обслуживание)."""
+    return await get_backend().purge_updates(time.time() - ttl_sec)
@@ -0,0 +1,94 @@
+# app/db/albums.py
+"""
+Альбомы (media group): Telegram присылает каждое фото альбома отдельным
+апдейтом, и они могут попасть в разные веб-воркеры. Элементы складываются
+сюда; обрабатывает альбом тот, кто пришёл последним и первым «забрал» его
+(`claim`) — остальные просто выходят.
+"""
+from __future__ import annotations
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+from app.db import connection
+
+_DB: Optional[Path] = None
+
+# Сколько хранить элементы альбома (по ним же потом собирается архив финалов)
+ALBUM_TTL_SEC = 24 * 3600
+
+def _conn() -> sqlite3.Connection:
+    if _DB is None:
+        raise RuntimeError("albums DB is not initialized. Call albums_db.init(path) first.")
+    return connection.connect(_DB)
+
+def init(db_path: str) -> None:
+    """Инициализация таблиц элементов альбомов и их захвата обработчиком."""
+    global _DB
+    _DB = Path(db_path)
+    _DB.parent.mkdir(parents=True, exist_ok=True)
+    with _conn() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS album_items (
+            media_group_id TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            user_id    INTEGER NOT NULL,
+            file_id    TEXT NOT NULL,
+            added_at   REAL NOT NULL,
+            PRIMARY KEY (media_group_id, message_id)
+        );
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS album_claims (
+            media_group_id TEXT PRIMARY KEY,
+            claimed_at REAL NOT NULL
+        );
+        """)
+        c.commit()
+
+def add_item(media_group_id: str, message_id: int, user_id: int, file_id: str) -> float:
+    """Добавить элемент альбома; возвращает отметку времени добавления."""
+    now = time.time()
+    with _conn() as c:
+        c.execute("""
+            INSERT INTO album_items (media_group_id, message_id, user_id, file_id, added_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(media_group_id, message_id) DO NOTHING;
+        """, (media_group_id, message_id, user_id, file_id, now))
+        c.commit()
+    return now
+
+def last_added(media_group_id: str) -> float:
+    with _conn() as c:
+        row = c.execute(
+            "SELECT MAX(added_at) FROM album_items WHERE media_group_id = ?;", (media_group_id,)
+        ).fetchone()
+        return float(row[0] or 0.0)
+
+def claim(media_group_id: str) -> bool:
+    """Атомарно забрать альбом на обработку: True только у одного из вызывающих."""
+    with _conn() as c:
+        cur = c.execute("""
+            INSERT INTO album_claims (media_group_id, claimed_at) VALUES (?, ?)
+            ON CONFLICT(media_group_id) DO NOTHING;
+        """, (media_group_id, time.time()))
+        c.commit()
+        return cur.rowcount == 1
+
+def items(media_group_id: str) -> List[Dict[str, Any]]:
+    """Элементы альбома в порядке сообщений."""
+    with _conn() as c:
+        cur = c.execute("""
+            SELECT message_id, user_id, file_id FROM album_items
+             WHERE media_group_id = ? ORDER BY message_id;
+        """, (media_group_id,))
+        return [{"message_id": r[0], "user_id": r[1], "file_id": r[2]} for r in cur.fetchall()]
+
+def purge(ttl_sec: float = ALBUM_TTL_SEC) -> None:
+    """Удалить старые альбомы."""
+    cutoff = time.time() - ttl_sec
+    with _conn() as c:
+        c.execute("DELETE FROM album_items WHERE added_at < ?;", (cutoff,))
+        c.execute("DELETE FROM album_claims WHERE claimed_at < ?;", (cutoff,))
+        c.commit()
@@ -0,0 +1,278 @@
+# app/db/backend.py
+"""
+Бэкенд хранения: состояние, статистика, журнал использования, принятые апдейты, альбомы и FSM aiogram.
+
+Выбирается `DB_BACKEND` (`app.core.config.DatabaseSettings`):
+
+- `sqlite` — как раньше: файлы в `app/db/storage` на одном хосте, работа с
+  ними — в потоках `app.db.aio`, фото — в `user_state.last_image_bytes`;
+- `postgres` — общая БД для нескольких хостов (`app.db.postgres`, пул asyncpg),
+  фото — в общем файловом хранилище (`app.db.blobs`).
+
+Асинхронные модули `aio_state`/`aio_stats`/`aio_albums` обращаются только к
+`get_backend()` и не знают, где лежат данные.
+"""
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from aiogram.fsm.storage.base import BaseStorage
+
+from app.core.config import fsm_storage, get_database_settings, state_storage, stats_storage
+from app.db import albums, events, state, stats, updates
+from app.db.aio import read, write
+from app.db.events import Event
+
+StatsRow = Tuple[int, int, int, float]  # user_id, outputs, settings_changes, last_seen (unix)
+
+
+class StorageBackend(ABC):
+    """Операции хранения, которые нужны хендлерам (сигнатуры — как в `app.db.state`/`stats`/`albums`)."""
+
+    # ---------------------- Состояние ----------------------
+
+    @abstractmethod
+    async def ensure_user(self, user_id: int) -> None: ...
+
+    @abstractmethod
+    async def read_state(self, user_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def read_scalars(self, user_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def save_state(self, user_id: int, **fields) -> None: ...
+
+    @abstractmethod
+    async def update_fields(self, user_id: int, **fields) -> None: ...
+
+    @abstractmethod
+    async def adjust(self, user_id: int, column: str, delta: float, need_image: bool) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def cycle(self, user_id: int, column: str, choices: Sequence[Any], fallback: Any,
+                    need_image: bool) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def toggle(self, user_id: int, column: str, need_image: bool) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def set_scalars(self, user_id: int, **fields) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def get_image(self, user_id: int) -> Optional[bytes]: ...
+
+    # ---------------------- Сборка мусора фото ----------------------
+
+    @abstractmethod
+    async def touch_image(self, user_id: int, now: float) -> None: ...
+
+    @abstractmethod
+    async def evict_images(self, older_than: float, budget_bytes: int,
+                           limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """Пачка удалённых фото: `(user_id, новые скалярные поля)` (см. `state.evict_images`)."""
+
+    @abstractmethod
+    async def vacuum_step(self, pages: int) -> int:
+        """Шаг возврата места и чекпойнта; сколько работы (свободных страниц) осталось."""
+
+    # ---------------------- Статистика ----------------------
+
+    @abstractmethod
+    async def stats_ensure_user(self, user_id: int) -> None: ...
+
+    @abstractmethod
+    async def read_user_stats(self, user_id: int) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def apply_deltas(self, rows: List[StatsRow]) -> None:
+        """Пачка приращений статистики — одной транзакцией."""
+
+    @abstractmethod
+    def apply_deltas_sync(self, rows: List[StatsRow]) -> None:
+        """То же без event loop (сброс буфера статистики в `atexit`)."""
+
+    # ---------------------- Журнал использования ----------------------
+
+    @abstractmethod
+    async def append_events(self, batch: List[Event]) -> None:
+        """Пачка событий и приращения сводок — одной транзакцией (см. `app.db.events`)."""
+
+    @abstractmethod
+    def append_events_sync(self, batch: List[Event]) -> None: ...
+
+    @abstractmethod
+    async def read_rollups(self, grain: str, since: float, until: float,
+                           group_by: Sequence[str]) -> List[Dict[str, Any]]: ...
+
+    # ---------------------- Принятые апдейты ----------------------
+
+    @abstractmethod
+    async def claim_update(self, update_id: int, now: float) -> bool:
+        """True только у первого, кто забрал апдейт (см. `app.db.updates`)."""
+
+    @abstractmethod
+    async def release_update(self, update_id: int) -> None: ...
+
+    @abstractmethod
+    async def purge_updates(self, older_than: float) -> int: ...
+
+    # ---------------------- Альбомы ----------------------
+
+    @abstractmethod
+    async def album_add_item(self, media_group_id: str, message_id: int, user_id: int, file_id: str) -> float: ...
+
+    @abstractmethod
+    async def album_last_added(self, media_group_id: str) -> float: ...
+
+    @abstractmethod
+    async def album_claim(self, media_group_id: str) -> bool: ...
+
+    @abstractmethod
+    async def album_items(self, media_group_id: str) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def album_purge(self) -> None: ...
+
+    # ---------------------- Общее ----------------------
+
+    @property
+    @abstractmethod
+    def host_local(self) -> bool:
+        """Данные видны только этому хосту (можно кешировать в памяти хоста)."""
+
+    @abstractmethod
+    def fsm_storage(self) -> BaseStorage: ...
+
+    async def close(self) -> None:
+        pass
+
+
+class SqliteBackend(StorageBackend):
+    """Файлы SQLite на хосте; синхронные модули — в потоках `app.db.aio`."""
+
+    host_local = True
+
+    def __init__(self) -> None:
+        state.init(state_storage())
+        albums.init(state_storage())
+        updates.init(state_storage())
+        stats.init(stats_storage())
+        events.init(stats_storage())
+
+    async def ensure_user(self, user_id: int) -> None:
+        await write(state.ensure_user, user_id)
+
+    async def read_state(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await read(state.read_state, user_id)
+
+    async def read_scalars(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await read(state.read_scalars, user_id)
+
+    async def save_state(self, user_id: int, **fields) -> None:
+        await write(state.save_state, user_id, **fields)
+
+    async def update_fields(self, user_id: int, **fields) -> None:
+        await write(state.update_fields, user_id, **fields)
+
+    async def adjust(self, user_id: int, column: str, delta: float, need_image: bool) -> Optional[Dict[str, Any]]:
+        return await write(state.adjust, user_id, column, delta, need_image)
+
+    async def cycle(self, user_id: int, column: str, choices: Sequence[Any], fallback: Any,
+                    need_image: bool) -> Optional[Dict[str, Any]]:
+        return await write(state.cycle, user_id, column, choices, fallback, need_image)
+
+    async def toggle(self, user_id: int, column: str, need_image: bool) -> Optional[Dict[str, Any]]:
+        return await write(state.toggle, user_id, column, need_image)
+
+    async def set_scalars(self, user_id: int, **fields) -> Optional[Dict[str, Any]]:
+        return await write(state.set_scalars, user_id, **fields)
+
+    async def get_image(self, user_id: int) -> Optional[bytes]:
+        return await read(state.get_image, user_id)
+
+    async def touch_image(self, user_id: int, now: float) -> None:
+        await write(state.touch_image, user_id, now)
+
+    async def evict_images(self, older_than: float, budget_bytes: int,
+                           limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        return await write(state.evict_images, older_than, budget_bytes, limit)
+
+    async def vacuum_step(self, pages: int) -> int:
+        left = await write(state.vacuum_step, pages)
+        await write(stats.checkpoint)
+        return left
+
+    async def stats_ensure_user(self, user_id: int) -> None:
+        await write(stats.ensure_user, user_id)
+
+    async def read_user_stats(self, user_id: int) -> Optional[dict]:
+        return await read(stats.read_user_stats, user_id)
+
+    async def apply_deltas(self, rows: List[StatsRow]) -> None:
+        await write(stats.apply_deltas, rows)
+
+    def apply_deltas_sync(self, rows: List[StatsRow]) -> None:
+        stats.apply_deltas(rows)
+
+    async def append_events(self, batch: List[Event]) -> None:
+        await write(events.append, batch)
+
+    def append_events_sync(self, batch: List[Event]) -> None:
+        events.append(batch)
+
+    async def read_rollups(self, grain: str, since: float, until: float,
+                           group_by: Sequence[str]) -> List[Dict[str, Any]]:
+        return await read(events.rollups, grain, since, until, group_by)
+
+    async def claim_update(self, update_id: int, now: float) -> bool:
+        return await write(updates.claim, update_id, now)
+
+    async def release_update(self, update_id: int) -> None:
+        await write(updates.release, update_id)
+
+    async def purge_updates(self, older_than: float) -> int:
+        return await write(updates.purge, older_than)
+
+    async def album_add_item(self, media_group_id: str, message_id: int, user_id: int, file_id: str) -> float:
+        return await write(albums.add_item, media_group_id, message_id, user_id, file_id)
+
+    async def album_last_added(self, media_group_id: str) -> float:
+        return await read(albums.last_added, media_group_id)
+
+    async def album_claim(self, media_group_id: str) -> bool:
+        return await write(albums.claim, media_group_id)
+
+    async def album_items(self, media_group_id: str) -> List[Dict[str, Any]]:
+        return await read(albums.items, media_group_id)
+
+    async def album_purge(self) -> None:
+        await write(albums.purge)
+
+    def fsm_storage(self) -> BaseStorage:
+        from aiogram_sqlite_storage.sqlitestore import SQLStorage
+        return SQLStorage(db_path=fsm_storage())
+
+
+_BACKEND: Optional[StorageBackend] = None
+
+
+def get_backend() -> StorageBackend:
+    """Бэкенд процесса (создаётся при первом обращении; после fork — тот же объект)."""
+    global _BACKEND
+    if _BACKEND is None:
+        kind = get_database_settings().DB_BACKEND
+        if kind == "sqlite":
+            _BACKEND = SqliteBackend()
+        elif kind == "postgres":
+            from app.db.postgres import PostgresBackend
+            _BACKEND = PostgresBackend()
+        else:
+            raise RuntimeError(f"unknown DB_BACKEND {kind!r} (expected sqlite or postgres)")
+    return _BACKEND
+
+
+async def close() -> None:
+    """При остановке приложения: закрыть соединения бэкенда этого процесса."""
+    if _BACKEND is not None:
+        await _BACKEND.close()
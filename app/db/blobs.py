@@ -0,0 +1,62 @@
+# app/db/blobs.py
+"""
+Хранилище фото пользователей в файлах (для бэкенда postgres).
+
+Многомегабайтные оригиналы не хранятся в строках PostgreSQL: каждое чтение
+состояния тянуло бы их по сети, а TOAST и WAL раздувались бы на каждую
+замену фото. Фото лежит файлом `<root>/<ключ[:2]>/<ключ>.img` на общем для
+всех хостов томе (`BLOB_STORE_DIR`: NFS, CephFS и т.п.), в БД — его ключ.
+
+Ключ новый на каждую загрузку (`new_key`), файлы не перезаписываются: строка
+состояния переключается на новый ключ, после чего удаляется файл прежнего.
+Поэтому удаление старого фото (замена, сборка мусора) не может задеть только
+что загруженное, а запись через временный файл и `os.replace` гарантирует,
+что по ключу из БД всегда лежит файл целиком.
+"""
+from __future__ import annotations
+import os
+import secrets
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+Data = Union[bytes, bytearray, memoryview]
+
+
+def new_key() -> str:
+    return secrets.token_hex(16)
+
+
+class FileBlobStore:
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.img"
+
+    def put(self, key: str, data: Data) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,77 @@
+# app/db/connection.py
+"""
+Долгоживущие соединения SQLite: одно на поток (и процесс) для каждого файла БД.
+
+Раньше каждый вызов `state`/`stats` открывал новое соединение и заново
+выставлял PRAGMA, а `get_state` — ещё одно через `ensure_user`: одно нажатие
+кнопки — 4–6 соединений. Теперь соединение открывается и настраивается один
+раз на поток, а `sqlite3` кеширует подготовленные запросы соединения по тексту
+SQL (`cached_statements`) — повторный вызов не разбирает SQL заново.
+
+Соединение привязано к потоку (`threading.local`) и к процессу: после fork
+(воркеры gunicorn) дочерний процесс открывает свои соединения, а не наследует
+родительские.
+
+Транзакции — как и раньше: `with conn:` фиксирует или откатывает, но не
+закрывает соединение.
+"""
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Union
+
+from app.core.config import get_database_settings
+
+_local = threading.local()
+
+
+def _open(path: str) -> sqlite3.Connection:
+    cfg = get_database_settings()
+    conn = sqlite3.connect(
+        path, timeout=cfg.SQLITE_BUSY_TIMEOUT, check_same_thread=False,
+        cached_statements=cfg.SQLITE_CACHED_STATEMENTS,
+    )
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute(f"PRAGMA mmap_size={cfg.SQLITE_MMAP_SIZE_MB * 1024 * 1024};")
+    conn.execute(f"PRAGMA cache_size=-{cfg.SQLITE_CACHE_SIZE_KB};")  # отрицательное — в КиБ
+    conn.execute(f"PRAGMA journal_size_limit={cfg.SQLITE_WAL_LIMIT_MB * 1024 * 1024};")
+    if cfg.DB_MAINTENANCE_INTERVAL > 0:
+        # Чекпойнты WAL делает фоновое обслуживание (`app.db.maintenance`), а не
+        # коммит хендлера, которому не повезло переполнить WAL
+        conn.execute("PRAGMA wal_autocheckpoint=0;")
+    return conn
+
+
+def _pool() -> Dict[str, sqlite3.Connection]:
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        # Новый поток или процесс после fork: унаследованные соединения не трогаем
+        _local.pid, _local.conns = pid, {}
+    return _local.conns
+
+
+def connect(path: Union[str, Path]) -> sqlite3.Connection:
+    """Соединение с БД `path` для текущего потока (открывается при первом обращении)."""
+    path = Path(path).as_posix()
+    if not get_database_settings().SQLITE_PERSISTENT:
+        return _open(path)
+    conns = _pool()
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = _open(path)
+    return conn
+
+
+def close(path: Union[str, Path, None] = None) -> None:
+    """Закрыть соединения текущего потока (все или к одной БД)."""
+    conns = _pool()
+    keys = list(conns) if path is None else [Path(path).as_posix()]
+    for key in keys:
+        conn = conns.pop(key, None)
+        if conn is not None:
+            conn.close()
+
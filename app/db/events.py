@@ -0,0 +1,137 @@
+# app/db/events.py
+"""
+Журнал использования: события рендеринга и почасовые/посуточные сводки.
+
+`user_stats` хранит только два счётчика на пользователя. Здесь каждое
+событие (превью, финал, экспорт, постер) — строка журнала `usage_events`
+(только добавление), а сводки `usage_rollups` по корзинам часа и суток
+обновляются в той же транзакции, что и пачка событий: прибавляются число
+событий, сумма и максимум длительности по каждой комбинации измерений.
+
+Чтение аналитики идёт только по сводкам (первичный ключ начинается с
+`(grain, bucket)` — диапазон времени читается по индексу), поэтому время
+ответа не зависит от размера журнала.
+
+События пишутся пачками из буфера `app.db.aio_events`.
+"""
+from __future__ import annotations
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.db import connection
+
+_DB: Optional[Path] = None
+
+# ts, user_id, kind, size, dpi, fmt, dither, status, duration_ms
+Event = Tuple[float, int, str, str, int, str, str, str, float]
+
+GRAINS: Dict[str, int] = {"hour": 3600, "day": 86400}
+DIMENSIONS = ("kind", "size", "dpi", "fmt", "dither", "status")
+
+def _conn() -> sqlite3.Connection:
+    if _DB is None:
+        raise RuntimeError("events DB is not initialized. Call events_db.init(path) first.")
+    return connection.connect(_DB)
+
+def init(db_path: str) -> None:
+    """Инициализация журнала событий и таблицы сводок."""
+    global _DB
+    _DB = Path(db_path)
+    _DB.parent.mkdir(parents=True, exist_ok=True)
+    with _conn() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS usage_events (
+            id          INTEGER PRIMARY KEY,
+            ts          REAL NOT NULL,
+            user_id     INTEGER NOT NULL,
+            kind        TEXT NOT NULL,
+            size        TEXT NOT NULL,
+            dpi         INTEGER NOT NULL,
+            fmt         TEXT NOT NULL,
+            dither      TEXT NOT NULL,
+            status      TEXT NOT NULL,
+            duration_ms REAL NOT NULL
+        );
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS usage_rollups (
+            grain  TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            kind   TEXT NOT NULL,
+            size   TEXT NOT NULL,
+            dpi    INTEGER NOT NULL,
+            fmt    TEXT NOT NULL,
+            dither TEXT NOT NULL,
+            status TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            duration_ms_sum REAL NOT NULL,
+            duration_ms_max REAL NOT NULL,
+            PRIMARY KEY (grain, bucket, kind, size, dpi, fmt, dither, status)
+        ) WITHOUT ROWID;
+        """)
+        c.commit()
+
+def rollup_rows(events: Iterable[Event]) -> List[tuple]:
+    """Свернуть пачку событий в приращения сводок: `(grain, bucket, *измерения, events, sum, max)`."""
+    acc: Dict[tuple, List[float]] = {}
+    for ts, _uid, kind, size, dpi, fmt, dither, status, duration in events:
+        for grain, width in GRAINS.items():
+            key = (grain, int(ts // width) * width, kind, size, dpi, fmt, dither, status)
+            a = acc.get(key)
+            if a is None:
+                acc[key] = [1, duration, duration]
+            else:
+                a[0] += 1
+                a[1] += duration
+                a[2] = max(a[2], duration)
+    return [(*key, int(a[0]), a[1], a[2]) for key, a in acc.items()]
+
+def append(events: Sequence[Event]) -> None:
+    """Пачка событий в журнал и её приращения в сводки — одной транзакцией."""
+    with _conn() as c:
+        c.executemany("""
+            INSERT INTO usage_events (ts, user_id, kind, size, dpi, fmt, dither, status, duration_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """, events)
+        c.executemany("""
+            INSERT INTO usage_rollups (grain, bucket, kind, size, dpi, fmt, dither, status,
+                                       events, duration_ms_sum, duration_ms_max)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (grain, bucket, kind, size, dpi, fmt, dither, status) DO UPDATE
+               SET events = events + excluded.events,
+                   duration_ms_sum = duration_ms_sum + excluded.duration_ms_sum,
+                   duration_ms_max = MAX(duration_ms_max, excluded.duration_ms_max);
+        """, rollup_rows(events))
+        c.commit()
+
+def check_query(grain: str, group_by: Sequence[str]) -> None:
+    if grain not in GRAINS:
+        raise ValueError(f"grain must be one of {sorted(GRAINS)}")
+    unknown = set(group_by) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"unknown dimensions: {sorted(unknown)}")
+
+def rollups(grain: str, since: float, until: float, group_by: Sequence[str]) -> List[Dict[str, Any]]:
+    """Сводки за `[since, until)` по корзинам `grain`, сгруппированные по `group_by` (только чтение)."""
+    check_query(grain, group_by)
+    dims = "".join(f", {d}" for d in group_by)
+    with _conn() as c:
+        cur = c.execute(f"""
+            SELECT bucket{dims}, SUM(events), SUM(duration_ms_sum), MAX(duration_ms_max)
+              FROM usage_rollups
+             WHERE grain = ? AND bucket >= ? AND bucket < ?
+             GROUP BY bucket{dims} ORDER BY bucket{dims};
+        """, (grain, int(since // GRAINS[grain]) * GRAINS[grain], until))
+        return [rollup_record(row, group_by) for row in cur.fetchall()]
+
+def rollup_record(row: Sequence[Any], group_by: Sequence[str]) -> Dict[str, Any]:
+    n = len(group_by)
+    events, total, peak = row[1 + n], row[2 + n], row[3 + n]
+    return {
+        "bucket": int(row[0]),
+        **dict(zip(group_by, row[1:1 + n])),
+        "events": int(events),
+        "duration_ms_avg": round(total / events, 1) if events else 0.0,
+        "duration_ms_max": round(peak, 1),
+    }
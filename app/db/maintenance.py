@@ -0,0 +1,114 @@
+# app/db/maintenance.py
+"""
+Фоновое обслуживание БД: сборка мусора фото, возврат места, чекпойнты WAL.
+
+Раз в `DB_MAINTENANCE_INTERVAL` секунд:
+
+1. удаляются фото, не использовавшиеся дольше `IMAGE_TTL_DAYS`, и самые
+   давние сверх `IMAGE_BUDGET_MB` (LRU по `image_used_at`);
+2. забываются принятые апдейты старше `WEBHOOK_DEDUP_TTL` (`app.db.updates`);
+3. освобождённые страницы возвращаются файлу (`PRAGMA incremental_vacuum`),
+   WAL переносится в БД пассивным чекпойнтом.
+
+Работа идёт маленькими шагами (`DB_MAINTENANCE_BATCH` фото,
+`DB_MAINTENANCE_PAGES` страниц) через того же потока-писателя, что и
+хендлеры (`app.db.aio`), с паузой между шагами: запись хендлера ждёт не
+дольше одного шага, а не всей уборки. Чекпойнты больше не делает коммит
+хендлера (`wal_autocheckpoint=0`, см. `app.db.connection`).
+
+Запускается в одном процессе хоста — воркере с WORKER_ID "0" (как
+setup_webhook) или в единственном процессе режима отладки.
+
+Возврат места шагами требует `auto_vacuum=INCREMENTAL`. Новые БД создаются
+так сразу; существующую переводит однократный полный VACUUM — отдельной
+командой на остановленном боте, не при старте:
+
+    python -m app.db.maintenance --convert      (make db-convert)
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+from typing import Optional
+
+from app.core.config import get_database_settings, get_webhooks_setting, state_storage
+from app.db import aio_state, aio_updates, state
+from app.db.backend import get_backend
+from app.utils.logger import logger
+
+STEP_PAUSE_SEC = 0.05    # пауза между шагами — очередь писателя успевает обслужить хендлеры
+MAX_STEPS = 1000         # шагов за проход; остальное — в следующий
+
+
+async def run_once() -> None:
+    """Один проход обслуживания (шагами)."""
+    cfg = get_database_settings()
+    now = time.time()
+    older_than = now - cfg.IMAGE_TTL_DAYS * 86400 if cfg.IMAGE_TTL_DAYS > 0 else 0.0
+    budget = cfg.IMAGE_BUDGET_MB * 1024 * 1024
+    evicted = 0
+    for _ in range(MAX_STEPS):
+        n = await aio_state.evict_images(older_than, budget, cfg.DB_MAINTENANCE_BATCH)
+        evicted += n
+        if n < cfg.DB_MAINTENANCE_BATCH:
+            break
+        await asyncio.sleep(STEP_PAUSE_SEC)
+    if evicted:
+        logger.info(f"DB maintenance: evicted {evicted} stored images")
+    await aio_updates.purge(get_webhooks_setting().WEBHOOK_DEDUP_TTL)
+    for _ in range(MAX_STEPS):
+        if await get_backend().vacuum_step(cfg.DB_MAINTENANCE_PAGES) == 0:
+            break
+        await asyncio.sleep(STEP_PAUSE_SEC)
+
+
+async def _loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_once()
+        except Exception as e:
+            # Обслуживание не должно ронять воркер: попробуем в следующий раз
+            logger.error(f"DB maintenance failed: {e!r}")
+
+
+_TASK: Optional[asyncio.Task] = None
+
+
+def start() -> None:
+    """Запустить фоновое обслуживание в текущем event loop (если включено)."""
+    global _TASK
+    interval = get_database_settings().DB_MAINTENANCE_INTERVAL
+    if interval > 0 and _TASK is None:
+        _TASK = asyncio.get_running_loop().create_task(_loop(interval))
+
+
+async def stop() -> None:
+    global _TASK
+    if _TASK is not None:
+        _TASK.cancel()
+        try:
+            await _TASK
+        except asyncio.CancelledError:
+            pass
+        _TASK = None
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Обслуживание БД состояния (SQLite)")
+    p.add_argument("--convert", action="store_true",
+                   help="однократно перевести state.db на auto_vacuum=INCREMENTAL (полный VACUUM, бот остановлен)")
+    args = p.parse_args()
+    if not args.convert:
+        p.print_help()
+        return
+    state.init(state_storage())
+    logger.info(f"Converting {state_storage()} to auto_vacuum=INCREMENTAL (full VACUUM)...")
+    if state.convert_auto_vacuum():
+        logger.info("Done")
+    else:
+        logger.info("Already in auto_vacuum=INCREMENTAL mode, nothing to do")
+
+
+if __name__ == "__main__":
+    main()
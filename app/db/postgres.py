@@ -0,0 +1,509 @@
+# app/db/postgres.py
+"""
+Бэкенд PostgreSQL (`DB_BACKEND=postgres`) — для нескольких хостов с общей БД.
+
+- Пул соединений asyncpg на процесс (`PG_POOL_MIN`..`PG_POOL_MAX`), создаётся
+  при первом запросе в event loop воркера; подготовленные запросы asyncpg
+  кеширует на соединении сам.
+- Схема создаётся при первом подключении под advisory-блокировкой: воркеры
+  всех хостов стартуют одновременно, а `CREATE TABLE IF NOT EXISTS` в
+  PostgreSQL от гонки не защищён.
+- Таблицы и запросы повторяют `app.db.state`/`stats`/`albums` (те же
+  атомарные UPDATE … RETURNING), отличия — только в диалекте.
+- Фото — не в БД, а в `FileBlobStore` на общем томе (`BLOB_STORE_DIR`);
+  в `user_state` — его ключ (`image_key`) и флаг `has_image`. Файл пишется до
+  строки состояния, файл прежнего ключа удаляется после неё.
+- Статистика — одним INSERT … SELECT FROM unnest(массивы) на пачку буфера
+  `app.db.aio_stats`: один запрос и одна транзакция на весь сброс.
+- Журнал использования (`app.db.events`) — так же: события и приращения
+  сводок — двумя INSERT … FROM unnest в одной транзакции.
+- FSM aiogram — таблица `fsm_data` (`PostgresFSMStorage`), данные в JSONB.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import asyncpg
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from app.core.config import blob_storage, get_database_settings
+from app.db.aio import read, write
+from app.db.albums import ALBUM_TTL_SEC
+from app.db.backend import StatsRow, StorageBackend
+from app.db.blobs import FileBlobStore, new_key
+from app.db.events import GRAINS, Event, rollup_record, check_query, rollup_rows
+from app.db.state import ADJUST_LIMITS, CYCLE_COLUMNS, SCALAR_COLUMNS, TOGGLE_COLUMNS
+
+_SCHEMA_LOCK = 0x50595250  # ключ advisory-блокировки создания схемы ("PYRP")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_state (
+    user_id      BIGINT PRIMARY KEY,
+    brightness   DOUBLE PRECISION NOT NULL DEFAULT 1.0,
+    contrast     DOUBLE PRECISION NOT NULL DEFAULT 1.0,
+    gamma        DOUBLE PRECISION NOT NULL DEFAULT 1.0,
+    sharpness    DOUBLE PRECISION NOT NULL DEFAULT 1.0,
+    invert       BOOLEAN NOT NULL DEFAULT FALSE,
+    dither       TEXT NOT NULL DEFAULT 'fs',
+    dpi          INTEGER NOT NULL DEFAULT 300,
+    denoise_size INTEGER NOT NULL DEFAULT 0,
+    blur_radius  DOUBLE PRECISION NOT NULL DEFAULT 0.0,
+    out_format   TEXT NOT NULL DEFAULT 'bmp',
+    has_image    BOOLEAN NOT NULL DEFAULT FALSE,
+    version      BIGINT NOT NULL DEFAULT 0
+);
+ALTER TABLE user_state ADD COLUMN IF NOT EXISTS image_key TEXT;
+ALTER TABLE user_state ADD COLUMN IF NOT EXISTS image_used_at DOUBLE PRECISION NOT NULL DEFAULT 0;
+ALTER TABLE user_state ADD COLUMN IF NOT EXISTS image_size BIGINT NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS user_state_image_lru ON user_state (image_used_at) WHERE has_image;
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id BIGINT PRIMARY KEY,
+    outputs_count BIGINT NOT NULL DEFAULT 0,
+    settings_changes_count BIGINT NOT NULL DEFAULT 0,
+    first_seen TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    last_seen  TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+CREATE TABLE IF NOT EXISTS usage_events (
+    id          BIGSERIAL PRIMARY KEY,
+    ts          DOUBLE PRECISION NOT NULL,
+    user_id     BIGINT NOT NULL,
+    kind        TEXT NOT NULL,
+    size        TEXT NOT NULL,
+    dpi         INTEGER NOT NULL,
+    fmt         TEXT NOT NULL,
+    dither      TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    duration_ms DOUBLE PRECISION NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage_rollups (
+    grain  TEXT NOT NULL,
+    bucket BIGINT NOT NULL,
+    kind   TEXT NOT NULL,
+    size   TEXT NOT NULL,
+    dpi    INTEGER NOT NULL,
+    fmt    TEXT NOT NULL,
+    dither TEXT NOT NULL,
+    status TEXT NOT NULL,
+    events BIGINT NOT NULL,
+    duration_ms_sum DOUBLE PRECISION NOT NULL,
+    duration_ms_max DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (grain, bucket, kind, size, dpi, fmt, dither, status)
+);
+CREATE TABLE IF NOT EXISTS seen_updates (
+    update_id BIGINT PRIMARY KEY,
+    seen_at   DOUBLE PRECISION NOT NULL
+);
+CREATE TABLE IF NOT EXISTS album_items (
+    media_group_id TEXT NOT NULL,
+    message_id BIGINT NOT NULL,
+    user_id    BIGINT NOT NULL,
+    file_id    TEXT NOT NULL,
+    added_at   DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (media_group_id, message_id)
+);
+CREATE TABLE IF NOT EXISTS album_claims (
+    media_group_id TEXT PRIMARY KEY,
+    claimed_at DOUBLE PRECISION NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fsm_data (
+    key   TEXT PRIMARY KEY,
+    state TEXT,
+    data  JSONB
+);
+"""
+
+_CYCLE_TYPES = {"dither": "text", "dpi": "integer", "denoise_size": "integer", "out_format": "text"}
+_SCALARS_SQL = f"{', '.join(SCALAR_COLUMNS)}, has_image, version"
+_TS = "to_char({0}, 'YYYY-MM-DD HH24:MI:SS')"  # как CURRENT_TIMESTAMP в SQLite
+
+
+def _scalars(row: Optional[asyncpg.Record]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    return {
+        "brightness": float(row["brightness"]),
+        "contrast": float(row["contrast"]),
+        "gamma": float(row["gamma"]),
+        "sharpness": float(row["sharpness"]),
+        "invert": bool(row["invert"]),
+        "dither": str(row["dither"]),
+        "dpi": int(row["dpi"]),
+        "denoise_size": int(row["denoise_size"]),
+        "blur_radius": float(row["blur_radius"]),
+        "out_format": (row["out_format"] or "bmp"),
+        "has_image": bool(row["has_image"]),
+        "version": int(row["version"]),
+    }
+
+
+def _status_count(status: str) -> int:
+    # "INSERT 0 1" / "UPDATE 3" → число затронутых строк
+    return int(status.rsplit(" ", 1)[-1])
+
+
+class PostgresBackend(StorageBackend):
+    host_local = False
+
+    def __init__(self) -> None:
+        self.blobs = FileBlobStore(blob_storage())
+        self._pool: Optional[asyncpg.Pool] = None
+        self._pid: Optional[int] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def pool(self) -> asyncpg.Pool:
+        pid = os.getpid()
+        if self._pid != pid:
+            # Пул привязан к event loop процесса: после fork — свой
+            self._pool, self._lock, self._pid = None, asyncio.Lock(), pid
+        if self._pool is None:
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await self._create_pool()
+        return self._pool
+
+    async def _create_pool(self) -> asyncpg.Pool:
+        cfg = get_database_settings()
+        pool = await asyncpg.create_pool(
+            cfg.PG_DSN, min_size=cfg.PG_POOL_MIN, max_size=cfg.PG_POOL_MAX,
+            command_timeout=cfg.PG_COMMAND_TIMEOUT,
+        )
+        async with pool.acquire() as conn, conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1);", _SCHEMA_LOCK)
+            await conn.execute(SCHEMA)
+        return pool
+
+    async def close(self) -> None:
+        if self._pool is not None and self._pid == os.getpid():
+            await self._pool.close()
+        self._pool = None
+
+    # ---------------------- Состояние ----------------------
+
+    async def ensure_user(self, user_id: int) -> None:
+        await (await self.pool()).execute(
+            "INSERT INTO user_state (user_id) VALUES ($1) ON CONFLICT (user_id) DO NOTHING;", user_id)
+
+    async def read_scalars(self, user_id: int) -> Optional[Dict[str, Any]]:
+        row = await (await self.pool()).fetchrow(
+            f"SELECT {_SCALARS_SQL} FROM user_state WHERE user_id = $1;", user_id)
+        return _scalars(row)
+
+    async def read_state(self, user_id: int) -> Optional[Dict[str, Any]]:
+        rec = await self.read_scalars(user_id)
+        if rec is None:
+            return None
+        image = await self.get_image(user_id) if rec["has_image"] else None
+        rec = {k: v for k, v in rec.items() if k not in ("has_image", "version")}
+        return {**rec, "last_image_bytes": image}
+
+    async def _put_image(self, image: Any) -> Dict[str, Any]:
+        """Записать фото под новым ключом (до строки состояния); поля строки для него."""
+        if image is None:
+            return {"has_image": False, "image_key": None, "image_size": 0}
+        key = new_key()
+        await write(self.blobs.put, key, image)
+        return {"has_image": True, "image_key": key, "image_size": len(image), "image_used_at": time.time()}
+
+    async def save_state(self, user_id: int, **fields) -> None:
+        fields.update(await self._put_image(fields.pop("last_image_bytes")))
+        await self._update(user_id, fields)
+
+    async def update_fields(self, user_id: int, **fields) -> None:
+        if "last_image_bytes" in fields:
+            fields.update(await self._put_image(fields.pop("last_image_bytes")))
+        await self.ensure_user(user_id)
+        await self._update(user_id, fields)
+
+    async def _update(self, user_id: int, fields: Dict[str, Any]) -> None:
+        if "invert" in fields:
+            fields["invert"] = bool(fields["invert"])
+        cols = ", ".join(f"{k} = ${i}" for i, k in enumerate(fields, 2))
+        # Прежний ключ фото — из той же строки под блокировкой (RETURNING отдаёт только новые значения)
+        row = await (await self.pool()).fetchrow(f"""
+            UPDATE user_state s SET {cols}, version = s.version + 1
+              FROM (SELECT image_key FROM user_state WHERE user_id = $1 FOR UPDATE) old
+             WHERE s.user_id = $1
+            RETURNING old.image_key;
+        """, user_id, *fields.values())
+        if "image_key" in fields:
+            # Файл, на который строка больше не ссылается: прежний или (строки нет) только что записанный
+            stale = row["image_key"] if row is not None else fields["image_key"]
+            if stale is not None and stale != fields["image_key"]:
+                await write(self.blobs.delete, stale)
+
+    async def _update_returning(self, sql_set: str, params: Sequence[Any], user_id: int,
+                                need_image: bool) -> Optional[Dict[str, Any]]:
+        # $1 — user_id, параметры `sql_set` — с $2
+        where = "user_id = $1 AND has_image" if need_image else "user_id = $1"
+        row = await (await self.pool()).fetchrow(
+            f"UPDATE user_state SET {sql_set}, version = version + 1 WHERE {where} RETURNING {_SCALARS_SQL};",
+            user_id, *params)
+        return _scalars(row)
+
+    async def adjust(self, user_id: int, column: str, delta: float, need_image: bool) -> Optional[Dict[str, Any]]:
+        if column not in ADJUST_LIMITS:
+            raise ValueError(f"column {column!r} can not be adjusted")
+        lo, hi = ADJUST_LIMITS[column]
+        sql = f"{column} = round(greatest($2, least($3, {column} + $4))::numeric, 2)::double precision"
+        return await self._update_returning(sql, (lo, hi, delta), user_id, need_image)
+
+    async def cycle(self, user_id: int, column: str, choices: Sequence[Any], fallback: Any,
+                    need_image: bool) -> Optional[Dict[str, Any]]:
+        if column not in CYCLE_COLUMNS:
+            raise ValueError(f"column {column!r} can not be cycled")
+        nxt = list(choices[1:]) + [choices[0]]
+        params = [v for pair in zip(choices, nxt) for v in pair] + [fallback]
+        # Типы параметров CASE PostgreSQL по колонке не выводит — приводим явно
+        t = _CYCLE_TYPES[column]
+        whens = " ".join(f"WHEN ${i}::{t} THEN ${i + 1}::{t}" for i in range(2, 2 + 2 * len(choices), 2))
+        sql = f"{column} = CASE {column} {whens} ELSE ${len(params) + 1}::{t} END"
+        return await self._update_returning(sql, params, user_id, need_image)
+
+    async def toggle(self, user_id: int, column: str, need_image: bool) -> Optional[Dict[str, Any]]:
+        if column not in TOGGLE_COLUMNS:
+            raise ValueError(f"column {column!r} can not be toggled")
+        return await self._update_returning(f"{column} = NOT {column}", (), user_id, need_image)
+
+    async def set_scalars(self, user_id: int, **fields) -> Optional[Dict[str, Any]]:
+        unknown = set(fields) - set(SCALAR_COLUMNS)
+        if unknown:
+            raise ValueError(f"not scalar state fields: {sorted(unknown)}")
+        if "invert" in fields:
+            fields["invert"] = bool(fields["invert"])
+        cols = ", ".join(f"{k} = ${i}" for i, k in enumerate(fields, 2))
+        return await self._update_returning(cols, list(fields.values()), user_id, need_image=False)
+
+    async def get_image(self, user_id: int) -> Optional[bytes]:
+        key = await (await self.pool()).fetchval(
+            "SELECT image_key FROM user_state WHERE user_id = $1 AND has_image;", user_id)
+        return await read(self.blobs.get, key) if key is not None else None
+
+    async def touch_image(self, user_id: int, now: float) -> None:
+        await (await self.pool()).execute(
+            "UPDATE user_state SET image_used_at = $2 WHERE user_id = $1 AND has_image;", user_id, now)
+
+    async def evict_images(self, older_than: float, budget_bytes: int,
+                           limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        # Кандидаты: не использовавшиеся с `older_than` и самые давние, пока объём выше бюджета
+        # (накопленная сумма по LRU); SKIP LOCKED — не ждём строк, которые сейчас меняются
+        rows = await (await self.pool()).fetch(f"""
+            WITH lru AS (
+                SELECT user_id, image_used_at,
+                       SUM(image_size) OVER (ORDER BY image_used_at, user_id) - image_size AS freed_before
+                  FROM user_state WHERE has_image
+                 ORDER BY image_used_at, user_id LIMIT $3
+            ), total AS (
+                SELECT COALESCE(SUM(image_size), 0) AS bytes FROM user_state WHERE has_image
+            ), victims AS (
+                SELECT s.user_id, s.image_key FROM user_state s
+                 WHERE s.user_id IN (
+                       SELECT lru.user_id FROM lru, total
+                        WHERE lru.image_used_at < $1 OR ($2 > 0 AND total.bytes - lru.freed_before > $2))
+                   AND s.has_image
+                   FOR UPDATE SKIP LOCKED
+            )
+            UPDATE user_state s
+               SET has_image = FALSE, image_key = NULL, image_size = 0, version = s.version + 1
+              FROM victims v
+             WHERE s.user_id = v.user_id
+            RETURNING v.image_key AS old_key, s.user_id, {", ".join(f"s.{c}" for c in SCALAR_COLUMNS)},
+                      s.has_image, s.version;
+        """, older_than, budget_bytes, limit)
+        for row in rows:
+            if row["old_key"] is not None:
+                await write(self.blobs.delete, row["old_key"])
+        return [(row["user_id"], _scalars(row)) for row in rows]
+
+    async def vacuum_step(self, pages: int) -> int:
+        # Место в PostgreSQL возвращает autovacuum, фото удалены вместе с файлами
+        return 0
+
+    # ---------------------- Статистика ----------------------
+
+    async def stats_ensure_user(self, user_id: int) -> None:
+        await (await self.pool()).execute(
+            "INSERT INTO user_stats (user_id) VALUES ($1) ON CONFLICT (user_id) DO NOTHING;", user_id)
+
+    async def read_user_stats(self, user_id: int) -> Optional[dict]:
+        row = await (await self.pool()).fetchrow(f"""
+            SELECT outputs_count, settings_changes_count,
+                   {_TS.format('first_seen')} AS first_seen, {_TS.format('last_seen')} AS last_seen
+              FROM user_stats WHERE user_id = $1;
+        """, user_id)
+        return dict(row) if row is not None else None
+
+    _APPLY_DELTAS = """
+        INSERT INTO user_stats AS s (user_id, outputs_count, settings_changes_count, last_seen)
+        SELECT u, o, c, to_timestamp(t) AT TIME ZONE 'utc'
+          FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::float8[]) AS d(u, o, c, t)
+        ON CONFLICT (user_id) DO UPDATE
+           SET outputs_count = s.outputs_count + excluded.outputs_count,
+               settings_changes_count = s.settings_changes_count + excluded.settings_changes_count,
+               last_seen = greatest(s.last_seen, excluded.last_seen);
+    """
+
+    @staticmethod
+    def _columns(rows: List[StatsRow]) -> List[list]:
+        # user_id в пачке уникальны (буфер — словарь), иначе ON CONFLICT не обновит строку дважды
+        return [list(col) for col in zip(*rows)] if rows else [[], [], [], []]
+
+    async def apply_deltas(self, rows: List[StatsRow]) -> None:
+        await (await self.pool()).execute(self._APPLY_DELTAS, *self._columns(rows))
+
+    def apply_deltas_sync(self, rows: List[StatsRow]) -> None:
+        # atexit: event loop воркера уже закрыт — отдельное соединение на один запрос
+        async def once() -> None:
+            cfg = get_database_settings()
+            conn = await asyncpg.connect(cfg.PG_DSN, command_timeout=cfg.PG_COMMAND_TIMEOUT)
+            try:
+                await conn.execute(self._APPLY_DELTAS, *self._columns(rows))
+            finally:
+                await conn.close()
+        asyncio.run(once())
+
+    # ---------------------- Журнал использования ----------------------
+
+    _INSERT_EVENTS = """
+        INSERT INTO usage_events (ts, user_id, kind, size, dpi, fmt, dither, status, duration_ms)
+        SELECT * FROM unnest($1::float8[], $2::bigint[], $3::text[], $4::text[], $5::integer[],
+                             $6::text[], $7::text[], $8::text[], $9::float8[]);
+    """
+    _UPSERT_ROLLUPS = """
+        INSERT INTO usage_rollups AS r (grain, bucket, kind, size, dpi, fmt, dither, status,
+                                        events, duration_ms_sum, duration_ms_max)
+        SELECT * FROM unnest($1::text[], $2::bigint[], $3::text[], $4::text[], $5::integer[],
+                             $6::text[], $7::text[], $8::text[], $9::bigint[], $10::float8[], $11::float8[])
+        ON CONFLICT (grain, bucket, kind, size, dpi, fmt, dither, status) DO UPDATE
+           SET events = r.events + excluded.events,
+               duration_ms_sum = r.duration_ms_sum + excluded.duration_ms_sum,
+               duration_ms_max = greatest(r.duration_ms_max, excluded.duration_ms_max);
+    """
+
+    async def _append_events(self, conn: asyncpg.Connection, batch: List[Event]) -> None:
+        # Ключи `rollup_rows` уникальны в пачке — ON CONFLICT не встретит строку дважды
+        async with conn.transaction():
+            await conn.execute(self._INSERT_EVENTS, *[list(col) for col in zip(*batch)])
+            await conn.execute(self._UPSERT_ROLLUPS, *[list(col) for col in zip(*rollup_rows(batch))])
+
+    async def append_events(self, batch: List[Event]) -> None:
+        if batch:
+            async with (await self.pool()).acquire() as conn:
+                await self._append_events(conn, batch)
+
+    def append_events_sync(self, batch: List[Event]) -> None:
+        if not batch:
+            return
+        async def once() -> None:
+            cfg = get_database_settings()
+            conn = await asyncpg.connect(cfg.PG_DSN, command_timeout=cfg.PG_COMMAND_TIMEOUT)
+            try:
+                await self._append_events(conn, batch)
+            finally:
+                await conn.close()
+        asyncio.run(once())
+
+    async def read_rollups(self, grain: str, since: float, until: float,
+                           group_by: Sequence[str]) -> List[Dict[str, Any]]:
+        check_query(grain, group_by)
+        dims = "".join(f", {d}" for d in group_by)
+        width = GRAINS[grain]
+        rows = await (await self.pool()).fetch(f"""
+            SELECT bucket{dims}, SUM(events)::bigint, SUM(duration_ms_sum), MAX(duration_ms_max)
+              FROM usage_rollups
+             WHERE grain = $1 AND bucket >= $2 AND bucket < $3
+             GROUP BY bucket{dims} ORDER BY bucket{dims};
+        """, grain, int(since // width) * width, math.ceil(until))
+        return [rollup_record(tuple(row), group_by) for row in rows]
+
+    # ---------------------- Принятые апдейты ----------------------
+
+    async def claim_update(self, update_id: int, now: float) -> bool:
+        status = await (await self.pool()).execute("""
+            INSERT INTO seen_updates (update_id, seen_at) VALUES ($1, $2)
+            ON CONFLICT (update_id) DO NOTHING;
+        """, update_id, now)
+        return _status_count(status) == 1
+
+    async def release_update(self, update_id: int) -> None:
+        await (await self.pool()).execute("DELETE FROM seen_updates WHERE update_id = $1;", update_id)
+
+    async def purge_updates(self, older_than: float) -> int:
+        status = await (await self.pool()).execute("DELETE FROM seen_updates WHERE seen_at < $1;", older_than)
+        return _status_count(status)
+
+    # ---------------------- Альбомы ----------------------
+
+    async def album_add_item(self, media_group_id: str, message_id: int, user_id: int, file_id: str) -> float:
+        now = time.time()
+        await (await self.pool()).execute("""
+            INSERT INTO album_items (media_group_id, message_id, user_id, file_id, added_at)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (media_group_id, message_id) DO NOTHING;
+        """, media_group_id, message_id, user_id, file_id, now)
+        return now
+
+    async def album_last_added(self, media_group_id: str) -> float:
+        value = await (await self.pool()).fetchval(
+            "SELECT MAX(added_at) FROM album_items WHERE media_group_id = $1;", media_group_id)
+        return float(value or 0.0)
+
+    async def album_claim(self, media_group_id: str) -> bool:
+        status = await (await self.pool()).execute("""
+            INSERT INTO album_claims (media_group_id, claimed_at) VALUES ($1, $2)
+            ON CONFLICT (media_group_id) DO NOTHING;
+        """, media_group_id, time.time())
+        return _status_count(status) == 1
+
+    async def album_items(self, media_group_id: str) -> List[Dict[str, Any]]:
+        rows = await (await self.pool()).fetch("""
+            SELECT message_id, user_id, file_id FROM album_items
+             WHERE media_group_id = $1 ORDER BY message_id;
+        """, media_group_id)
+        return [dict(r) for r in rows]
+
+    async def album_purge(self) -> None:
+        cutoff = time.time() - ALBUM_TTL_SEC
+        async with (await self.pool()).acquire() as conn, conn.transaction():
+            await conn.execute("DELETE FROM album_items WHERE added_at < $1;", cutoff)
+            await conn.execute("DELETE FROM album_claims WHERE claimed_at < $1;", cutoff)
+
+    def fsm_storage(self) -> BaseStorage:
+        return PostgresFSMStorage(self)
+
+
+class PostgresFSMStorage(BaseStorage):
+    """FSM aiogram в таблице `fsm_data` общей БД (ключи — `DefaultKeyBuilder`)."""
+
+    def __init__(self, backend: PostgresBackend):
+        self.backend = backend
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await (await self.backend.pool()).execute("""
+            INSERT INTO fsm_data (key, state) VALUES ($1, $2)
+            ON CONFLICT (key) DO UPDATE SET state = excluded.state;
+        """, self.key_builder.build(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await (await self.backend.pool()).fetchval(
+            "SELECT state FROM fsm_data WHERE key = $1;", self.key_builder.build(key))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await (await self.backend.pool()).execute("""
+            INSERT INTO fsm_data (key, data) VALUES ($1, $2::jsonb)
+            ON CONFLICT (key) DO UPDATE SET data = excluded.data;
+        """, self.key_builder.build(key), json.dumps(dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = await (await self.backend.pool()).fetchval(
+            "SELECT data::text FROM fsm_data WHERE key = $1;", self.key_builder.build(key))
+        return json.loads(raw) if raw else {}
+
+    async def close(self) -> None:
+        await self.backend.close()
@@ -1,24 +1,36 @@
 # app/db/state.py
 from __future__ import annotations
 import sqlite3
+import time
 from pathlib import Path
-from typing import Optional, Literal, Any, Dict
+from typing import Optional, Literal, Any, Dict, List, Sequence, Tuple
+
+from app.db import connection
+from app.utils.logger import logger
 
 _DB: Optional[Path] = None
+_WARNED_AUTO_VACUUM = False
 
 def _conn() -> sqlite3.Connection:
     if _DB is None:
         raise RuntimeError("state DB is not initialized. Call state_db.init(path) first.")
-    conn = sqlite3.connect(_DB.as_posix(), timeout=10, check_same_thread=False)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    return conn
+    return connection.connect(_DB)
 
 def init(db_path: str) -> None:
     """Инициализация файла и таблицы состояния пользователей."""
     global _DB
     _DB = Path(db_path)
     _DB.parent.mkdir(parents=True, exist_ok=True)
+    if not _DB.exists():
+        # Новая БД — сразу с INCREMENTAL: режим задаётся до того, как соединение
+        # `app.db.connection` запишет заголовок (WAL). Существующую переводит
+        # `convert_auto_vacuum` отдельной командой
+        raw = sqlite3.connect(_DB)
+        try:
+            raw.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            raw.execute("PRAGMA journal_mode=WAL;")
+        finally:
+            raw.close()
     with _conn() as c:
         c.execute("""
         CREATE TABLE IF NOT EXISTS user_state (
@@ -36,13 +48,44 @@ def init(db_path: str) -> None:
         );
         """)
         # мягкая миграция новых полей
-        try:
-            c.execute("ALTER TABLE user_state ADD COLUMN out_format TEXT NOT NULL DEFAULT 'bmp';")
-        except sqlite3.OperationalError:
-            # колонка уже добавлена ранее
-            pass
+        for ddl in (
+            "ALTER TABLE user_state ADD COLUMN out_format TEXT NOT NULL DEFAULT 'bmp';",
+            # растёт при каждом изменении состояния (кеши сверяются с ним)
+            "ALTER TABLE user_state ADD COLUMN version INTEGER NOT NULL DEFAULT 0;",
+            # для сборки мусора фото: когда фото последний раз использовалось и его размер
+            "ALTER TABLE user_state ADD COLUMN image_used_at REAL NOT NULL DEFAULT 0;",
+            "ALTER TABLE user_state ADD COLUMN image_size INTEGER NOT NULL DEFAULT 0;",
+        ):
+            try:
+                c.execute(ddl)
+            except sqlite3.OperationalError:
+                # колонка уже добавлена ранее
+                pass
+        # Фото, сохранённые до появления колонок, считаем использованными сейчас
+        c.execute("""
+            UPDATE user_state SET image_used_at = ?, image_size = length(last_image_bytes)
+             WHERE last_image_bytes IS NOT NULL AND image_size = 0;
+        """, (time.time(),))
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS user_state_image_lru
+                ON user_state (image_used_at, image_size) WHERE last_image_bytes IS NOT NULL;
+        """)
         c.commit()
 
+def convert_auto_vacuum() -> bool:
+    """Перевести существующую БД на auto_vacuum=INCREMENTAL полным VACUUM; False — уже переведена.
+
+    VACUUM переписывает весь файл (на время — вдвое больше места на диске) и
+    держит БД заблокированной: только отдельной командой на остановленном боте
+    (`python -m app.db.maintenance --convert`), не при старте.
+    """
+    with _conn() as c:
+        if c.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2:
+            return False
+        c.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        c.execute("VACUUM;")
+        return True
+
 def ensure_user(user_id: int) -> None:
     with _conn() as c:
         c.execute("""
@@ -53,15 +96,21 @@ def ensure_user(user_id: int) -> None:
 
 def get_state(user_id: int) -> Dict[str, Any]:
     """Возвращает все поля состояния пользователя (создаёт запись при отсутствии)."""
+    ensure_user(user_id)
+    # запись гарантированно есть после ensure_user
+    return read_state(user_id)
+
+def read_state(user_id: int) -> Optional[Dict[str, Any]]:
+    """Поля состояния пользователя или None, если записи ещё нет (только чтение)."""
     with _conn() as c:
-        ensure_user(user_id)
         cur = c.execute("""
             SELECT brightness, contrast, gamma, sharpness, invert, dither, dpi,
                    denoise_size, blur_radius, last_image_bytes, out_format
             FROM user_state WHERE user_id = ?;
         """, (user_id,))
         row = cur.fetchone()
-        # row гарантированно есть после ensure_user
+        if row is None:
+            return None
         return {
             "brightness": float(row[0]),
             "contrast": float(row[1]),
@@ -96,12 +145,15 @@ def save_state(
             UPDATE user_state
                SET brightness = ?, contrast = ?, gamma = ?, sharpness = ?,
                    invert = ?, dither = ?, dpi = ?, denoise_size = ?,
-                   blur_radius = ?, last_image_bytes = ?, out_format = ?
+                   blur_radius = ?, last_image_bytes = ?, out_format = ?,
+                   image_used_at = ?, image_size = ?,
+                   version = version + 1
              WHERE user_id = ?;
         """, (
             brightness, contrast, gamma, sharpness,
             1 if invert else 0, dither, dpi, denoise_size,
-            blur_radius, last_image_bytes, out_format, user_id
+            blur_radius, last_image_bytes, out_format,
+            time.time(), len(last_image_bytes) if last_image_bytes is not None else 0, user_id
         ))
         c.commit()
 
@@ -109,9 +161,203 @@ def update_fields(user_id: int, **fields) -> None:
     """Частичное обновление произвольных полей (без SELECT)."""
     if not fields:
         return
+    if "last_image_bytes" in fields:
+        image = fields["last_image_bytes"]
+        fields.update(image_used_at=time.time(), image_size=len(image) if image is not None else 0)
     cols = ", ".join(f"{k} = ?" for k in fields.keys())
     vals = list(fields.values()) + [user_id]
     with _conn() as c:
         ensure_user(user_id)
-        c.execute(f"UPDATE user_state SET {cols} WHERE user_id = ?;", vals)
+        c.execute(f"UPDATE user_state SET {cols}, version = version + 1 WHERE user_id = ?;", vals)
+        c.commit()
+
+# ---------------------- Атомарные изменения без перезаписи фото ----------------------
+#
+# Кнопка настройки меняет одно поле. Вместо «прочитать всё → поменять →
+# записать всё» (с перезаписью многомегабайтного last_image_bytes и потерей
+# одного из двух одновременных нажатий) — один UPDATE, новое значение
+# считается в SQL, а RETURNING сразу отдаёт новые скалярные поля.
+
+# Допустимые диапазоны параметров-«ползунков»
+ADJUST_LIMITS: Dict[str, Tuple[float, float]] = {
+    "brightness": (0.1, 3.0),
+    "contrast": (0.1, 3.0),
+    "gamma": (0.2, 5.0),
+    "sharpness": (0.0, 5.0),
+    "blur_radius": (0.0, 2.0),
+}
+CYCLE_COLUMNS = ("dither", "dpi", "denoise_size", "out_format")
+TOGGLE_COLUMNS = ("invert",)
+SCALAR_COLUMNS = (
+    "brightness", "contrast", "gamma", "sharpness", "invert", "dither", "dpi",
+    "denoise_size", "blur_radius", "out_format",
+)
+
+_RETURNING = f"RETURNING {', '.join(SCALAR_COLUMNS)}, last_image_bytes IS NOT NULL, version"
+
+def _scalars(row: Optional[tuple]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    return {
+        "brightness": float(row[0]),
+        "contrast": float(row[1]),
+        "gamma": float(row[2]),
+        "sharpness": float(row[3]),
+        "invert": bool(row[4]),
+        "dither": str(row[5]),
+        "dpi": int(row[6]),
+        "denoise_size": int(row[7]),
+        "blur_radius": float(row[8]),
+        "out_format": (row[9] or "bmp"),
+        "has_image": bool(row[10]),
+        "version": int(row[11]),
+    }
+
+def _update_returning(sql_set: str, params: Sequence[Any], user_id: int, need_image: bool) -> Optional[Dict[str, Any]]:
+    where = "user_id = ? AND last_image_bytes IS NOT NULL" if need_image else "user_id = ?"
+    with _conn() as c:
+        row = c.execute(
+            f"UPDATE user_state SET {sql_set}, version = version + 1 WHERE {where} {_RETURNING};",
+            (*params, user_id),
+        ).fetchone()
+        c.commit()
+    return _scalars(row)
+
+def adjust(user_id: int, column: str, delta: float, need_image: bool = True) -> Optional[Dict[str, Any]]:
+    """Прибавить `delta` к параметру с ограничением `ADJUST_LIMITS` и округлением до сотых.
+
+    Возвращает новые скалярные поля (без фото, с `has_image` и `version`)
+    или None, если записи нет (или нет фото при `need_image`).
+    """
+    if column not in ADJUST_LIMITS:
+        raise ValueError(f"column {column!r} can not be adjusted")
+    lo, hi = ADJUST_LIMITS[column]
+    return _update_returning(f"{column} = round(max(?, min(?, {column} + ?)), 2)", (lo, hi, delta), user_id, need_image)
+
+def cycle(user_id: int, column: str, choices: Sequence[Any], fallback: Any,
+          need_image: bool = True) -> Optional[Dict[str, Any]]:
+    """Следующее значение из `choices` по кругу (`fallback` — если текущего среди них нет)."""
+    if column not in CYCLE_COLUMNS:
+        raise ValueError(f"column {column!r} can not be cycled")
+    nxt = list(choices[1:]) + [choices[0]]
+    case = f"CASE {column} {' '.join('WHEN ? THEN ?' for _ in choices)} ELSE ? END"
+    params = [v for pair in zip(choices, nxt) for v in pair] + [fallback]
+    return _update_returning(f"{column} = {case}", params, user_id, need_image)
+
+def toggle(user_id: int, column: str, need_image: bool = True) -> Optional[Dict[str, Any]]:
+    """Переключить флаг (0 ↔ 1)."""
+    if column not in TOGGLE_COLUMNS:
+        raise ValueError(f"column {column!r} can not be toggled")
+    return _update_returning(f"{column} = 1 - {column}", (), user_id, need_image)
+
+def set_scalars(user_id: int, **fields) -> Optional[Dict[str, Any]]:
+    """Записать скалярные поля (фото не трогается) и вернуть новое состояние."""
+    unknown = set(fields) - set(SCALAR_COLUMNS)
+    if unknown:
+        raise ValueError(f"not scalar state fields: {sorted(unknown)}")
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    return _update_returning(cols, list(fields.values()), user_id, need_image=False)
+
+def read_scalars(user_id: int) -> Optional[Dict[str, Any]]:
+    """Скалярные поля (как у `adjust`) без чтения фото или None, если записи нет."""
+    with _conn() as c:
+        row = c.execute(
+            f"SELECT {', '.join(SCALAR_COLUMNS)}, last_image_bytes IS NOT NULL, version "
+            "FROM user_state WHERE user_id = ?;", (user_id,),
+        ).fetchone()
+        return _scalars(row)
+
+def get_image(user_id: int) -> Optional[bytes]:
+    """Только фото пользователя (только чтение)."""
+    with _conn() as c:
+        row = c.execute("SELECT last_image_bytes FROM user_state WHERE user_id = ?;", (user_id,)).fetchone()
+        return row[0] if row else None
+
+# ---------------------- Сборка мусора фото ----------------------
+#
+# Фото хранится, пока пользователь с ним работает. `touch_image` отмечает
+# использование (не чаще `IMAGE_TOUCH_INTERVAL`, см. `app.db.aio_state`),
+# `evict_images` небольшими пачками удаляет фото, не использовавшиеся дольше
+# TTL, и самые давние сверх общего бюджета (LRU). Освобождённые страницы
+# возвращаются файлу шагами `vacuum_step` (auto_vacuum=INCREMENTAL), а WAL
+# переносится в БД пассивными чекпойнтами — всё это делает фоновое
+# обслуживание (`app.db.maintenance`), а не хендлеры.
+
+def touch_image(user_id: int, now: float) -> None:
+    """Отметить использование фото (версию не меняет — это не изменение состояния)."""
+    with _conn() as c:
+        c.execute(
+            "UPDATE user_state SET image_used_at = ? WHERE user_id = ? AND last_image_bytes IS NOT NULL;",
+            (now, user_id),
+        )
         c.commit()
+
+def evict_images(older_than: float, budget_bytes: int, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+    """Удалить до `limit` фото: не использовавшиеся с `older_than`, затем самые давние сверх бюджета.
+
+    `budget_bytes <= 0` — без бюджета. Возвращает `(user_id, новые скалярные поля)` удалённых.
+    """
+    with _conn() as c:
+        # Выбор и удаление — под одной блокировкой записи: фото, загруженное
+        # между ними, не должно попасть под удаление
+        c.execute("BEGIN IMMEDIATE;")
+        try:
+            victims = [r[0] for r in c.execute("""
+                SELECT user_id FROM user_state
+                 WHERE last_image_bytes IS NOT NULL AND image_used_at < ?
+                 ORDER BY image_used_at LIMIT ?;
+            """, (older_than, limit))]
+            if len(victims) < limit and budget_bytes > 0:
+                total = c.execute(
+                    "SELECT COALESCE(SUM(image_size), 0) FROM user_state WHERE last_image_bytes IS NOT NULL;"
+                ).fetchone()[0]
+                if total > budget_bytes:
+                    chosen = set(victims)
+                    for uid, size in c.execute("""
+                        SELECT user_id, image_size FROM user_state
+                         WHERE last_image_bytes IS NOT NULL
+                         ORDER BY image_used_at LIMIT ?;
+                    """, (limit,)).fetchall():
+                        if uid in chosen:
+                            total -= size  # уже удаляется по TTL — его объём тоже освободится
+                            continue
+                        if total <= budget_bytes or len(victims) >= limit:
+                            break
+                        victims.append(uid)
+                        total -= size
+            rows = []
+            if victims:
+                marks = ", ".join("?" for _ in victims)
+                rows = c.execute(f"""
+                    UPDATE user_state
+                       SET last_image_bytes = NULL, image_size = 0, version = version + 1
+                     WHERE user_id IN ({marks})
+                    RETURNING user_id, {', '.join(SCALAR_COLUMNS)}, last_image_bytes IS NOT NULL, version;
+                """, victims).fetchall()
+            c.commit()
+        except BaseException:
+            c.rollback()
+            raise
+    return [(row[0], _scalars(row[1:])) for row in rows]
+
+def vacuum_step(pages: int) -> int:
+    """Вернуть файлу до `pages` свободных страниц и перенести WAL в БД (PASSIVE — никого не ждёт).
+
+    Возвращает, сколько свободных страниц осталось.
+    """
+    global _WARNED_AUTO_VACUUM
+    with _conn() as c:
+        if c.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            # incremental_vacuum без INCREMENTAL ничего не делает — только чекпойнт
+            if not _WARNED_AUTO_VACUUM:
+                logger.warning("state DB is not in auto_vacuum=INCREMENTAL mode, freed pages stay in the file; "
+                               "run `python -m app.db.maintenance --convert` with the bot stopped")
+                _WARNED_AUTO_VACUUM = True
+            c.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchall()
+            return 0
+        if c.execute("PRAGMA freelist_count;").fetchone()[0]:
+            # PRAGMA incremental_vacuum освобождает по странице на шаг, а execute() у
+            # оператора без колонок делает только первый шаг — executescript доводит до конца
+            c.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        c.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchall()
+        return c.execute("PRAGMA freelist_count;").fetchone()[0]
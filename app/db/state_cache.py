@@ -0,0 +1,219 @@
+# app/db/state_cache.py
+"""
+Общий для всех воркеров хоста кеш скалярного состояния пользователей (без фото).
+
+Соседние нажатия одного пользователя попадают в разные процессы gunicorn,
+поэтому кеш в памяти процесса был бы несогласованным. Здесь кеш — таблица в
+POSIX shared memory (`/dev/shm/<STATE_CACHE_NAME>`), которую проецируют все
+воркеры:
+
+- таблица прямого отображения: `STATE_CACHE_SLOTS` слотов фиксированного
+  размера, пользователь попадает в слот по хешу id; коллизия просто вытесняет
+  прежнюю запись;
+- чтение без блокировок — seqlock: счётчик слота нечётный во время записи,
+  читатель повторяет чтение, если счётчик изменился или нечётный;
+- запись — под блокировкой диапазона байт слота (`fcntl.lockf`) между
+  процессами и `threading.Lock` внутри процесса;
+- записи версионированы (`user_state.version` растёт с каждым изменением):
+  `put` после записи в БД не затирает более новую версию, а `fill` после
+  чтения из БД кладёт запись, только если слот не менялся с момента промаха
+  (иначе прочитанное из БД могло уже устареть).
+
+Кеш общий только для воркеров одного хоста, поэтому включается лишь с
+бэкендом, данные которого видны одному хосту (`DB_BACKEND=sqlite`): с общим
+PostgreSQL изменения с других хостов сюда не попадали бы.
+
+Источник истины — БД: кеш заполняется сквозной записью (`app.db.aio_state`
+кладёт сюда результат каждого UPDATE … RETURNING) и при промахах. Мастер
+gunicorn сбрасывает таблицу при старте (`reset`), чтобы не доверять записям
+прошлого запуска.
+"""
+from __future__ import annotations
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import get_database_settings
+from app.db.backend import get_backend
+from app.utils.logger import logger
+
+SHM_DIR = "/dev/shm"
+MAGIC = 0x50535431  # "PST1"
+
+DITHERS = ("fs", "ordered", "none")
+OUT_FORMATS = ("bmp", "png", "tiff", "jpg", "gcode", "svg")
+
+_HEADER = struct.Struct("<II")  # magic, число слотов
+_HEADER_SIZE = 64
+_SEQ = struct.Struct("<I")
+# seq, user_id, version, brightness, contrast, gamma, sharpness, blur_radius,
+# dpi, invert, denoise_size, dither, out_format, has_image
+_SLOT = struct.Struct("<Iqq5diBBBBB")
+_STRIDE = 80
+_READ_RETRIES = 10_000
+
+
+def _slot_index(user_id: int, slots: int) -> int:
+    # Мультипликативное перемешивание: соседние id — в разные слоты
+    return ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % slots
+
+
+class StateCache:
+    def __init__(self, path: str, slots: int):
+        self.slots = slots
+        self._lock = threading.Lock()
+        size = _HEADER_SIZE + slots * _STRIDE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Кто первым открыл — размечает файл; остальные ждут на блокировке заголовка
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER_SIZE, 0)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, _HEADER.pack(MAGIC, slots), 0)
+            elif os.fstat(self._fd).st_size != size:
+                # Таблицу уже проецируют процессы с другим числом слотов — не трогаем
+                raise RuntimeError(f"state cache {path}: size mismatch, expected {size}")
+            magic, stored = _HEADER.unpack(os.pread(self._fd, _HEADER.size, 0))
+            if magic != MAGIC or stored != slots:
+                raise RuntimeError(f"state cache {path}: unexpected header {magic:#x}/{stored}")
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER_SIZE, 0)
+        self._mm = mmap.mmap(self._fd, size)
+
+    # ---------------------- Чтение ----------------------
+
+    def lookup(self, user_id: int) -> Tuple[Optional[Dict[str, Any]], int]:
+        """(состояние или None, метка слота для `fill` после промаха)."""
+        off = _HEADER_SIZE + _slot_index(user_id, self.slots) * _STRIDE
+        mm = self._mm
+        for _ in range(_READ_RETRIES):
+            seq = _SEQ.unpack_from(mm, off)[0]
+            if seq & 1:
+                continue  # слот пишется прямо сейчас
+            row = _SLOT.unpack_from(mm, off)
+            if _SEQ.unpack_from(mm, off)[0] == seq:
+                break
+        else:
+            # Писатель не закончил (или умер посреди записи) — считаем промахом, без `fill`
+            return None, -1
+        if row[1] != user_id:
+            return None, seq
+        return _decode(row), seq
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self.lookup(user_id)[0]
+
+    # ---------------------- Запись ----------------------
+
+    def put(self, user_id: int, rec: Dict[str, Any]) -> None:
+        """Сквозная запись после изменения в БД: более новую версию в слоте не затирает."""
+        self._write(user_id, rec, lambda row: row[1] == user_id and row[2] >= rec["version"])
+
+    def fill(self, user_id: int, rec: Dict[str, Any], seq: int) -> None:
+        """Заполнение после промаха: только если слот не менялся с `lookup`."""
+        self._write(user_id, rec, lambda row: row[0] != seq)
+
+    def invalidate(self, user_id: int) -> None:
+        """Убрать запись пользователя (состояние изменено без RETURNING).
+
+        Счётчик слота сдвигается всегда, даже если в слоте пусто или чужая
+        запись: иначе `fill` читателя, который промахнулся и прочитал БД до
+        этой записи, прошёл бы по старой метке и положил устаревшее состояние.
+        """
+        self._write(user_id, None, lambda row: False)
+
+    def _write(self, user_id: int, rec: Optional[Dict[str, Any]], skip) -> None:
+        packed = _encode(user_id, rec) if rec is not None else None
+        if rec is not None and packed is None:
+            self.invalidate(user_id)  # значение, которое не кодируется в слот
+            return
+        off = _HEADER_SIZE + _slot_index(user_id, self.slots) * _STRIDE
+        mm = self._mm
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, _STRIDE, off)
+            try:
+                row = _SLOT.unpack_from(mm, off)
+                if skip(row):
+                    return
+                # Нечётный счётчик — читатели ждут (`| 1`: и после писателя, умершего посреди записи)
+                seq = row[0] | 1
+                _SEQ.pack_into(mm, off, seq)
+                if packed is None and row[1] == user_id:
+                    _SLOT.pack_into(mm, off, seq, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+                elif packed is None:
+                    _SLOT.pack_into(mm, off, seq, *row[1:])  # чужую запись не трогаем — только счётчик
+                else:
+                    _SLOT.pack_into(mm, off, seq, *packed)
+                _SEQ.pack_into(mm, off, seq + 1)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, _STRIDE, off)
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+
+def _encode(user_id: int, rec: Dict[str, Any]) -> Optional[tuple]:
+    if rec["dither"] not in DITHERS or rec["out_format"] not in OUT_FORMATS:
+        return None
+    return (
+        user_id, rec["version"], rec["brightness"], rec["contrast"], rec["gamma"], rec["sharpness"],
+        rec["blur_radius"], rec["dpi"], int(rec["invert"]), rec["denoise_size"],
+        DITHERS.index(rec["dither"]), OUT_FORMATS.index(rec["out_format"]), int(rec["has_image"]),
+    )
+
+
+def _decode(row: tuple) -> Dict[str, Any]:
+    return {
+        "brightness": row[3],
+        "contrast": row[4],
+        "gamma": row[5],
+        "sharpness": row[6],
+        "invert": bool(row[9]),
+        "dither": DITHERS[row[11]],
+        "dpi": row[8],
+        "denoise_size": row[10],
+        "blur_radius": row[7],
+        "out_format": OUT_FORMATS[row[12]],
+        "has_image": bool(row[13]),
+        "version": row[2],
+    }
+
+
+_CACHE: Optional[StateCache] = None
+_PID: Optional[int] = None
+_DISABLED = False
+
+
+def _path() -> str:
+    return os.path.join(SHM_DIR, get_database_settings().STATE_CACHE_NAME)
+
+
+def get_cache() -> Optional[StateCache]:
+    """Кеш процесса или None, если выключен (`STATE_CACHE_SLOTS=0`, бэкенд не локальный) или недоступен."""
+    global _CACHE, _PID, _DISABLED
+    if _DISABLED:
+        return None
+    if _CACHE is None or _PID != os.getpid():
+        slots = get_database_settings().STATE_CACHE_SLOTS
+        if slots <= 0 or not get_backend().host_local:
+            _DISABLED = True
+            return None
+        try:
+            _CACHE, _PID = StateCache(_path(), slots), os.getpid()
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"state cache disabled: {e}")
+            _DISABLED = True
+            return None
+    return _CACHE
+
+
+def reset() -> None:
+    """Удалить таблицу (мастер gunicorn при старте): воркеры создадут чистую."""
+    try:
+        os.unlink(_path())
+    except FileNotFoundError:
+        pass
@@ -2,18 +2,17 @@
 from __future__ import annotations
 import sqlite3
 from pathlib import Path
-from typing import Literal, Optional
+from typing import Iterable, Literal, Optional, Tuple
+
+from app.db import connection
 
 _DB_PATH: Optional[Path] = None
 
 def _connect() -> sqlite3.Connection:
     if _DB_PATH is None:
         raise RuntimeError("stats DB is not initialized. Call stats_db.init(db_path) first.")
-    conn = sqlite3.connect(_DB_PATH.as_posix(), timeout=10, check_same_thread=False)
-    # Бонус к устойчивости при параллельных апдейтах
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    return conn
+    # Долгоживущее соединение потока: PRAGMA (WAL и пр.) выставлены при открытии
+    return connection.connect(_DB_PATH)
 
 def init(db_path: str) -> None:
     """Инициализирует файл БД и таблицу статистики."""
@@ -53,23 +52,52 @@ def record_output(user_id: int, delta: int = 1) -> None:
         _incr(conn, user_id, "outputs_count", delta)
         conn.commit()
 
+def apply_deltas(rows: Iterable[Tuple[int, int, int, float]]) -> None:
+    """Накопленные приращения `(user_id, outputs, settings_changes, last_seen_unix)` — одной транзакцией."""
+    with _connect() as conn:
+        conn.executemany("""
+            INSERT INTO user_stats (user_id, outputs_count, settings_changes_count, last_seen)
+            VALUES (?, ?, ?, datetime(?, 'unixepoch'))
+            ON CONFLICT(user_id) DO UPDATE
+               SET outputs_count = outputs_count + excluded.outputs_count,
+                   settings_changes_count = settings_changes_count + excluded.settings_changes_count,
+                   last_seen = MAX(last_seen, excluded.last_seen);
+        """, rows)
+        conn.commit()
+
 def record_setting_change(user_id: int, delta: int = 1) -> None:
     """Вызывать при любом изменении параметров/настройки."""
     with _connect() as conn:
         _incr(conn, user_id, "settings_changes_count", delta)
         conn.commit()
 
-def get_user_stats(user_id: int) -> dict:
+def ensure_user(user_id: int) -> None:
     with _connect() as conn:
         _ensure_user_row(conn, user_id)
+        conn.commit()
+
+def get_user_stats(user_id: int) -> dict:
+    ensure_user(user_id)
+    return read_user_stats(user_id)
+
+def read_user_stats(user_id: int) -> Optional[dict]:
+    """Статистика пользователя или None, если записи ещё нет (только чтение)."""
+    with _connect() as conn:
         cur = conn.execute("""
             SELECT outputs_count, settings_changes_count, first_seen, last_seen
               FROM user_stats WHERE user_id = ?;
         """, (user_id,))
         row = cur.fetchone()
+        if row is None:
+            return None
         return {
             "outputs_count": row[0],
             "settings_changes_count": row[1],
             "first_seen": row[2],
             "last_seen": row[3],
         }
+
+def checkpoint() -> None:
+    """Перенести WAL в БД, никого не ожидая (фоновое обслуживание, `app.db.maintenance`)."""
+    with _connect() as conn:
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchall()
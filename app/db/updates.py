@@ -0,0 +1,58 @@
+# app/db/updates.py
+"""
+Принятые апдейты Telegram (по `update_id`) — защита от повторной обработки.
+
+Пока финал рендерится, Telegram может не дождаться ответа и доставить тот же
+апдейт ещё раз — и он попадёт в другой веб-воркер. Перед обработкой апдейт
+«забирается» (`claim`): INSERT по первичному ключу `update_id` удаётся
+только одному воркеру, повтор получает False. Записи старше TTL удаляет
+фоновое обслуживание (`purge`).
+"""
+from __future__ import annotations
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+from app.db import connection
+
+_DB: Optional[Path] = None
+
+def _conn() -> sqlite3.Connection:
+    if _DB is None:
+        raise RuntimeError("updates DB is not initialized. Call updates_db.init(path) first.")
+    return connection.connect(_DB)
+
+def init(db_path: str) -> None:
+    """Инициализация таблицы принятых апдейтов."""
+    global _DB
+    _DB = Path(db_path)
+    _DB.parent.mkdir(parents=True, exist_ok=True)
+    with _conn() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS seen_updates (
+            update_id INTEGER PRIMARY KEY,
+            seen_at   REAL NOT NULL
+        );
+        """)
+        c.commit()
+
+def claim(update_id: int, now: float) -> bool:
+    """Атомарно забрать апдейт на обработку: True только при первой доставке."""
+    with _conn() as c:
+        cur = c.execute("INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?);",
+                        (update_id, now))
+        c.commit()
+        return cur.rowcount == 1
+
+def release(update_id: int) -> None:
+    """Вернуть апдейт (обработка не начиналась — повторная доставка должна пройти)."""
+    with _conn() as c:
+        c.execute("DELETE FROM seen_updates WHERE update_id = ?;", (update_id,))
+        c.commit()
+
+def purge(older_than: float) -> int:
+    """Удалить записи, принятые раньше `older_than`; сколько удалено."""
+    with _conn() as c:
+        cur = c.execute("DELETE FROM seen_updates WHERE seen_at < ?;", (older_than,))
+        c.commit()
+        return cur.rowcount
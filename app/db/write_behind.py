@@ -0,0 +1,119 @@
+# app/db/write_behind.py
+"""
+Отложенная запись (write-behind) в БД: общий буфер статистики
+(`app.db.aio_stats`) и журнала использования (`app.db.aio_events`).
+
+Записи копятся в памяти процесса (`add`) и уходят в БД одной пачкой — раз в
+`interval()` секунд или сразу, как только их набралось `size()`. Что именно
+копится и как пишется, задают функции модуля-владельца:
+
+- `empty()` — пустой буфер (словарь, список, …);
+- `merge(batch, pending)` — вернуть неудачно записанную пачку в буфер, где
+  за время записи появились новые записи (результат — новый буфер);
+- `apply(batch)` / `apply_sync(batch)` — запись пачки в БД из event loop и
+  без него (`atexit`).
+
+- Сброс идёт под `lock`: кто читает БД вместе с несброшенным (`pending`),
+  делает это под ним же — пачка видна либо в буфере, либо в БД, не в обоих.
+- Неудачная пачка возвращается в буфер, и сброс повторяется только по
+  таймеру с паузой, растущей вдвое до `MAX_RETRY_DELAY`: новые записи при
+  полном буфере не запускают сброс за сбросом.
+"""
+from __future__ import annotations
+import asyncio
+from typing import Awaitable, Callable, Generic, Optional, Set, Sized, TypeVar
+
+from app.utils.logger import logger
+
+B = TypeVar("B", bound=Sized)
+
+MAX_RETRY_DELAY = 60.0  # сек — предел паузы между повторами неудачного сброса
+
+
+class WriteBehindBuffer(Generic[B]):
+    def __init__(self, name: str,
+                 empty: Callable[[], B],
+                 merge: Callable[[B, B], B],
+                 apply: Callable[[B], Awaitable[None]],
+                 apply_sync: Callable[[B], None],
+                 interval: Callable[[], float],
+                 size: Callable[[], int]) -> None:
+        self.name = name
+        self._empty = empty
+        self._merge = merge
+        self._apply = apply
+        self._apply_sync = apply_sync
+        self._interval = interval
+        self._size = size
+        self._pending: B = empty()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._failures = 0  # неудачных сбросов подряд
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """Держится на время сброса: под ним БД и буфер согласованы (создаётся в event loop)."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def pending(self) -> B:
+        """Ещё не сброшенное (читать вместе с БД — под `lock`)."""
+        return self._pending
+
+    def add(self, put: Callable[[B], None]) -> None:
+        """`put(pending)` добавляет запись в буфер; вызывать из event loop."""
+        put(self._pending)
+        # Пока идёт сброс или после неудачного — только по таймеру (без лавины сбросов)
+        if len(self._pending) >= self._size() and not self.lock.locked() and not self._failures:
+            self._spawn()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._delay(), self._spawn)
+
+    def _delay(self) -> float:
+        interval = self._interval()
+        return min(interval * 2 ** self._failures, max(interval, MAX_RETRY_DELAY))
+
+    def _spawn(self) -> None:
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take(self) -> B:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, self._empty()
+        return batch
+
+    async def flush(self) -> None:
+        async with self.lock:
+            batch = self._take()
+            if not batch:
+                return
+            try:
+                await self._apply(batch)
+            except Exception as e:
+                # Не теряем: вернём в буфер и повторим по таймеру с растущей паузой
+                self._failures += 1
+                self._pending = self._merge(batch, self._pending)
+                logger.error(f"{self.name} flush failed ({len(batch)} pending, "
+                             f"retry in {self._delay():.0f}s): {e}")
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self._delay(), self._spawn)
+            else:
+                self._failures = 0
+
+    async def close(self) -> None:
+        """Дождаться начатых сбросов и сбросить остаток."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+    def flush_sync(self) -> None:
+        """Сброс без event loop (atexit)."""
+        batch = self._take()
+        if batch:
+            self._apply_sync(batch)
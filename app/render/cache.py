@@ -0,0 +1,168 @@
+# app/render/cache.py
+"""
+Кеш декодированных оригиналов в разделяемой памяти.
+
+Пользователь жмёт кнопки по одному и тому же фото, и каждый раз оригинал
+заново декодировался бы из JPEG/PNG. Здесь декодированное изображение (режим L)
+лежит в сегменте shared memory и отдаётся воркерам пула как `ImageHandle`:
+они открывают его без копирования.
+
+Ключ — дайджест исходных байтов. Объём ограничен бюджетом, вытесняется самый
+давно использованный элемент, но только если на него нет активных аренд.
+
+`PreviewCache` — кеш уже закодированных превью в веб-воркере: смена DPI или
+формата файла, возврат к прежним настройкам и повторные нажатия дают то же
+превью, его не нужно ни рендерить, ни (если известен `file_id` Telegram)
+загружать заново.
+"""
+from __future__ import annotations
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from app.render.shm import ImageHandle, SegmentArena
+
+if TYPE_CHECKING:
+    from app.render.pipeline import ProcState
+
+
+def digest(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def preview_key(source_key: str, st: "ProcState") -> str:
+    """Ключ превью: оригинал + параметры, от которых превью зависит (DPI и формат файла — нет)."""
+    return (
+        f"{source_key}:{st.brightness}:{st.contrast}:{st.gamma}:{st.sharpness}:{int(st.invert)}"
+        f":{st.dither}:{st.denoise_size}:{st.blur_radius}"
+    )
+
+
+@dataclass
+class _Entry:
+    handle: ImageHandle
+    nbytes: int
+    leases: int = 0
+
+
+class DecodedCache:
+    def __init__(self, arena: SegmentArena, budget_bytes: int):
+        self.arena = arena
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._used = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    def acquire(self, key: str) -> Optional[ImageHandle]:
+        """Взять изображение из кеша на время задачи (без вытеснения до `release`)."""
+        entry = self._entries.get(key)
+        if entry is None or not self.arena.has(entry.handle.name):
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        entry.leases += 1
+        self.hits += 1
+        return entry.handle
+
+    def release(self, key: str) -> None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.leases = max(0, entry.leases - 1)
+
+    def put(self, key: str, handle: ImageHandle, nbytes: int) -> ImageHandle:
+        """Добавить (уже принятый ареной) сегмент и сразу арендовать его."""
+        self._entries[key] = _Entry(handle, nbytes, leases=1)
+        self._used += nbytes
+        self._evict()
+        return handle
+
+    def _evict(self) -> None:
+        for key in list(self._entries):
+            if self._used <= self.budget_bytes:
+                break
+            if self._entries[key].leases == 0:
+                self._drop(key)
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._used -= entry.nbytes
+        self.arena.release(entry.handle.name)
+
+    def clear(self) -> None:
+        for key in list(self._entries):
+            self._drop(key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._used,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+@dataclass
+class Preview:
+    key: str
+    data: bytes
+    filename: str
+    file_id: Optional[str] = None  # file_id фото в Telegram после первой отправки
+
+
+class PreviewCache:
+    """LRU закодированных превью с бюджетом по байтам."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, Preview]" = OrderedDict()
+        self._used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Preview]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, preview: Preview) -> Preview:
+        if self.budget_bytes <= 0 or len(preview.data) > self.budget_bytes:
+            return preview
+        old = self._entries.pop(preview.key, None)
+        if old is not None:
+            self._used -= len(old.data)
+        self._entries[preview.key] = preview
+        self._used += len(preview.data)
+        while self._used > self.budget_bytes:
+            _, entry = self._entries.popitem(last=False)
+            self._used -= len(entry.data)
+        return preview
+
+    def set_file_id(self, key: str, file_id: Optional[str]) -> None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.file_id = file_id
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._used = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._used,
+            "hits": self.hits,
+            "misses": self.misses,
+            "file_ids": sum(1 for e in self._entries.values() if e.file_id),
+        }
@@ -0,0 +1,130 @@
+# app/render/daemon.py
+"""
+Демон рендеринга: один долгоживущий процесс на хост.
+
+gunicorn поднимает `cpu_count()*2+1` uvicorn-воркеров; если каждый держит свой
+пул процессов, ядра переподписаны в разы, а кеши дублируются. Демон владеет
+единственным пулом по числу ядер, общей очередью и кешем декодированных
+оригиналов; веб-воркеры (`RENDER_MODE=daemon`) шлют ему запросы по Unix-сокету
+(`app.render.protocol`).
+
+Запуск: `python -m app.render.daemon` (gunicorn делает это сам в `on_starting`,
+если `RENDER_DAEMON_SPAWN=true`).
+"""
+from __future__ import annotations
+import asyncio
+import os
+import signal
+from pathlib import Path
+from typing import Any, Dict, Set, Tuple
+
+from app.core.config import get_render_settings
+from app.render import protocol
+from app.render.pool import RenderError
+from app.render.protocol import Frame, Op
+from app.render.service import LocalRenderer, get_local_renderer
+from app.utils.logger import logger
+
+
+class RenderDaemon:
+    def __init__(self, renderer: LocalRenderer, path: str):
+        self.renderer = renderer
+        self.path = path
+        self._server: asyncio.AbstractServer | None = None
+        self._clients: Set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        sock = Path(self.path)
+        sock.parent.mkdir(parents=True, exist_ok=True)
+        if sock.exists():
+            sock.unlink()  # сокет от предыдущего запуска
+        self._server = await asyncio.start_unix_server(self._on_client, path=self.path)
+        os.chmod(self.path, 0o660)
+        logger.info(f"🖼 Демон рендеринга слушает {self.path} (pid {os.getpid()}, {self.renderer.pool.workers} процессов)")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # До Python 3.12 close() не трогает открытые соединения — клиенты должны
+            # сразу увидеть, что демона нет, и перейти на запасной пул
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+        self.renderer.shutdown()
+        Path(self.path).unlink(missing_ok=True)
+        logger.info("🖼 Демон рендеринга остановлен")
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        lock = asyncio.Lock()  # ответы параллельных запросов не должны перемешиваться
+        tasks: Set[asyncio.Task] = set()
+        self._clients.add(writer)
+        try:
+            while True:
+                frame = await protocol.read_frame(reader)
+                task = asyncio.create_task(self._dispatch(frame, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # клиент закрыл соединение
+        except protocol.ProtocolError as e:
+            logger.error(f"🖼 Некорректный кадр от клиента: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, frame: Frame, writer: asyncio.StreamWriter, lock: asyncio.Lock) -> None:
+        try:
+            meta, payload = await self._handle(frame)
+            out = protocol.encode(Op.OK, frame.request_id, meta, payload)
+        except RenderError as e:
+            out = protocol.encode(Op.ERROR, frame.request_id, {"error": type(e).__name__, "message": str(e)})
+        except Exception as e:
+            logger.error(f"🖼 Ошибка обработки запроса {frame.op.name}: {e}", exc_info=True)
+            out = protocol.encode(Op.ERROR, frame.request_id, {"error": "RenderError", "message": str(e)})
+        async with lock:
+            writer.writelines(out)
+            await writer.drain()
+
+    async def _handle(self, frame: Frame) -> Tuple[Dict[str, Any], bytes]:
+        if frame.op == Op.PING:
+            return {"pid": os.getpid()}, b""
+        if frame.op == Op.STATS:
+            return self.renderer.stats(), b""
+
+        meta = frame.meta
+        st = protocol.state_from_meta(meta["st"])
+        src = protocol.handle_from_meta(meta.get("src")) or frame.payload
+        # Большой финал клиент просит писать сразу во временный файл (хост тот же)
+        out = meta.get("path") or protocol.handle_from_meta(meta.get("out"))
+        extra: Dict[str, Any] = {}
+        if frame.op == Op.PREVIEW:
+            res, extra["filename"] = await self.renderer.run_preview(src, meta.get("key"), st, out)
+        elif frame.op == Op.FINAL:
+            res, extra["filename"] = await self.renderer.run_final(src, meta.get("key"), st, meta["size"], out)
+        elif frame.op == Op.EXPORT:
+            res, extra["filename"] = await self.renderer.run_export(src, meta.get("key"), st, out)
+        elif frame.op == Op.POSTER:
+            spec = protocol.poster_from_meta(meta["poster"])
+            res, extra["filename"] = await self.renderer.run_poster(src, meta.get("key"), st, spec, out)
+        else:
+            raise RenderError(f"unsupported op {frame.op!r}")
+        if isinstance(res, int):
+            return {"written": res, **extra}, b""
+        return extra, res
+
+
+async def main() -> None:
+    daemon = RenderDaemon(get_local_renderer(), get_render_settings().RENDER_SOCKET_PATH)
+    await daemon.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    await daemon.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
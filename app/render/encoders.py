@@ -0,0 +1,314 @@
+# app/render/encoders.py
+"""
+Кодировщики 1-бит листа: BMP, PNG и TIFF, потоково по горизонтальным полосам.
+
+Одни и те же кодировщики используются и полосовым рендером (`app.render.strips`),
+и обычным — тогда весь лист режется на полосы уже после дизеринга, и байты
+результата не зависят от того, каким путём он собран.
+
+- BMP — без сжатия, байт в байт как у Pillow;
+- PNG — фильтр строк и стратегия zlib под двухуровневые данные
+  (`RENDER_PNG_LEVEL`, `RENDER_PNG_FILTER`, `RENDER_PNG_STRATEGY`);
+- TIFF — сжатие по полосам (strip TIFF): CCITT Group 4 для штриховых
+  изображений и Deflate для дизеринга, где G4 раздувает файл
+  (`RENDER_TIFF_COMPRESSION`).
+
+`auto` выбирает вариант по типу дизеринга — см. `scripts/bench/encoders.py`.
+
+Превью для Telegram кодируется отдельно (`encode_preview`): из нескольких
+кандидатов (1-бит PNG, JPEG) в пределах бюджета времени берётся самый
+маленький.
+
+Выходной файл должен поддерживать seek (BMP пишется снизу вверх, у TIFF
+смещение IFD дописывается в заголовок в конце).
+"""
+from __future__ import annotations
+import io
+import os
+import struct
+import time
+import zlib
+from typing import BinaryIO, List, Literal, Optional, Protocol, Tuple
+
+from PIL import Image, ImageChops
+
+PngFilter = Literal["none", "up", "adaptive"]
+PngStrategy = Literal["auto", "default", "filtered", "rle"]
+TiffCompression = Literal["auto", "group4", "deflate", "raw"]
+
+PNG_LEVEL = int(os.getenv("RENDER_PNG_LEVEL", 6))
+PNG_FILTER: PngFilter = os.getenv("RENDER_PNG_FILTER", "none")  # type: ignore[assignment]
+PNG_STRATEGY: PngStrategy = os.getenv("RENDER_PNG_STRATEGY", "auto")  # type: ignore[assignment]
+TIFF_COMPRESSION: TiffCompression = os.getenv("RENDER_TIFF_COMPRESSION", "auto")  # type: ignore[assignment]
+# Высота полосы: и шаг полосового рендера, и RowsPerStrip у TIFF
+STRIP_ROWS = int(os.getenv("RENDER_STRIP_ROWS", 512))
+
+# Превью: кандидаты по порядку, бюджет времени на кодирование и качество JPEG
+PREVIEW_FORMATS = [f.strip() for f in os.getenv("RENDER_PREVIEW_FORMATS", "png,jpg").split(",") if f.strip()]
+PREVIEW_ENCODE_MS = float(os.getenv("RENDER_PREVIEW_ENCODE_MS", 25))
+PREVIEW_JPEG_QUALITY = int(os.getenv("RENDER_PREVIEW_JPEG_QUALITY", 75))
+# JPEG двухуровневой картинки не бывает меньше ~0.25 бит/пиксель — если PNG уже
+# меньше, JPEG не кодируем вовсе
+PREVIEW_JPEG_MIN_BPP = 0.25
+
+_STRATEGIES = {"default": zlib.Z_DEFAULT_STRATEGY, "filtered": zlib.Z_FILTERED, "rle": zlib.Z_RLE}
+
+
+def png_strategy(dither: str, strategy: PngStrategy = PNG_STRATEGY) -> int:
+    """Стратегия zlib: у упорядоченного дизеринга узор периодический — выигрывает поиск
+    совпадений; у Floyd–Steinberg и порога — RLE: почти тот же размер в 10–30 раз быстрее."""
+    if strategy == "auto":
+        strategy = "default" if dither == "ordered" else "rle"
+    return _STRATEGIES[strategy]
+
+
+def tiff_compression(dither: str, compression: TiffCompression = TIFF_COMPRESSION) -> TiffCompression:
+    """G4 сжимает длинные серии, а у дизеринга они в пиксель-два — там он больше несжатого файла."""
+    if compression == "auto":
+        return "group4" if dither == "none" else "deflate"
+    return compression
+
+
+class SheetWriter(Protocol):
+    def write(self, band: Image.Image, y0: int) -> None: ...
+    def close(self) -> None: ...
+
+
+class BmpWriter:
+    """BMP 1-бит, байт в байт как у Pillow; строки хранятся снизу вверх — пишем по смещениям."""
+
+    def __init__(self, fp: BinaryIO, width: int, height: int, dpi: int):
+        self.fp = fp
+        self.height = height
+        self.stride = ((width + 7) // 8 + 3) & ~3
+        ppm = int(dpi * 39.3701 + 0.5)
+        image = self.stride * height
+        offset = 14 + 40 + 2 * 4
+        self.data = fp.tell() + offset
+        fp.write(
+            b"BM" + struct.pack("<IiI", offset + image, 0, offset)
+            + struct.pack("<IiiHHIIiiII", 40, width, height, 1, 1, 0, image, ppm, ppm, 2, 2)
+            + b"\x00\x00\x00\x00\xff\xff\xff\x00"
+        )
+
+    def write(self, band: Image.Image, y0: int) -> None:
+        self.fp.seek(self.data + (self.height - y0 - band.height) * self.stride)
+        self.fp.write(band.tobytes("raw", "1", self.stride, -1))
+
+    def close(self) -> None:
+        self.fp.seek(self.data + self.height * self.stride)
+
+
+class PngWriter:
+    """PNG 1-бит: IDAT-чанки из одного потока zlib.
+
+    Фильтры строк считаются над упакованными байтами как над изображением 'L'
+    (ширина = байт в строке) — вычитание по модулю 256 делает Pillow в C.
+    `adaptive` выбирает для каждой полосы фильтр с меньшей суммой |байт|
+    (эвристика из спецификации PNG, по гистограмме).
+    """
+
+    def __init__(self, fp: BinaryIO, width: int, height: int, dpi: int,
+                 level: int = PNG_LEVEL, strategy: int = zlib.Z_DEFAULT_STRATEGY, row_filter: PngFilter = PNG_FILTER):
+        self.fp = fp
+        self.row_bytes = (width + 7) // 8
+        self.row_filter = row_filter
+        self.z = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+        self._last_row: Optional[Image.Image] = None  # последняя строка предыдущей полосы (для Up)
+        ppm = int(dpi / 0.0254 + 0.5)
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0))
+        self._chunk(b"pHYs", struct.pack(">IIB", ppm, ppm, 1))
+
+    def _chunk(self, tag: bytes, data: bytes) -> None:
+        self.fp.write(struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def _up(self, packed: Image.Image) -> Image.Image:
+        prev = Image.new("L", packed.size)
+        if self._last_row is not None:
+            prev.paste(self._last_row, (0, 0))
+        prev.paste(packed.crop((0, 0, packed.width, packed.height - 1)), (0, 1))
+        return ImageChops.subtract_modulo(packed, prev)
+
+    def write(self, band: Image.Image, y0: int) -> None:
+        n = self.row_bytes
+        packed = Image.frombytes("L", (n, band.height), band.tobytes())
+        tag, data = b"\x00", packed
+        if self.row_filter in ("up", "adaptive"):
+            up = self._up(packed)
+            if self.row_filter == "up" or _cost(up) < _cost(packed):
+                tag, data = b"\x02", up
+        self._last_row = packed.crop((0, packed.height - 1, n, packed.height))
+        raw = data.tobytes()
+        rows = b"".join(tag + raw[i:i + n] for i in range(0, len(raw), n))
+        out = self.z.compress(rows)
+        if out:
+            self._chunk(b"IDAT", out)
+
+    def close(self) -> None:
+        self._chunk(b"IDAT", self.z.flush())
+        self._chunk(b"IEND", b"")
+
+
+def _cost(img: Image.Image) -> int:
+    # Сумма |байт| при трактовке байта как знакового — чем меньше, тем лучше сожмётся
+    hist = img.histogram()
+    return sum(hist[v] * min(v, 256 - v) for v in range(256))
+
+
+class TiffWriter:
+    """TIFF 1-бит; полоса листа = strip TIFF, каждая сжата независимо.
+
+    Размер сжатых полос заранее неизвестен, поэтому IFD страницы пишется после
+    её полос, а его смещение — в заголовок файла (или в IFD предыдущей страницы:
+    `next_page` начинает следующую страницу многостраничного файла).
+    Полосы можно сжать заранее в других потоках (`encode`) и записать готовыми
+    (`write_encoded`).
+    """
+
+    _CODES = {"raw": 1, "group4": 4, "deflate": 8}
+
+    def __init__(self, fp: BinaryIO, width: int, height: int, dpi: int, rows_per_strip: int,
+                 compression: TiffCompression = "deflate", level: int = PNG_LEVEL, strategy: int = zlib.Z_DEFAULT_STRATEGY):
+        self.fp = fp
+        self.width, self.height, self.dpi = width, height, dpi
+        self.rows_per_strip = rows_per_strip
+        self.compression = compression
+        self.level, self.strategy = level, strategy
+        self.photometric = 1  # BlackIsZero: бит 1 — белый, как в режиме '1'
+        self.start = fp.tell()
+        self.offsets: List[int] = []
+        self.counts: List[int] = []
+        self._link = self.start + 4  # куда записать смещение IFD текущей страницы
+        fp.write(b"II*\x00\x00\x00\x00\x00")  # смещение IFD — в close()
+
+    def encode(self, band: Image.Image) -> bytes:
+        if self.compression == "deflate":
+            z = zlib.compressobj(self.level, zlib.DEFLATED, 15, 9, self.strategy)
+            return z.compress(band.tobytes()) + z.flush()
+        if self.compression == "group4":
+            # Кодер G4 есть только в libtiff: кодируем полосу отдельным TIFF из одной strip
+            bio = io.BytesIO()
+            band.save(bio, format="TIFF", compression="group4", tiffinfo={278: band.height})
+            with Image.open(bio) as mini:
+                offset, count = mini.tag_v2[273][0], mini.tag_v2[279][0]
+                self.photometric = mini.tag_v2.get(262, self.photometric)
+            return bio.getbuffer()[offset:offset + count].tobytes()
+        return band.tobytes()
+
+    def write(self, band: Image.Image, y0: int) -> None:
+        # Полосы приходят по порядку, высотой rows_per_strip (последняя — может быть ниже)
+        self.write_encoded(self.encode(band))
+
+    def write_encoded(self, data: bytes) -> None:
+        self.offsets.append(self.fp.tell() - self.start)
+        self.counts.append(len(data))
+        self.fp.write(data)
+
+    def next_page(self, width: int, height: int) -> None:
+        """Закончить страницу и начать следующую размером `width`×`height`."""
+        self._write_ifd()
+        self.width, self.height = width, height
+        self.offsets, self.counts = [], []
+
+    def close(self) -> None:
+        self._write_ifd()
+
+    def _write_ifd(self) -> None:
+        fp = self.fp
+        if (fp.tell() - self.start) % 2:
+            fp.write(b"\x00")  # IFD по чётному смещению
+        ifd = fp.tell() - self.start
+        n = len(self.offsets)
+        tags = 12
+        xres = ifd + 2 + tags * 12 + 4
+        offsets_at = xres + 16
+        counts_at = offsets_at + 4 * n
+
+        def entry(tag: int, typ: int, count: int, value: int) -> bytes:
+            if typ == 3 and count == 1:
+                return struct.pack("<HHIHH", tag, typ, count, value, 0)
+            return struct.pack("<HHII", tag, typ, count, value)
+
+        fp.write(b"".join([
+            struct.pack("<H", tags),
+            entry(256, 4, 1, self.width),
+            entry(257, 4, 1, self.height),
+            entry(258, 3, 1, 1),                                          # BitsPerSample
+            entry(259, 3, 1, self._CODES[self.compression]),              # Compression
+            entry(262, 3, 1, self.photometric),
+            entry(273, 4, n, self.offsets[0] if n == 1 else offsets_at),  # StripOffsets
+            entry(277, 3, 1, 1),                                          # SamplesPerPixel
+            entry(278, 4, 1, self.rows_per_strip),
+            entry(279, 4, n, self.counts[0] if n == 1 else counts_at),    # StripByteCounts
+            entry(282, 5, 1, xres),
+            entry(283, 5, 1, xres + 8),
+            entry(296, 3, 1, 2),                                          # дюймы
+            struct.pack("<I", 0),                                         # следующей страницы нет
+            struct.pack("<IIII", self.dpi, 1, self.dpi, 1),
+            struct.pack(f"<{n}I", *self.offsets),
+            struct.pack(f"<{n}I", *self.counts),
+        ]))
+        end = fp.tell()
+        fp.seek(self._link)
+        fp.write(struct.pack("<I", ifd))
+        fp.seek(end)
+        self._link = self.start + xres - 4
+
+
+STREAM_FORMATS = ("bmp", "png", "tiff")
+
+
+def open_writer(fmt: str, fp: BinaryIO, width: int, height: int, dpi: int, rows_per_strip: int, dither: str) -> SheetWriter:
+    if fmt == "bmp":
+        return BmpWriter(fp, width, height, dpi)
+    if fmt == "png":
+        return PngWriter(fp, width, height, dpi, strategy=png_strategy(dither))
+    if fmt == "tiff":
+        return TiffWriter(fp, width, height, dpi, rows_per_strip, tiff_compression(dither), strategy=png_strategy(dither))
+    raise ValueError(f"unsupported streaming format: {fmt}")
+
+
+def encode_sheet(bw: Image.Image, fmt: str, fp: BinaryIO, dpi: int, dither: str, rows_per_strip: int = STRIP_ROWS) -> None:
+    """Закодировать готовый 1-бит лист теми же кодировщиками, нарезая его на полосы."""
+    writer = open_writer(fmt, fp, bw.width, bw.height, dpi, rows_per_strip, dither)
+    for y0 in range(0, bw.height, rows_per_strip):
+        writer.write(bw.crop((0, y0, bw.width, min(bw.height, y0 + rows_per_strip))), y0)
+    writer.close()
+
+
+def _preview_candidate(bw: Image.Image, fmt: str, dither: str) -> bytes:
+    bio = io.BytesIO()
+    if fmt == "png":
+        writer = PngWriter(bio, bw.width, bw.height, 72, strategy=png_strategy(dither))
+        writer.write(bw, 0)
+        writer.close()
+    elif fmt == "jpg":
+        bw.convert("L").save(bio, format="JPEG", quality=PREVIEW_JPEG_QUALITY, optimize=True)
+    else:
+        raise ValueError(f"unsupported preview format: {fmt}")
+    return bio.getvalue()
+
+
+def encode_preview(bw: Image.Image, fp: BinaryIO, dither: str) -> str:
+    """Записать в `fp` самое компактное превью из `PREVIEW_FORMATS`, вернуть его расширение.
+
+    Первый кандидат кодируется всегда, следующие — пока не исчерпан бюджет
+    `PREVIEW_ENCODE_MS`. Для дизеринга 1-бит PNG обычно в десятки раз меньше
+    JPEG (и без артефактов), но выбор делается по факту для каждого изображения.
+    """
+    best: Optional[Tuple[str, bytes]] = None
+    start = time.perf_counter()
+    for fmt in PREVIEW_FORMATS:
+        if best is not None:
+            if (time.perf_counter() - start) * 1000 >= PREVIEW_ENCODE_MS:
+                break
+            if fmt == "jpg" and len(best[1]) * 8 <= bw.width * bw.height * PREVIEW_JPEG_MIN_BPP:
+                continue
+        data = _preview_candidate(bw, fmt, dither)
+        if best is None or len(data) < len(best[1]):
+            best = (fmt, data)
+    if best is None:
+        raise ValueError("RENDER_PREVIEW_FORMATS is empty")
+    fp.write(best[1])
+    return best[0]
@@ -0,0 +1,96 @@
+# app/render/export.py
+"""
+Экспорт всех листов одним архивом.
+
+Отдельные финалы A4 и A3 (и каждый формат) — это отдельные прогоны
+`adjust_image_base` по одному и тому же оригиналу. Здесь обработанный
+оригинал считается один раз; обрезка, масштабирование и дизеринг — один раз
+на размер листа (размеры параллельно, в пуле потоков), и один и тот же 1-бит
+лист кодируется во все форматы `EXPORT_FORMATS`. Результат — ZIP.
+
+Файлы в архиве байт в байт совпадают с отдельными финалами тех же настроек
+(большие листы собираются полосами так же, как в `app.render.strips`).
+"""
+from __future__ import annotations
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from dataclasses import replace
+from typing import BinaryIO, List, Literal, Tuple
+
+from PIL import Image
+
+from app.render.encoders import STREAM_FORMATS, STRIP_ROWS, open_writer
+from app.render.parallel import ordered_map
+from app.render.pipeline import (ProcState, a_series_pixels, adjust_image_base, encode_final, final_capacity,
+                                 final_filename, final_sheet)
+from app.render.sheet_pool import get_sheet_pool
+from app.render.strips import STRIP_MIN_PIXELS, sheet_bands
+
+EXPORT_SIZES: Tuple[Literal["A4", "A3"], ...] = ("A4", "A3")
+# JPEG — 8-бит копия того же листа, в разы больше; в экспорт по умолчанию не входит
+EXPORT_FORMATS = [f.strip() for f in os.getenv("RENDER_EXPORT_FORMATS", "bmp,png,tiff").split(",") if f.strip()]
+# Файлы листов до упаковки в архив — в памяти, крупнее — на диске
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+# Сжатые форматы в архиве хранятся как есть, BMP — жмётся
+_ZIP_COMPRESSION = {"bmp": zipfile.ZIP_DEFLATED}
+
+Member = Tuple[str, BinaryIO]
+
+
+def export_filename(st: ProcState) -> str:
+    return f"pyro_export_{st.dpi}dpi.zip"
+
+
+def export_capacity(st: ProcState) -> int:
+    """Верхняя оценка размера архива (для выходного буфера)."""
+    return sum(
+        final_capacity(replace(st, out_format=fmt), size) for size in EXPORT_SIZES for fmt in EXPORT_FORMATS
+    )
+
+
+def _spool() -> BinaryIO:
+    return tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+
+
+def _export_size(img: Image.Image, base: Image.Image, st: ProcState, size: Literal["A4", "A3"]) -> List[Member]:
+    pool = get_sheet_pool()
+    members = [(final_filename(replace(st, out_format=fmt), size), _spool()) for fmt in EXPORT_FORMATS]
+    w, h = a_series_pixels(size, st.dpi)
+    if w * h >= STRIP_MIN_PIXELS and STRIP_ROWS > 0 and all(f in STREAM_FORMATS for f in EXPORT_FORMATS):
+        # Большой лист — полосами, каждая полоса сразу во все форматы
+        (tw, th), bands = sheet_bands(img, st, size, base)
+        writers = [open_writer(fmt, fp, tw, th, st.dpi, STRIP_ROWS, st.dither)
+                   for fmt, (_, fp) in zip(EXPORT_FORMATS, members)]
+        for oy0, bw in bands:
+            for writer in writers:
+                writer.write(bw, oy0)
+            pool.release(bw)
+        for writer in writers:
+            writer.close()
+    else:
+        fitted, bw = final_sheet(base, st, size)
+        for fmt, (_, fp) in zip(EXPORT_FORMATS, members):
+            pool.release(encode_final(bw, fmt, st, fp))
+        pool.release(fitted, bw)
+    return members
+
+
+def build_export_to(img: Image.Image, st: ProcState, fp: BinaryIO) -> str:
+    """Собрать все листы (`EXPORT_SIZES` × `EXPORT_FORMATS`) в ZIP и записать в `fp`. Возвращает имя файла."""
+    base = adjust_image_base(img, st)  # один раз на все листы
+    stamp = time.localtime()[:6]
+    with zipfile.ZipFile(fp, "w") as zf:
+        for members in ordered_map(lambda size: _export_size(img, base, st, size), EXPORT_SIZES):
+            for name, member in members:
+                with member:
+                    member.seek(0)
+                    info = zipfile.ZipInfo(name, stamp)
+                    info.compress_type = _ZIP_COMPRESSION.get(name.rsplit(".", 1)[-1], zipfile.ZIP_STORED)
+                    with zf.open(info, "w") as dst:
+                        shutil.copyfileobj(member, dst, 1 << 20)
+    get_sheet_pool().release(base if base is not img else None)
+    return export_filename(st)
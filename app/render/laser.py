@@ -0,0 +1,138 @@
+# app/render/laser.py
+"""
+Программа для лазерного выжигателя прямо из 1-бит листа: G-code или SVG.
+
+Лист собирается полосами (`app.render.strips.sheet_bands`) так же, как
+BMP/PNG/TIFF-финал, и каждая полоса сразу превращается в текст: подряд идущие
+чёрные пиксели строки сливаются в один отрезок (run-length), белые — холостой
+ход. Программа целиком в памяти не собирается ни при каком DPI — в работе
+лишь несколько полос листа и текст одной полосы.
+
+G-code — растровые строки «змейкой» (чётные строки слева направо, нечётные —
+справа налево), без возврата каретки на каждой строке. Мощность (`S`) и
+подача (`F`) задаются один раз в заголовке (модальные), отрезок — `G1`,
+переход — `G0`. Начало координат — левый нижний угол листа, единицы — мм.
+
+SVG — по пути на полосу из горизонтальных отрезков толщиной в пиксель;
+размер документа — в мм, координаты — в пикселях листа (viewBox).
+"""
+from __future__ import annotations
+import os
+import re
+from typing import BinaryIO, Iterator, List, Literal, Tuple
+
+from PIL import Image
+
+from app.render.pipeline import ProcState, final_filename
+from app.render.sheet_pool import get_sheet_pool
+from app.render.strips import sheet_bands
+
+# Мощность лазера при выжигании — значение `S` контроллера (GRBL: 0..$30, обычно 1000)
+LASER_POWER = int(os.getenv("RENDER_LASER_POWER", 1000))
+# Подача при выжигании, мм/мин
+LASER_FEED = int(os.getenv("RENDER_LASER_FEED", 3000))
+# M4 — динамическая мощность (GRBL laser mode): на разгоне и торможении не пережигает края
+LASER_DYNAMIC = os.getenv("RENDER_LASER_DYNAMIC", "1").lower() not in ("0", "false", "no")
+# Знаков после запятой в координатах G-code (3 — микрон, с запасом для 600 DPI)
+LASER_DECIMALS = int(os.getenv("RENDER_LASER_DECIMALS", 3))
+
+# Серии чёрных пикселей в строке 'L'-полосы (0 — жечь, 255 — пропуск)
+_BLACK_RUN = re.compile(rb"\x00+")
+
+Run = Tuple[int, int]  # [x0, x1) в пикселях
+
+
+def row_runs(band: Image.Image) -> Iterator[List[Run]]:
+    """Отрезки чёрных пикселей каждой строки 1-бит полосы, слева направо."""
+    buf = band.convert("L").tobytes()
+    w = band.width
+    for pos in range(0, len(buf), w):
+        yield [(m.start() - pos, m.end() - pos) for m in _BLACK_RUN.finditer(buf, pos, pos + w)]
+
+
+class GcodeWriter:
+    """Растровая G-code программа, дописываемая полосами."""
+
+    def __init__(self, fp: BinaryIO, width: int, height: int, dpi: int, title: str = ""):
+        self.fp = fp
+        self.height = height
+        px = 25.4 / dpi
+        # Координаты всех границ пикселей — заранее строками: в цикле только склейка
+        self.xs = [f"{x * px:.{LASER_DECIMALS}f}" for x in range(width + 1)]
+        self.px = px
+        self.reverse = False
+        fp.write((
+            f"; {title}\n"
+            f"; {width}x{height} px, {dpi} DPI, {width * px:.1f}x{height * px:.1f} mm\n"
+            "G21\nG90\n"
+            f"{'M4' if LASER_DYNAMIC else 'M3'} S0\n"
+            f"G1 F{LASER_FEED} S{LASER_POWER}\n"
+        ).encode("ascii"))
+
+    def write(self, band: Image.Image, y0: int) -> None:
+        xs, out = self.xs, []
+        for i, runs in enumerate(row_runs(band)):
+            if not runs:
+                continue
+            # Центр строки; ось Y станка — вверх от нижнего края листа
+            y = f"{(self.height - (y0 + i) - 0.5) * self.px:.{LASER_DECIMALS}f}"
+            if self.reverse:
+                runs = [(b, a) for a, b in reversed(runs)]
+            start, end = runs[0]
+            out.append(f"G0X{xs[start]}Y{y}\nG1X{xs[end]}\n")
+            out.extend(f"G0X{xs[start]}\nG1X{xs[end]}\n" for start, end in runs[1:])
+            self.reverse = not self.reverse
+        if out:
+            self.fp.write("".join(out).encode("ascii"))
+
+    def close(self) -> None:
+        self.fp.write(b"M5\nG0X0Y0\n")
+
+
+class SvgWriter:
+    """SVG с отрезками выжигания, дописываемый полосами (путь на полосу)."""
+
+    def __init__(self, fp: BinaryIO, width: int, height: int, dpi: int, title: str = ""):
+        self.fp = fp
+        mm = 25.4 / dpi
+        fp.write((
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width * mm:.3f}mm" height="{height * mm:.3f}mm" '
+            f'viewBox="0 0 {width} {height}">\n'
+            f"<title>{title}</title>\n"
+            '<g fill="none" stroke="#000" stroke-width="1">\n'
+        ).encode("ascii"))
+
+    def write(self, band: Image.Image, y0: int) -> None:
+        out = []
+        for i, runs in enumerate(row_runs(band)):
+            if runs:
+                # Отрезок по центру строки пикселей
+                out.append(f"M{runs[0][0]} {y0 + i}.5h{runs[0][1] - runs[0][0]}")
+                out.extend(f"M{a} {y0 + i}.5h{b - a}" for a, b in runs[1:])
+        if out:
+            self.fp.write(f'<path d="{"".join(out)}"/>\n'.encode("ascii"))
+
+    def close(self) -> None:
+        self.fp.write(b"</g>\n</svg>\n")
+
+
+def open_laser_writer(fmt: str, fp: BinaryIO, width: int, height: int, dpi: int, title: str = ""):
+    if fmt == "gcode":
+        return GcodeWriter(fp, width, height, dpi, title)
+    if fmt == "svg":
+        return SvgWriter(fp, width, height, dpi, title)
+    raise ValueError(f"unsupported laser format: {fmt}")
+
+
+def build_laser_to(img: Image.Image, st: ProcState, size: Literal["A4", "A3"], fp: BinaryIO) -> str:
+    """Финал (fill + авто-альбомная ориентация) программой для лазера `LASER_FORMATS`, полосами."""
+    filename = final_filename(st, size)
+    (tw, th), bands = sheet_bands(img, st, size)
+    writer = open_laser_writer(st.out_format.lower(), fp, tw, th, st.dpi, filename)
+    pool = get_sheet_pool()
+    for oy0, bw in bands:
+        writer.write(bw, oy0)
+        pool.release(bw)
+    writer.close()
+    return filename
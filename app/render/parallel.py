@@ -0,0 +1,113 @@
+# app/render/parallel.py
+"""
+Параллельная обработка одного большого изображения на нескольких ядрах.
+
+Pillow отпускает GIL внутри своих циклов на C (point, filter, blend, resize,
+convert), поэтому горизонтальные полосы одного кадра можно обрабатывать
+потоками одного процесса — без копирования между процессами.
+
+Полоса берётся с запасом строк (`halo`), который нужен фильтру, и после
+обработки запас обрезается: для поэлементных операций и фильтров с конечным
+окном результат побитно совпадает с обработкой целого кадра.
+"""
+from __future__ import annotations
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from PIL import Image
+
+from app.render.sheet_pool import get_sheet_pool
+
+# 0 — по числу ядер
+THREADS = int(os.getenv("RENDER_THREADS", 0)) or os.cpu_count() or 1
+# Меньшие кадры дешевле обработать целиком в одном потоке
+PARALLEL_MIN_PIXELS = int(os.getenv("RENDER_PARALLEL_MIN_PIXELS", 4_000_000))
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_THREAD_PREFIX = "render"
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_PID: Optional[int] = None
+
+
+def set_threads(threads: int) -> None:
+    """Сменить число потоков (бенчмарки); 0 — по числу ядер."""
+    global THREADS, _EXECUTOR
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown(wait=True)
+        _EXECUTOR = None
+    THREADS = threads or os.cpu_count() or 1
+
+
+def get_executor() -> Optional[ThreadPoolExecutor]:
+    """Пул потоков процесса (после fork — новый).
+
+    None при `RENDER_THREADS=1` и внутри самого пула: вложенная задача, ждущая
+    свободный поток того же пула, могла бы заблокировать его целиком.
+    """
+    global _EXECUTOR, _EXECUTOR_PID
+    if THREADS <= 1 or threading.current_thread().name.startswith(_THREAD_PREFIX):
+        return None
+    if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+        _EXECUTOR = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix=_THREAD_PREFIX)
+        _EXECUTOR_PID = os.getpid()
+    return _EXECUTOR
+
+
+def band_bounds(height: int, parts: int) -> List[Tuple[int, int]]:
+    """Разбить [0, height) на `parts` полос почти равной высоты (кратной 8)."""
+    step = max(8, -(-height // max(1, parts) // 8) * 8)
+    return [(y, min(height, y + step)) for y in range(0, height, step)]
+
+
+def band_map(
+    img: Image.Image,
+    fn: Callable[[Image.Image, int], Image.Image],
+    halo: int = 0,
+    min_pixels: int = PARALLEL_MIN_PIXELS,
+) -> Image.Image:
+    """Применить `fn(полоса, y0)` к полосам `img` параллельно и собрать результат.
+
+    `fn` получает полосу с запасом `halo` строк сверху и снизу (в пределах кадра)
+    и номер её первой строки в кадре; размер результата должен совпадать с входом.
+    """
+    executor = get_executor()
+    w, h = img.size
+    if executor is None or w * h < min_pixels:
+        return fn(img, 0)
+
+    def run(bounds: Tuple[int, int]) -> Image.Image:
+        y0, y1 = bounds
+        a, b = max(0, y0 - halo), min(h, y1 + halo)
+        out = fn(img.crop((0, a, w, b)), a)
+        return out.crop((0, y0 - a, w, y1 - a)) if (a, b) != (y0, y1) else out
+
+    bands = band_bounds(h, THREADS)
+    results = list(executor.map(run, bands))
+    dst = get_sheet_pool().image(results[0].mode, (w, h))
+    for (y0, _), band in zip(bands, results):
+        dst.paste(band, (0, y0))
+    return dst
+
+
+def ordered_map(fn: Callable[[T], R], items: Iterable[T], window: Optional[int] = None) -> Iterator[R]:
+    """Как `map`, но задачи идут в пуле потоков, не больше `window` одновременно, результаты — по порядку.
+
+    Ограниченное окно держит память полосового рендера пропорциональной числу потоков.
+    """
+    executor = get_executor()
+    if executor is None:
+        yield from map(fn, items)
+        return
+    window = window or THREADS
+    pending: Deque[Future] = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,319 @@
+# app/render/pipeline.py
+"""
+Конвейер обработки изображений для пиропечати (только Pillow, без aiogram).
+
+Модуль импортируется в процессах пула рендеринга, поэтому не должен тянуть
+за собой бота, БД и прочую инфраструктуру веб-воркера.
+"""
+from __future__ import annotations
+import io
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import BinaryIO, List, Literal, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageOps, ImageEnhance, ImageFilter
+
+from app.render.encoders import encode_preview, encode_sheet
+from app.render.parallel import band_map
+from app.render.sheet_pool import get_sheet_pool
+
+DEFAULT_DPI = int(os.getenv("DEFAULT_DPI", 300))
+MAX_PREVIEW_WIDTH = int(os.getenv("MAX_PREVIEW_WIDTH", 1024))
+# Форматы-программы для лазерного станка (`app.render.laser`): текст, а не растр
+LASER_FORMATS = ("gcode", "svg")
+
+# Допустимые значения полей ProcState (их же приводят хендлеры при чтении из БД)
+Dither = Literal["fs", "ordered", "none"]
+OutFormat = Literal["bmp", "png", "tiff", "jpg", "gcode", "svg"]
+
+# Размеры форматов A4 и A3 в мм
+A_SERIES_MM = {
+    "A4": (210, 297),
+    "A3": (297, 420),
+}
+
+# Политика масштабирования: "fit" — вписывать с полями, "fill" — обрезать по краям
+FIT_POLICY: Literal["fit", "fill"] = "fit"
+
+# Совместимость с разными версиями Pillow: берём корректный фильтр ресемплинга
+RESAMPLE = getattr(getattr(Image, "Resampling", Image), "LANCZOS")
+
+# ---------------------- Состояние пользователя ----------------------
+@dataclass
+class ProcState:
+    brightness: float = 1.0   # Яркость (1.0 — исходная)
+    contrast: float = 1.0     # Контраст (1.0 — исходный)
+    gamma: float = 1.0        # Гамма (1.0 — исходная)
+    sharpness: float = 2.0    # Резкость (1.0 — исходная)
+    invert: bool = False      # Инверсия (ч/б меняются местами)
+    dither: Dither = "fs"     # Тип дизеринга
+    dpi: int = DEFAULT_DPI    # Выходной DPI для финального изображения
+    last_image_bytes: Optional[bytes] = None  # Оригинал, присланный пользователем
+    denoise_size: int = 0       # 0 = выкл, 3 или 5 = медианный фильтр
+    blur_radius: float = 0.0    # 0.0 = выкл; 0.3–1.5 = лёгкое сглаживание
+    out_format: OutFormat = "bmp"  # формат итогового файла
+
+# ---------------------- Вспомогательные функции обработки ----------------------
+
+def _ensure_rgb(img: Image.Image) -> Image.Image:
+    """Гарантируем режим RGB для предсказуемых преобразований."""
+    if img.mode in ("RGB", "RGBA"):
+        return img.convert("RGB")
+    return img.convert("RGB")
+
+def _blend_lut(lut: List[int], degenerate: int, factor: float) -> List[int]:
+    """Таблица значений для `Image.blend(константа, img, factor)` — та же арифметика Pillow,
+    что у ImageEnhance на всём кадре, но посчитанная один раз на 256 уровней."""
+    ramp = Image.frombytes("L", (256, 1), bytes(lut))
+    return list(Image.blend(Image.new("L", (256, 1), degenerate), ramp, factor).tobytes())
+
+def tone_lut(gray: Image.Image, st: ProcState) -> Optional[List[int]]:
+    """Яркость → контраст → гамма одной таблицей (None — ничего не меняется).
+    Средний уровень для контраста берётся из гистограммы всего кадра, поэтому таблицу
+    можно применять к полосам изображения по отдельности.
+    """
+    lut = list(range(256))
+    changed = False
+
+    # Яркость / Контраст (как ImageEnhance.Brightness/Contrast)
+    if abs(st.brightness - 1.0) > 1e-3:
+        lut = _blend_lut(lut, 0, st.brightness)
+        changed = True
+    if abs(st.contrast - 1.0) > 1e-3:
+        hist = gray.histogram()
+        total = sum(hist[v] * lut[v] for v in range(256))
+        mean = int(total / max(1, sum(hist)) + 0.5)
+        lut = _blend_lut(lut, mean, st.contrast)
+        changed = True
+
+    # Гамма-коррекция (на 8-бит L)
+    if abs(st.gamma - 1.0) > 1e-3:
+        inv_gamma = 1.0 / st.gamma
+        gamma = [int((i / 255.0) ** inv_gamma * 255 + 0.5) for i in range(256)]
+        lut = [gamma[v] for v in lut]
+        changed = True
+
+    return lut if changed else None
+
+def filter_halo(st: ProcState) -> int:
+    """Сколько строк соседей нужно фильтрам `apply_filters`, чтобы полоса совпала с целым кадром."""
+    halo = 0
+    if abs(st.sharpness - 1.0) > 1e-3:
+        halo += 1  # SMOOTH 3×3
+    if st.denoise_size in (3, 5):
+        halo += st.denoise_size // 2
+    if st.blur_radius > 1e-3:
+        halo += 3 * (int(st.blur_radius) + 2)  # три прохода box blur
+    return halo
+
+def apply_filters(gray: Image.Image, st: ProcState) -> Image.Image:
+    """Резкость → медианный фильтр → размытие → инверсия (после тоновой таблицы)."""
+    # Резкость
+    if abs(st.sharpness - 1.0) > 1e-3:
+        gray = ImageEnhance.Sharpness(gray).enhance(st.sharpness)
+
+    # Удаление «песка» медианным фильтром
+    if st.denoise_size in (3, 5):
+        gray = gray.filter(ImageFilter.MedianFilter(size=st.denoise_size))
+
+    # Мягкое сглаживание (убирает «лесенку», полезно до дизеринга)
+    if st.blur_radius > 1e-3:
+        gray = gray.filter(ImageFilter.GaussianBlur(radius=st.blur_radius))
+
+    # Инверсия
+    if st.invert:
+        gray = ImageOps.invert(gray)
+
+    return gray
+
+def to_gray(img: Image.Image) -> Image.Image:
+    # L приходит из кеша декодированных изображений — это уже grayscale(RGB)
+    return img if img.mode == "L" else ImageOps.grayscale(_ensure_rgb(img))
+
+def adjust_image_base(img: Image.Image, st: ProcState) -> Image.Image:
+    """Базовая обработка: перевод в серый → яркость/контраст → гамма → резкость → опциональная инверсия.
+    Возвращает 8-бит изображение в режиме 'L'.
+    """
+    gray = to_gray(img)  # режим L
+    lut = tone_lut(gray, st)
+
+    def adjust(band: Image.Image, _y0: int) -> Image.Image:
+        if lut is not None:
+            band = band.point(lut)
+        return apply_filters(band, st)
+
+    # Полосы с запасом под окна фильтров — побитно как целый кадр
+    return band_map(gray, adjust, filter_halo(st))
+
+# Упорядоченный (Bayer) дизеринг 8×8
+_BAYER_8x8 = [
+    [0, 48, 12, 60, 3, 51, 15, 63],
+    [32, 16, 44, 28, 35, 19, 47, 31],
+    [8, 56, 4, 52, 11, 59, 7, 55],
+    [40, 24, 36, 20, 43, 27, 39, 23],
+    [2, 50, 14, 62, 1, 49, 13, 61],
+    [34, 18, 46, 30, 33, 17, 45, 29],
+    [10, 58, 6, 54, 9, 57, 5, 53],
+    [42, 26, 38, 22, 41, 25, 37, 21],
+]
+
+# Пиксель белый, если он строго больше порога (t + 0.5) * 4 = 4t + 2
+_ABOVE_ZERO = [0] + [255] * 255
+
+@lru_cache(maxsize=16)
+def _bayer_tile(width: int, phase: int) -> Image.Image:
+    """8 строк порогов матрицы Bayer ширины `width`, начиная со строки `phase`."""
+    rows = []
+    for y in range(8):
+        row = bytes(4 * t + 2 for t in _BAYER_8x8[(y + phase) % 8])
+        rows.append((row * (width // 8 + 1))[:width])
+    return Image.frombytes("L", (width, 8), b"".join(rows))
+
+def ordered_dither(img_gray: Image.Image, y0: int = 0) -> Image.Image:
+    """Вернуть 1-бит изображение через упорядоченный (Bayer) дизеринг 8×8.
+    `y0` — номер первой строки, если это полоса большого кадра (фаза матрицы по вертикали).
+    """
+    w, h = img_gray.size
+    # Порог — изображение из повторённой матрицы; сравнение — вычитание с насыщением в C
+    pool = get_sheet_pool()
+    tile = _bayer_tile(w, y0 % 8)
+    thresholds = pool.image("L", (w, h))
+    for y in range(0, h, 8):
+        thresholds.paste(tile, (0, y))
+    dst = ImageChops.subtract(img_gray, thresholds).point(_ABOVE_ZERO, "1")
+    pool.release(thresholds)
+    return dst
+
+def apply_dither(img_gray: Image.Image, kind: Dither, y0: int = 0) -> Image.Image:
+    """Применить выбранный тип дизеринга к серому изображению (режим 'L')."""
+    if kind == "fs":
+        # Стандартный Floyd–Steinberg из Pillow при convert('1')
+        return img_gray.convert("1")
+    elif kind == "ordered":
+        # Поэлементный — полосы считаются параллельно
+        return band_map(img_gray, lambda band, y: ordered_dither(band, y0 + y))
+    elif kind == "none":
+        # Простой порог на 128
+        return band_map(img_gray, lambda band, _y: band.point(lambda p: 255 if p >= 128 else 0, mode="1"))
+    else:
+        return img_gray.convert("1")
+
+def a_series_pixels(size: Literal["A4", "A3"], dpi: int) -> Tuple[int, int]:
+    """Посчитать размеры в пикселях для заданного формата и DPI (портрет)."""
+    mm_w, mm_h = A_SERIES_MM[size]
+    inch_w, inch_h = mm_w / 25.4, mm_h / 25.4
+    return int(round(inch_w * dpi)), int(round(inch_h * dpi))
+
+def a_series_pixels_oriented(size: Literal["A4","A3"], dpi: int, landscape: bool) -> Tuple[int,int]:
+    """Размеры листа с учётом ориентации. landscape=True — альбомная (поворот на 90°)."""
+    w, h = a_series_pixels(size, dpi)
+    return (h, w) if landscape else (w, h)
+
+def fill_box(src_wh: Tuple[int, int], target_wh: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """Область исходника, которая после обрезки (fill) растягивается на весь лист."""
+    tw, th = target_wh
+    target_ratio = tw / th
+    w, h = src_wh
+    src_ratio = w / h
+    if src_ratio > target_ratio:
+        # Слишком широкое изображение → обрезаем по ширине
+        new_w = int(h * target_ratio)
+        x0 = (w - new_w) // 2
+        return x0, 0, x0 + new_w, h
+    # Слишком высокое изображение → обрезаем по высоте
+    new_h = int(w / target_ratio)
+    y0 = (h - new_h) // 2
+    return 0, y0, w, y0 + new_h
+
+def fit_to_aspect(img: Image.Image, target_wh: Tuple[int, int], policy: Literal["fit", "fill"] = FIT_POLICY) -> Image.Image:
+    """Подогнать под целевое соотношение сторон: вписать с полями (fit) или обрезать (fill)."""
+    tw, th = target_wh
+
+    if policy == "fill":
+        # Обрезаем так, чтобы заполнить всё поле
+        crop = img.crop(fill_box(img.size, target_wh))
+        return crop.resize((tw, th), RESAMPLE)
+    else:
+        # Вписываем с белыми полями
+        img_resized = img.copy()
+        img_resized.thumbnail((tw, th), RESAMPLE)
+        canvas = get_sheet_pool().image("L", (tw, th), 255)
+        cx = (tw - img_resized.width) // 2
+        cy = (th - img_resized.height) // 2
+        canvas.paste(img_resized, (cx, cy))
+        return canvas
+
+def build_preview_to(img: Image.Image, st: ProcState, fp: BinaryIO) -> str:
+    """Собрать предпросмотр для Telegram и записать его в `fp`; возвращает имя файла."""
+    base = adjust_image_base(img, st)  # L
+    # Масштаб предпросмотра под чат
+    w = min(MAX_PREVIEW_WIDTH, base.width)
+    h = int(round(base.height * (w / base.width)))
+    base = base.resize((w, h), RESAMPLE)
+    bw = apply_dither(base, st.dither)  # режим '1'
+    # Для экономии трафика — самый компактный из вариантов (обычно 1-бит PNG)
+    return f"preview.{encode_preview(bw, fp, st.dither)}"
+
+def build_preview(img: Image.Image, st: ProcState) -> Tuple[bytes, str]:
+    """Собрать предпросмотр для Telegram в памяти: (байты, имя файла)."""
+    bio = io.BytesIO()
+    filename = build_preview_to(img, st, bio)
+    return bio.getvalue(), filename
+
+def final_filename(st: ProcState, size: Literal["A4", "A3"]) -> str:
+    fmt = st.out_format.lower()
+    return f"pyro_{size}_{st.dpi}dpi.{fmt}"
+
+def final_capacity(st: ProcState, size: Literal["A4", "A3"]) -> int:
+    """Верхняя оценка размера закодированного финала (для выходного буфера)."""
+    w, h = a_series_pixels(size, st.dpi)
+    if st.out_format.lower() == "jpg":
+        return w * h + (1 << 20)  # JPEG из L: не больше байта на пиксель с запасом на заголовки
+    if st.out_format.lower() in LASER_FORMATS:
+        # Программа для лазера: в худшем случае отрезок на каждые два пикселя, ~20 байт на отрезок
+        return (w + 1) // 2 * h * 20 + (1 << 20)
+    return 2 * ((w + 31) // 32 * 4) * h + (1 << 20)  # 1-бит: сырые строки BMP ×2
+
+def final_sheet(base: Image.Image, st: ProcState, size: Literal["A4", "A3"]) -> Tuple[Image.Image, Image.Image]:
+    """Лист из обработанного оригинала: (L под размер листа, 1-бит после дизеринга).
+    ВАЖНО: всегда 'fill' (обрезка), авто-альбомная ориентация для горизонтальных фото.
+    """
+    # если фото горизонтальное — используем альбомную ориентацию листа
+    landscape = base.width > base.height
+    target_wh = a_series_pixels_oriented(size, st.dpi, landscape)
+    # финал всегда с обрезанием (fill), без растяжения
+    fitted = fit_to_aspect(base, target_wh, "fill")  # L
+    return fitted, apply_dither(fitted, st.dither)  # 1-бит
+
+def encode_final(bw: Image.Image, fmt: str, st: ProcState, fp: BinaryIO) -> Optional[Image.Image]:
+    """Закодировать 1-бит лист в `fmt`; возвращает промежуточное изображение (для пула), если оно было."""
+    if fmt == "jpg":
+        out = ImageOps.grayscale(bw.convert("L"))  # JPEG не поддерживает 1-бит
+        out.save(fp, format="JPEG", quality=95, optimize=True, dpi=(st.dpi, st.dpi))
+        return out
+    # 1-битный bw с DPI; PNG и TIFF сжимаются под двухуровневые данные
+    encode_sheet(bw, fmt, fp, st.dpi, st.dither)
+    return None
+
+def build_final_to(img: Image.Image, st: ProcState, size: Literal["A4", "A3"], fp: BinaryIO) -> str:
+    """Собрать финальный 1-бит файл под выбранный лист и DPI, записать в `fp`.
+    Возвращает имя файла.
+    """
+    base = adjust_image_base(img, st)  # L
+    fitted, bw = final_sheet(base, st, size)
+    out = encode_final(bw, st.out_format.lower(), st, fp)
+
+    # Листовые буферы — следующему рендеру (исходник не трогаем: он может быть из кеша)
+    get_sheet_pool().release(base if base is not img else None, fitted, bw, out)
+    return final_filename(st, size)
+
+def build_final(img: Image.Image, st: ProcState, size: Literal["A4", "A3"]) -> Tuple[bytes, str]:
+    """Собрать финальный файл в памяти: (байты, имя файла)."""
+    bio = io.BytesIO()
+    filename = build_final_to(img, st, size, bio)
+    return bio.getvalue(), filename
+
+def load_image_from_bytes(data: bytes) -> Image.Image:
+    """Открыть изображение из bytes в режиме RGB."""
+    return Image.open(io.BytesIO(data)).convert("RGB")
@@ -0,0 +1,164 @@
+# app/render/pool.py
+"""
+Пул процессов для CPU-тяжёлой обработки изображений.
+
+Pillow-конвейер (`app.render.pipeline`) синхронный: один финал A3/600 DPI
+занимает ядро на секунды, и если выполнять его прямо в aiogram-хендлере,
+встаёт весь event loop воркера. Здесь рендер уходит в `ProcessPoolExecutor`,
+а хендлеры только ждут результат.
+
+- Размер пула — по числу ядер (или `RENDER_WORKERS`).
+- Очередь ограничена: при переполнении сразу `RenderQueueFull`, без ожидания.
+- У каждой задачи свой таймаут; при отмене ожидания задача снимается из очереди.
+- Слот очереди освобождается только когда задача реально завершилась в воркере,
+  поэтому брошенные по таймауту рендеры продолжают учитываться в нагрузке.
+- Результат, пришедший после таймаута или отмены ожидания, передаётся
+  `on_orphan` в цикле событий: задача, создающая ресурс (сегмент shared
+  memory), не оставляет его без владельца.
+"""
+from __future__ import annotations
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from app.core.config import get_render_settings
+from app.utils.logger import logger
+
+
+class RenderError(Exception):
+    """Базовая ошибка подсистемы рендеринга."""
+
+
+class RenderQueueFull(RenderError):
+    """Очередь рендеринга заполнена — задача не принята."""
+
+
+class RenderTimeout(RenderError):
+    """Задача не уложилась в отведённое время."""
+
+
+class RenderUnavailable(RenderError):
+    """Демон рендеринга недоступен."""
+
+
+class RenderPool:
+    def __init__(
+        self,
+        workers: int,
+        queue_size: int,
+        mp_context: str = "spawn",
+        max_tasks_per_child: int = 0,
+    ):
+        self.workers = workers
+        self.capacity = workers + queue_size  # выполняются + ждут
+        self._mp_context = mp_context
+        self._max_tasks_per_child = max_tasks_per_child or None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._inflight = 0
+        self._lock = threading.Lock()  # done-колбэки приходят из потока executor'а
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # После fork (gunicorn preload_app) пул родителя недействителен — создаём свой
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self._mp_context),
+                max_tasks_per_child=self._max_tasks_per_child,
+            )
+            self._pid = os.getpid()
+            self._inflight = 0
+            logger.info(f"🖼 Пул рендеринга запущен: {self.workers} процессов, очередь {self.capacity}")
+        return self._executor
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        if self._inflight >= self.capacity:
+            raise RenderQueueFull(f"render queue is full ({self._inflight}/{self.capacity})")
+        executor = self._get_executor()
+        try:
+            fut = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            logger.error("Пул рендеринга сломан, пересоздаём")
+            self._executor = None
+            fut = self._get_executor().submit(fn, *args)
+        with self._lock:
+            self._inflight += 1
+        fut.add_done_callback(self._release)
+        return fut
+
+    def _release(self, _fut: Future) -> None:
+        with self._lock:
+            self._inflight = max(0, self._inflight - 1)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, timeout: float,
+                  on_orphan: Optional[Callable[[Any], None]] = None) -> Any:
+        """Выполнить `fn(*args)` в процессе пула и дождаться результата.
+
+        `on_orphan(результат)` вызывается, если задача всё же завершилась после
+        того, как ждать её перестали (таймаут, отмена).
+        """
+        fut = self._submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout)
+        except asyncio.TimeoutError:
+            fut.cancel()
+            _on_late_result(fut, on_orphan)
+            raise RenderTimeout(f"{getattr(fn, '__name__', fn)} exceeded {timeout}s")
+        except asyncio.CancelledError:
+            _on_late_result(fut, on_orphan)
+            raise
+        except BrokenProcessPool:
+            self._executor = None
+            raise RenderError("render worker crashed")
+
+    def shutdown(self) -> None:
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            logger.info("🖼 Пул рендеринга остановлен")
+        self._executor = None
+
+
+def _on_late_result(fut: Future, on_orphan: Optional[Callable[[Any], None]]) -> None:
+    # Уже запущенную задачу cancel() не снимает — её результат придёт в поток executor'а
+    if on_orphan is None:
+        return
+    loop = asyncio.get_running_loop()
+
+    def done(f: Future) -> None:
+        if f.cancelled() or f.exception() is not None:
+            return
+        try:
+            loop.call_soon_threadsafe(on_orphan, f.result())
+        except RuntimeError:
+            pass  # цикл событий уже закрыт — процесс останавливается
+
+    fut.add_done_callback(done)
+
+
+_POOL: Optional[RenderPool] = None
+
+
+def get_pool() -> RenderPool:
+    global _POOL
+    if _POOL is None:
+        cfg = get_render_settings()
+        _POOL = RenderPool(
+            workers=cfg.RENDER_WORKERS or os.cpu_count() or 1,
+            queue_size=cfg.RENDER_QUEUE_SIZE,
+            mp_context=cfg.RENDER_MP_CONTEXT,
+            max_tasks_per_child=cfg.RENDER_MAX_TASKS_PER_CHILD,
+        )
+    return _POOL
+
+
+def shutdown() -> None:
+    if _POOL is not None:
+        _POOL.shutdown()
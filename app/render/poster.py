@@ -0,0 +1,189 @@
+# app/render/poster.py
+"""
+Постер из нескольких листов: одно изображение на сетке N×M листов A4/A3.
+
+Геометрия: листы одной ориентации (той, при которой пропорции постера ближе
+к фото) стыкуются с перекрытием `overlap_mm`; весь постер заполняется фото с
+обрезкой по краям, как обычный финал. Каждый лист — это область оригинала
+(дробные координаты), отмасштабированная под лист и отдизеренная полосами
+(`app.render.strips.region_bands`), поэтому постер целиком в памяти не
+собирается ни при каком DPI: в работе одновременно лишь несколько полос.
+
+Обработанный оригинал (`adjust_image_base`) считается один раз на все листы,
+листы считаются параллельно в пуле потоков. На перекрытиях листов ставятся
+метки совмещения (кресты на углах перекрытия и риски по краям листа).
+
+Результат — многостраничный TIFF (если выбран формат TIFF) или ZIP с листами
+в выбранном формате (JPEG-листы — как PNG: постер всегда 1-бит и потоковый).
+"""
+from __future__ import annotations
+import math
+import shutil
+import tempfile
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, List, Literal, Tuple
+
+from PIL import Image, ImageDraw
+
+from app.render.encoders import STREAM_FORMATS, STRIP_ROWS, TiffWriter, open_writer, png_strategy, tiff_compression
+from app.render.parallel import ordered_map
+from app.render.pipeline import ProcState, a_series_pixels, adjust_image_base, fill_box
+from app.render.sheet_pool import get_sheet_pool
+from app.render.strips import region_bands
+
+POSTER_MAX_SHEETS = 36
+POSTER_MAX_OVERLAP_MM = 50.0
+MARK_LENGTH_MM = 6.0
+MARK_WIDTH_MM = 0.3
+# Листы до упаковки в ZIP — в памяти, крупнее — на диске
+POSTER_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class PosterSpec:
+    cols: int
+    rows: int
+    size: Literal["A4", "A3"] = "A4"
+    overlap_mm: float = 0.0
+    marks: bool = True
+
+    def validate(self) -> None:
+        if self.cols < 1 or self.rows < 1 or self.cols * self.rows > POSTER_MAX_SHEETS:
+            raise ValueError(f"poster grid must have 1..{POSTER_MAX_SHEETS} sheets")
+        if not 0 <= self.overlap_mm <= POSTER_MAX_OVERLAP_MM:
+            raise ValueError(f"overlap must be 0..{POSTER_MAX_OVERLAP_MM} mm")
+
+
+@dataclass(frozen=True)
+class Tile:
+    row: int
+    col: int
+    box: Tuple[float, float, float, float]  # область оригинала
+    size: Tuple[int, int]                   # размер листа, px
+
+
+def _mm(st: ProcState, mm: float) -> int:
+    return int(round(mm / 25.4 * st.dpi))
+
+
+def poster_layout(img_size: Tuple[int, int], st: ProcState, spec: PosterSpec) -> Tuple[Tuple[int, int], List[Tile]]:
+    """Размер постера целиком (px) и листы с их областями оригинала, построчно."""
+    sw, sh = a_series_pixels(spec.size, st.dpi)
+    ov = _mm(st, spec.overlap_mm)
+
+    def poster_size(w: int, h: int) -> Tuple[int, int]:
+        return spec.cols * w - (spec.cols - 1) * ov, spec.rows * h - (spec.rows - 1) * ov
+
+    # Ориентация листов — та, при которой пропорции постера ближе к пропорциям фото
+    aspect = img_size[0] / img_size[1]
+    sw, sh = min((sw, sh), (sh, sw), key=lambda wh: abs(math.log(poster_size(*wh)[0] / poster_size(*wh)[1] / aspect)))
+    pw, ph = poster_size(sw, sh)
+    cx0, cy0, cx1, cy1 = fill_box(img_size, (pw, ph))
+    sx, sy = (cx1 - cx0) / pw, (cy1 - cy0) / ph
+    tiles = []
+    for r in range(spec.rows):
+        for c in range(spec.cols):
+            x, y = c * (sw - ov), r * (sh - ov)
+            box = (cx0 + x * sx, cy0 + y * sy, cx0 + (x + sw) * sx, cy0 + (y + sh) * sy)
+            tiles.append(Tile(r, c, box, (sw, sh)))
+    return (pw, ph), tiles
+
+
+def poster_filename(st: ProcState, spec: PosterSpec) -> str:
+    ext = "tiff" if st.out_format.lower() == "tiff" else "zip"
+    return f"pyro_poster_{spec.cols}x{spec.rows}_{spec.size}_{st.dpi}dpi.{ext}"
+
+
+def poster_capacity(st: ProcState, spec: PosterSpec) -> int:
+    """Верхняя оценка размера результата (для выходного буфера)."""
+    w, h = a_series_pixels(spec.size, st.dpi)
+    return spec.cols * spec.rows * (2 * ((w + 31) // 32 * 4) * h) + (1 << 20)
+
+
+def _marks(tile: Tile, spec: PosterSpec, st: ProcState) -> List[Tuple[int, int, int, int]]:
+    """Прямоугольники меток совмещения на листе: кресты на углах перекрытий и риски у краёв."""
+    ov = _mm(st, spec.overlap_mm)
+    if not spec.marks or ov == 0:
+        return []
+    w, h = tile.size
+    ln, lw = _mm(st, MARK_LENGTH_MM), max(1, _mm(st, MARK_WIDTH_MM))
+    xs = ([ov] if tile.col > 0 else []) + ([w - ov] if tile.col < spec.cols - 1 else [])
+    ys = ([ov] if tile.row > 0 else []) + ([h - ov] if tile.row < spec.rows - 1 else [])
+    rects = []
+    for x in xs:
+        # Риски линии перекрытия у верхнего и нижнего края листа
+        rects += [(x - lw // 2, 0, x + lw - lw // 2, ln), (x - lw // 2, h - ln, x + lw - lw // 2, h)]
+    for y in ys:
+        rects += [(0, y - lw // 2, ln, y + lw - lw // 2), (w - ln, y - lw // 2, w, y + lw - lw // 2)]
+    for x in xs:
+        for y in ys:
+            rects += [(x - ln // 2, y - lw // 2, x + ln - ln // 2, y + lw - lw // 2),
+                      (x - lw // 2, y - ln // 2, x + lw - lw // 2, y + ln - ln // 2)]
+    return rects
+
+
+def _tile_bands(img: Image.Image, base: Image.Image, st: ProcState, spec: PosterSpec,
+                tile: Tile) -> Iterator[Tuple[int, Image.Image]]:
+    rects = _marks(tile, spec, st)
+    for y0, bw in region_bands(img, st, tile.box, tile.size, base):
+        y1 = y0 + bw.height
+        hits = [(x0, a - y0, x1, b - y0) for x0, a, x1, b in rects if a < y1 and b > y0]
+        if hits:
+            draw = ImageDraw.Draw(bw)
+            for x0, a, x1, b in hits:
+                draw.rectangle((x0, a, x1 - 1, b - 1), fill=0)  # метки — чёрным (прожигаются)
+        yield y0, bw
+
+
+def build_poster_to(img: Image.Image, st: ProcState, spec: PosterSpec, fp: BinaryIO) -> str:
+    """Собрать постер и записать в `fp`: многостраничный TIFF или ZIP листов. Возвращает имя файла."""
+    spec.validate()
+    base = adjust_image_base(img, st)  # один раз на все листы
+    _, tiles = poster_layout(img.size, st, spec)
+    pool = get_sheet_pool()
+
+    if st.out_format.lower() == "tiff":
+        writer = TiffWriter(fp, *tiles[0].size, st.dpi, STRIP_ROWS, tiff_compression(st.dither),
+                            strategy=png_strategy(st.dither))
+
+        def encode_tile(tile: Tile) -> List[bytes]:
+            # Лист сжимается в своём потоке; в файл страницы пишутся по порядку
+            strips = []
+            for _, bw in _tile_bands(img, base, st, spec, tile):
+                strips.append(writer.encode(bw))
+                pool.release(bw)
+            return strips
+
+        for i, strips in enumerate(ordered_map(encode_tile, tiles)):
+            if i:
+                writer.next_page(*tiles[i].size)
+            for data in strips:
+                writer.write_encoded(data)
+        writer.close()
+    else:
+        fmt = st.out_format.lower() if st.out_format.lower() in STREAM_FORMATS else "png"
+
+        def encode_tile(tile: Tile) -> Tuple[str, BinaryIO]:
+            out = tempfile.SpooledTemporaryFile(max_size=POSTER_SPOOL_BYTES)
+            sheet = open_writer(fmt, out, *tile.size, st.dpi, STRIP_ROWS, st.dither)
+            for y0, bw in _tile_bands(img, base, st, spec, tile):
+                sheet.write(bw, y0)
+                pool.release(bw)
+            sheet.close()
+            return f"pyro_poster_r{tile.row + 1}c{tile.col + 1}_{spec.size}_{st.dpi}dpi.{fmt}", out
+
+        stamp = time.localtime()[:6]
+        with zipfile.ZipFile(fp, "w") as zf:
+            for name, out in ordered_map(encode_tile, tiles):
+                with out:
+                    out.seek(0)
+                    info = zipfile.ZipInfo(name, stamp)
+                    info.compress_type = zipfile.ZIP_DEFLATED if fmt == "bmp" else zipfile.ZIP_STORED
+                    with zf.open(info, "w") as dst:
+                        shutil.copyfileobj(out, dst, 1 << 20)
+
+    pool.release(base if base is not img else None)
+    return poster_filename(st, spec)
+
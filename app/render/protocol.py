@@ -0,0 +1,96 @@
+# app/render/protocol.py
+"""
+Компактный протокол между веб-воркерами и демоном рендеринга (Unix-сокет).
+
+Кадр = заголовок фиксированной длины + JSON-метаданные + сырые байты:
+
+    magic(2) | version(1) | op(1) | request_id(4) | meta_len(4) | payload_len(4)
+
+Метаданные маленькие (параметры обработки, имена сегментов shared memory),
+полезная нагрузка — байты оригинала/результата. Если обе стороны на одном
+хосте, большие данные идут через shared memory, а в кадре только дескрипторы.
+По одному соединению можно слать несколько запросов одновременно: ответы
+сопоставляются по `request_id`.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import struct
+from dataclasses import asdict
+from enum import IntEnum
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.render.pipeline import ProcState
+from app.render.poster import PosterSpec
+from app.render.shm import ShmHandle
+
+MAGIC = b"PR"
+VERSION = 1
+HEADER = struct.Struct("!2sBBIII")
+MAX_META = 64 * 1024
+
+
+class Op(IntEnum):
+    PING = 1
+    PREVIEW = 2
+    FINAL = 3
+    STATS = 4
+    EXPORT = 5
+    POSTER = 6
+    OK = 0x80
+    ERROR = 0x81
+
+
+class ProtocolError(Exception):
+    """Повреждённый или несовместимый кадр."""
+
+
+class Frame(NamedTuple):
+    op: Op
+    request_id: int
+    meta: Dict[str, Any]
+    payload: bytes = b""
+
+
+def encode(op: Op, request_id: int, meta: Optional[Dict[str, Any]] = None, payload=b"") -> List[bytes]:
+    """Кадр как список буферов — для `writer.writelines` без склейки payload."""
+    raw_meta = json.dumps(meta or {}, separators=(",", ":")).encode()
+    header = HEADER.pack(MAGIC, VERSION, op, request_id, len(raw_meta), len(payload))
+    return [header, raw_meta, payload] if payload else [header, raw_meta]
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Frame:
+    magic, version, op, request_id, meta_len, payload_len = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if magic != MAGIC or version != VERSION or meta_len > MAX_META:
+        raise ProtocolError(f"bad frame header: {magic!r} v{version} meta={meta_len}")
+    meta = json.loads(await reader.readexactly(meta_len)) if meta_len else {}
+    payload = await reader.readexactly(payload_len) if payload_len else b""
+    return Frame(Op(op), request_id, meta, payload)
+
+
+# ---------------------- Сериализация параметров ----------------------
+
+def state_to_meta(st: ProcState) -> Dict[str, Any]:
+    d = asdict(st)
+    d.pop("last_image_bytes", None)
+    return d
+
+
+def state_from_meta(d: Dict[str, Any]) -> ProcState:
+    return ProcState(**d)
+
+
+def poster_to_meta(spec: PosterSpec) -> Dict[str, Any]:
+    return asdict(spec)
+
+
+def poster_from_meta(d: Dict[str, Any]) -> PosterSpec:
+    return PosterSpec(**d)
+
+
+def handle_to_meta(h: Optional[ShmHandle]) -> Optional[List]:
+    return [h.name, h.size] if h is not None else None
+
+
+def handle_from_meta(v: Optional[List]) -> Optional[ShmHandle]:
+    return ShmHandle(v[0], int(v[1])) if v else None
@@ -0,0 +1,528 @@
+# app/render/service.py
+"""
+Единая точка входа в рендеринг для хендлеров.
+
+Два режима (`RENDER_MODE`):
+- `daemon` (по умолчанию) — все веб-воркеры хоста отдают задачи одному демону
+  рендеринга (`app.render.daemon`) через Unix-сокет. У демона один пул по
+  числу ядер, одна очередь и один кеш декодированных оригиналов, а веб-воркеры
+  заняты только вводом-выводом. Пока демон недоступен, веб-воркер рендерит
+  сам, но в маленьком пуле (`RENDER_FALLBACK_WORKERS`, по умолчанию один
+  процесс): пул по числу ядер в каждом из `2·ядра+1` воркеров перегрузил бы
+  хост как раз тогда, когда демон упал. При `RENDER_FALLBACK_WORKERS=0` —
+  сразу `RenderQueueFull` («занято, повтори»).
+- `local` — у каждого веб-воркера свой пул процессов (`app.render.pool`). Так
+  же и в отладочном запуске (один процесс, демона нет).
+
+Большие оригиналы и результаты в обоих режимах ходят через shared memory
+(`app.render.shm`): веб-воркер владеет сегментами, пул только подключается.
+
+Большие финалы не возвращаются байтами: задача пишет файл во временный
+каталог (`RENDER_SPOOL_DIR`), и хендлер загружает его в Telegram потоком.
+
+Готовые превью кешируются в веб-воркере (`PreviewCache`) вместе с `file_id`,
+под которым Telegram их запомнил: повторное превью не рендерится и не
+загружается заново.
+
+Каждый рендер (и попадание в кеш превью) пишется в журнал использования
+(`app.db.aio_events`): вид, формат листа, DPI, формат файла, дизеринг, исход
+и время.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import os
+import tempfile
+import time
+from contextlib import ExitStack, asynccontextmanager
+from dataclasses import dataclass, replace
+from typing import (Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, Literal, Optional, Tuple,
+                    Union)
+
+from app.core.config import debug_mode, get_render_settings
+from app.db import aio_events
+from app.render import protocol, shm
+from app.render.cache import DecodedCache, Preview, PreviewCache, digest, preview_key
+from app.render.pipeline import MAX_PREVIEW_WIDTH, ProcState, final_capacity
+from app.render.pool import (RenderError, RenderPool, RenderQueueFull, RenderTimeout,
+                             RenderUnavailable, get_pool)
+from app.render.protocol import Op
+from app.render.shm import ImageHandle, SegmentArena, ShmHandle
+from app.render.export import export_capacity
+from app.render.poster import PosterSpec, poster_capacity
+from app.render.tasks import Output, Result, decode_task, export_task, final_task, poster_task, preview_task
+from app.utils.logger import logger
+
+# Превью ширины MAX_PREVIEW_WIDTH (худший случай — JPEG); страницы сегмента выделяются лениво
+PREVIEW_CAPACITY = MAX_PREVIEW_WIDTH * MAX_PREVIEW_WIDTH * 4
+
+Src = Union[bytes, ShmHandle]
+
+RECONNECT_DELAY = 5.0  # сек
+
+
+@dataclass
+class Rendered:
+    """Готовый финал: байты в памяти или (большой) временный файл — его удалит `render_final`."""
+    filename: str
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+    size: int = 0
+
+
+def _strip(st: ProcState) -> ProcState:
+    # Оригинал передаётся отдельным аргументом — не пиклим его дважды
+    return replace(st, last_image_bytes=None)
+
+
+def _collect(arena: SegmentArena, out: Optional[ShmHandle], res: Result) -> bytes:
+    # Задача вернула длину — результат лежит в выходном сегменте
+    return arena.read(out.name, res) if isinstance(res, int) else res
+
+
+def _lease_output(stack: ExitStack, arena: SegmentArena, capacity: int) -> Optional[ShmHandle]:
+    if get_render_settings().RENDER_SHM_ENABLED and arena.fits(capacity):
+        return stack.enter_context(arena.lease_output(capacity))
+    return None
+
+
+def _spool_path(stack: ExitStack, capacity: int) -> Optional[str]:
+    """Временный файл под большой финал (удаляется при закрытии `stack`) или `None`."""
+    cfg = get_render_settings()
+    if capacity < cfg.RENDER_SPOOL_MIN_BYTES:
+        return None
+    fd, path = tempfile.mkstemp(prefix="pyro_final_", dir=cfg.RENDER_SPOOL_DIR or None)
+    os.close(fd)
+    stack.callback(_unlink, path)
+    return path
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _lease_input(stack: ExitStack, arena: SegmentArena, data) -> Src:
+    cfg = get_render_settings()
+    if cfg.RENDER_SHM_ENABLED and len(data) >= cfg.RENDER_SHM_MIN_BYTES and arena.fits(len(data)):
+        return stack.enter_context(arena.lease_bytes(data))
+    return data
+
+
+class LocalRenderer:
+    """Пул процессов + арена shared memory + кеш декодированных оригиналов."""
+
+    def __init__(self, pool: RenderPool, arena: SegmentArena, cache: DecodedCache):
+        self.pool = pool
+        self.arena = arena
+        self.cache = cache
+        self._decoding: Dict[str, asyncio.Future] = {}
+
+    # ---- низкоуровневые операции (их же вызывает демон) ----
+
+    async def run_preview(self, src: Src, key: Optional[str], st: ProcState, out: Output) -> Tuple[Result, str]:
+        async with self._source(src, key) as source:
+            return await self.pool.run(
+                preview_task, source, out, _strip(st),
+                timeout=get_render_settings().RENDER_PREVIEW_TIMEOUT,
+            )
+
+    async def run_final(
+        self, src: Src, key: Optional[str], st: ProcState, size: Literal["A4", "A3"], out: Output,
+    ) -> Tuple[Result, str]:
+        async with self._source(src, key) as source:
+            return await self.pool.run(
+                final_task, source, out, _strip(st), size,
+                timeout=get_render_settings().RENDER_FINAL_TIMEOUT,
+            )
+
+    async def run_export(self, src: Src, key: Optional[str], st: ProcState, out: Output) -> Tuple[Result, str]:
+        async with self._source(src, key) as source:
+            return await self.pool.run(
+                export_task, source, out, _strip(st),
+                timeout=get_render_settings().RENDER_FINAL_TIMEOUT,
+            )
+
+    async def run_poster(
+        self, src: Src, key: Optional[str], st: ProcState, spec: PosterSpec, out: Output,
+    ) -> Tuple[Result, str]:
+        async with self._source(src, key) as source:
+            return await self.pool.run(
+                poster_task, source, out, _strip(st), spec,
+                timeout=get_render_settings().RENDER_FINAL_TIMEOUT * spec.cols * spec.rows,
+            )
+
+    @asynccontextmanager
+    async def _source(self, src: Src, key: Optional[str]) -> AsyncIterator[Union[Src, ImageHandle]]:
+        """Источник для задачи: декодированный оригинал из кеша или сами байты."""
+        handle = await self._decoded(src, key) if key and self.cache.enabled else None
+        if handle is not None:
+            try:
+                yield handle
+            finally:
+                self.cache.release(key)
+            return
+        with ExitStack() as stack:
+            yield src if isinstance(src, ShmHandle) else _lease_input(stack, self.arena, src)
+
+    async def _decoded(self, src: Src, key: str) -> Optional[ImageHandle]:
+        handle = self.cache.acquire(key)
+        if handle is not None:
+            return handle
+        pending = self._decoding.get(key)
+        if pending is not None:
+            # Тот же оригинал уже декодируется параллельным запросом
+            await asyncio.shield(pending)
+            return self.cache.acquire(key)
+        self._decoding[key] = asyncio.get_running_loop().create_future()
+        try:
+            with ExitStack() as stack:
+                source = src if isinstance(src, ShmHandle) else _lease_input(stack, self.arena, src)
+                handle = await self.pool.run(decode_task, source, timeout=get_render_settings().RENDER_PREVIEW_TIMEOUT,
+                                             on_orphan=self._drop_segment)
+            nbytes = self.arena.adopt(handle.name, "decoded", pinned=True)
+            return self.cache.put(key, handle, nbytes)
+        finally:
+            self._decoding.pop(key).set_result(None)
+
+    def _drop_segment(self, handle: ImageHandle) -> None:
+        """Декодирование завершилось после таймаута: сегмент создан, но ждать его уже некому."""
+        self.arena.adopt(handle.name, "decoded-late")
+        self.arena.release(handle.name)
+
+    # ---- API для хендлеров ----
+
+    async def preview(self, data: bytes, st: ProcState, key: Optional[str] = None) -> Tuple[bytes, str]:
+        with ExitStack() as stack:
+            out = _lease_output(stack, self.arena, PREVIEW_CAPACITY)
+            res, filename = await self.run_preview(data, key or digest(data), st, out)
+            return _collect(self.arena, out, res), filename
+
+    async def final(
+        self, data: bytes, st: ProcState, size: Literal["A4", "A3"], path: Optional[str] = None,
+    ) -> Rendered:
+        return await self._to_file_or_memory(
+            lambda out: self.run_final(data, digest(data), st, size, out), final_capacity(st, size), path,
+        )
+
+    async def export(self, data: bytes, st: ProcState, path: Optional[str] = None) -> Rendered:
+        return await self._to_file_or_memory(
+            lambda out: self.run_export(data, digest(data), st, out), export_capacity(st), path,
+        )
+
+    async def poster(self, data: bytes, st: ProcState, spec: PosterSpec, path: Optional[str] = None) -> Rendered:
+        return await self._to_file_or_memory(
+            lambda out: self.run_poster(data, digest(data), st, spec, out), poster_capacity(st, spec), path,
+        )
+
+    async def _to_file_or_memory(
+        self, run: Callable[[Output], Awaitable[Tuple[Result, str]]], capacity: int, path: Optional[str],
+    ) -> Rendered:
+        if path is not None:
+            written, filename = await run(path)
+            return Rendered(filename, path=path, size=written)
+        with ExitStack() as stack:
+            out = _lease_output(stack, self.arena, capacity)
+            res, filename = await run(out)
+            res = _collect(self.arena, out, res)
+            return Rendered(filename, data=res, size=len(res))
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self.pool.inflight,
+            "capacity": self.pool.capacity,
+            "shm": self.arena.stats(),
+            "decoded_cache": self.cache.stats(),
+        }
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
+        self.cache.clear()
+        self.arena.release_all()
+
+
+_ERRORS = {"RenderQueueFull": RenderQueueFull, "RenderTimeout": RenderTimeout}
+
+
+class DaemonClient:
+    """Клиент демона рендеринга: одно постоянное соединение, запросы мультиплексируются."""
+
+    def __init__(self, path: str, connect_timeout: float, arena: SegmentArena):
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.arena = arena
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+        self._retry_at = 0.0  # после неудачного подключения не долбим сокет каждый запрос
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        if self._writer is None or self._writer.is_closing():
+            if time.monotonic() < self._retry_at:
+                raise RenderUnavailable("render daemon is down")
+            try:
+                reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_unix_connection(self.path), self.connect_timeout,
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                self._retry_at = time.monotonic() + RECONNECT_DELAY
+                logger.error(f"🖼 Демон рендеринга недоступен ({e!r}), {RECONNECT_DELAY:.0f} с рендерим локально")
+                raise RenderUnavailable(f"render daemon unavailable: {e!r}")
+            asyncio.create_task(self._read_loop(reader, self._writer))
+        return self._writer
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                frame = await protocol.read_frame(reader)
+                fut = self._pending.get(frame.request_id)
+                if fut is not None and not fut.done():
+                    fut.set_result(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, protocol.ProtocolError) as e:
+            logger.warning(f"🖼 Соединение с демоном рендеринга потеряно: {e!r}")
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(RenderUnavailable("render daemon connection lost"))
+
+    async def request(self, op: Op, meta: dict, payload=b"", timeout: float = 30.0) -> protocol.Frame:
+        rid = next(self._ids) & 0xFFFFFFFF
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        try:
+            async with self._lock:
+                writer = await self._connect()
+                try:
+                    writer.writelines(protocol.encode(op, rid, meta, payload))
+                    await writer.drain()
+                except OSError as e:
+                    raise RenderUnavailable(f"render daemon connection failed: {e!r}")
+            frame = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeout(f"render daemon did not answer in {timeout}s")
+        finally:
+            self._pending.pop(rid, None)
+        if frame.op == Op.ERROR:
+            raise _ERRORS.get(frame.meta.get("error"), RenderError)(frame.meta.get("message", ""))
+        return frame
+
+    async def _render(
+        self, op: Op, data: bytes, st: ProcState, capacity: int, timeout: float, key: Optional[str] = None,
+        path: Optional[str] = None, **extra,
+    ) -> Tuple[bytes, dict]:
+        meta = {"st": protocol.state_to_meta(st), "key": key or digest(data), **extra}
+        with ExitStack() as stack:
+            src = _lease_input(stack, self.arena, data)
+            if isinstance(src, ShmHandle):
+                meta["src"], payload = protocol.handle_to_meta(src), b""
+            else:
+                payload = src
+            out = None
+            if path is not None:
+                meta["path"] = path
+            else:
+                out = _lease_output(stack, self.arena, capacity)
+                meta["out"] = protocol.handle_to_meta(out)
+            # Таймаут задачи считает демон; здесь только запас на доставку
+            frame = await self.request(op, meta, payload, timeout + 5.0)
+            if "written" in frame.meta and out is not None:
+                return self.arena.read(out.name, frame.meta["written"]), frame.meta
+            return frame.payload, frame.meta
+
+    async def preview(self, data: bytes, st: ProcState, key: Optional[str] = None) -> Tuple[bytes, str]:
+        res, meta = await self._render(
+            Op.PREVIEW, data, st, PREVIEW_CAPACITY, get_render_settings().RENDER_PREVIEW_TIMEOUT, key,
+        )
+        return res, meta["filename"]
+
+    async def final(
+        self, data: bytes, st: ProcState, size: Literal["A4", "A3"], path: Optional[str] = None,
+    ) -> Rendered:
+        res, meta = await self._render(
+            Op.FINAL, data, st, final_capacity(st, size), get_render_settings().RENDER_FINAL_TIMEOUT,
+            path=path, size=size,
+        )
+        return _rendered(res, meta, path)
+
+    async def export(self, data: bytes, st: ProcState, path: Optional[str] = None) -> Rendered:
+        res, meta = await self._render(
+            Op.EXPORT, data, st, export_capacity(st), get_render_settings().RENDER_FINAL_TIMEOUT, path=path,
+        )
+        return _rendered(res, meta, path)
+
+    async def poster(self, data: bytes, st: ProcState, spec: PosterSpec, path: Optional[str] = None) -> Rendered:
+        res, meta = await self._render(
+            Op.POSTER, data, st, poster_capacity(st, spec),
+            get_render_settings().RENDER_FINAL_TIMEOUT * spec.cols * spec.rows,
+            path=path, poster=protocol.poster_to_meta(spec),
+        )
+        return _rendered(res, meta, path)
+
+    def shutdown(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self.arena.release_all()
+
+
+def _rendered(res: bytes, meta: dict, path: Optional[str]) -> Rendered:
+    if path is not None:
+        return Rendered(meta["filename"], path=path, size=meta["written"])
+    return Rendered(meta["filename"], data=res, size=len(res))
+
+
+_LOCAL: Optional[LocalRenderer] = None
+_FALLBACK: Optional[LocalRenderer] = None  # пока демон недоступен
+_CLIENT: Optional[DaemonClient] = None
+_PREVIEWS: Optional[PreviewCache] = None
+
+
+def get_local_renderer() -> LocalRenderer:
+    global _LOCAL
+    if _LOCAL is None:
+        arena = shm.get_arena()
+        cache = DecodedCache(arena, get_render_settings().RENDER_DECODED_CACHE_MB * 1024 * 1024)
+        _LOCAL = LocalRenderer(get_pool(), arena, cache)
+    return _LOCAL
+
+
+def get_fallback_renderer() -> LocalRenderer:
+    """Маленький пул веб-воркера на время недоступности демона (без кеша декодированных)."""
+    global _FALLBACK
+    cfg = get_render_settings()
+    if cfg.RENDER_FALLBACK_WORKERS <= 0:
+        raise RenderQueueFull("render daemon is unavailable")
+    if _FALLBACK is None:
+        arena = shm.get_arena()
+        pool = RenderPool(
+            workers=cfg.RENDER_FALLBACK_WORKERS,
+            queue_size=cfg.RENDER_FALLBACK_QUEUE_SIZE,
+            mp_context=cfg.RENDER_MP_CONTEXT,
+            max_tasks_per_child=cfg.RENDER_MAX_TASKS_PER_CHILD,
+        )
+        _FALLBACK = LocalRenderer(pool, arena, DecodedCache(arena, 0))
+    return _FALLBACK
+
+
+def _get_client() -> Optional[DaemonClient]:
+    global _CLIENT
+    cfg = get_render_settings()
+    if cfg.RENDER_MODE != "daemon" or debug_mode():
+        return None
+    if _CLIENT is None:
+        _CLIENT = DaemonClient(cfg.RENDER_SOCKET_PATH, cfg.RENDER_DAEMON_CONNECT_TIMEOUT, shm.get_arena())
+    return _CLIENT
+
+
+def get_preview_cache() -> PreviewCache:
+    global _PREVIEWS
+    if _PREVIEWS is None:
+        _PREVIEWS = PreviewCache(get_render_settings().RENDER_PREVIEW_CACHE_MB * 1024 * 1024)
+    return _PREVIEWS
+
+
+def _outcome(e: BaseException) -> str:
+    """Исход неудачного рендера для журнала использования."""
+    if isinstance(e, RenderQueueFull):
+        return "busy"
+    if isinstance(e, RenderTimeout):
+        return "timeout"
+    return "error"
+
+
+def _record(kind: str, size: str, st: ProcState, status: str, started: float, user_id: int) -> None:
+    aio_events.record(kind, size, st.dpi, st.out_format, st.dither, status, time.monotonic() - started, user_id)
+
+
+async def render_preview(data: bytes, st: ProcState, user_id: int = 0) -> Preview:
+    """Превью из кеша или свежеотрендеренное; у повторного может быть `file_id` для отправки без загрузки."""
+    started = time.monotonic()
+    source_key = digest(data)
+    key = preview_key(source_key, st)
+    cache = get_preview_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        _record("preview", "preview", st, "cached", started, user_id)
+        return cached
+    client = _get_client()
+    res = None
+    try:
+        if client is not None:
+            try:
+                res = await client.preview(data, st, source_key)
+            except RenderUnavailable:
+                pass  # уже залогировано клиентом — рендерим в запасном пуле
+        if res is None:
+            res = await (get_local_renderer() if client is None else get_fallback_renderer()).preview(
+                data, st, source_key)
+    except Exception as e:
+        _record("preview", "preview", st, _outcome(e), started, user_id)
+        raise
+    _record("preview", "preview", st, "ok", started, user_id)
+    return cache.put(Preview(key, *res))
+
+
+def remember_preview_file_id(key: str, file_id: Optional[str]) -> None:
+    """Запомнить (или забыть — `None`) `file_id`, под которым Telegram сохранил превью."""
+    get_preview_cache().set_file_id(key, file_id)
+
+
+@asynccontextmanager
+async def _spooled(capacity: int, render: Callable[[Any, Optional[str]], Awaitable[Rendered]],
+                   event: Tuple[str, str, ProcState, int]) -> AsyncIterator[Rendered]:
+    kind, size, st, user_id = event
+    with ExitStack() as stack:
+        started = time.monotonic()
+        try:
+            path = _spool_path(stack, capacity)
+            client = _get_client()
+            res = None
+            if client is not None:
+                try:
+                    res = await render(client, path)
+                except RenderUnavailable:
+                    pass  # уже залогировано клиентом — рендерим в запасном пуле
+            if res is None:
+                res = await render(get_local_renderer() if client is None else get_fallback_renderer(), path)
+        except Exception as e:
+            _record(kind, size, st, _outcome(e), started, user_id)
+            raise
+        # Только рендер: загрузка в Telegram внутри блока `async with` — уже не его время
+        _record(kind, size, st, "ok", started, user_id)
+        yield res
+
+
+def render_final(data: bytes, st: ProcState, size: Literal["A4", "A3"],
+                 user_id: int = 0) -> AsyncContextManager[Rendered]:
+    """Финал на время блока `async with`: большой лежит во временном файле, после блока он удаляется."""
+    return _spooled(final_capacity(st, size), lambda r, path: r.final(data, st, size, path),
+                    ("final", size, st, user_id))
+
+
+def render_export(data: bytes, st: ProcState, user_id: int = 0) -> AsyncContextManager[Rendered]:
+    """ZIP со всеми листами (`app.render.export`) — как `render_final`."""
+    return _spooled(export_capacity(st), lambda r, path: r.export(data, st, path),
+                    ("export", "all", st, user_id))
+
+
+def render_poster(data: bytes, st: ProcState, spec: PosterSpec, user_id: int = 0) -> AsyncContextManager[Rendered]:
+    """Постер на нескольких листах (`app.render.poster`) — как `render_final`."""
+    return _spooled(poster_capacity(st, spec), lambda r, path: r.poster(data, st, spec, path),
+                    ("poster", f"{spec.cols}x{spec.rows}@{spec.size}", st, user_id))
+
+
+def shutdown() -> None:
+    if _CLIENT is not None:
+        _CLIENT.shutdown()
+    if _LOCAL is not None:
+        _LOCAL.shutdown()
+    if _FALLBACK is not None:
+        _FALLBACK.shutdown()
+    if _PREVIEWS is not None:
+        _PREVIEWS.clear()
+    shm.release_all()
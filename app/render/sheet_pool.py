@@ -0,0 +1,122 @@
+# app/render/sheet_pool.py
+"""
+Пул переиспользуемых буферов листа в процессе рендеринга.
+
+Геометрия листа — одна из немногих комбинаций (формат, DPI, ориентация) из
+`a_series_pixels_oriented`, а полосы полосового рендера — всегда
+`ширина × STRIP_ROWS`. Вместо того чтобы на каждый рендер заново выделять
+холсты, пороговые матрицы и выходные буферы по десятки мегабайт (и дробить
+кучу долгоживущего воркера), отработавшие изображения и буферы возвращаются
+в пул и выдаются следующему рендеру того же размера.
+
+Пул — на процесс; объём ограничен бюджетом, на один ключ хранится не больше
+`PER_KEY` объектов. В пул можно вернуть только то, на что больше никто не
+ссылается (в том числе нельзя возвращать исходное изображение из кеша).
+"""
+from __future__ import annotations
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+SHEET_POOL_BYTES = int(os.getenv("RENDER_SHEET_POOL_MB", 192)) * 1024 * 1024
+PER_KEY = int(os.getenv("RENDER_SHEET_POOL_PER_KEY", 2))
+BUFFER_GRANULE = 1 << 20  # размеры выходных буферов округляются до мегабайта
+
+Key = Tuple[str, Tuple[int, int]]
+
+
+def _nbytes(img: Image.Image) -> int:
+    # Pillow хранит '1', 'L' и 'P' по байту на пиксель, остальные режимы — по 4
+    return img.width * img.height * (1 if img.mode in ("1", "L", "P") else 4)
+
+
+class SheetPool:
+    def __init__(self, budget_bytes: int, per_key: int):
+        self.budget_bytes = budget_bytes
+        self.per_key = per_key
+        self._images: Dict[Key, List[Image.Image]] = {}
+        self._buffers: Dict[int, List[bytearray]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.allocated = 0  # выделено новых
+        self.reused = 0     # выдано из пула
+        self.returned = 0   # принято обратно
+        self.dropped = 0    # не принято: ключ заполнен или бюджет исчерпан
+
+    # ---- изображения ----
+
+    def image(self, mode: str, size: Tuple[int, int], color: Optional[int] = None) -> Image.Image:
+        """Изображение `mode`/`size`; содержимое не определено, если не задан `color`."""
+        with self._lock:
+            free = self._images.get((mode, size))
+            img = free.pop() if free else None
+            if img is not None:
+                self._bytes -= _nbytes(img)
+                self.reused += 1
+            else:
+                self.allocated += 1
+        if img is None:
+            return Image.new(mode, size, color or 0)
+        if color is not None:
+            img.paste(color, (0, 0) + size)
+        return img
+
+    def release(self, *images: Optional[Image.Image]) -> None:
+        for img in images:
+            if img is None or getattr(img, "readonly", 0):
+                continue  # изображения поверх чужой памяти (shared memory) не переиспользуем
+            self._put(self._images.setdefault((img.mode, img.size), []), img, _nbytes(img))
+
+    # ---- байтовые буферы (выход кодировщиков) ----
+
+    def buffer(self, capacity: int) -> bytearray:
+        size = -(-capacity // BUFFER_GRANULE) * BUFFER_GRANULE
+        with self._lock:
+            free = self._buffers.get(size)
+            buf = free.pop() if free else None
+            if buf is not None:
+                self._bytes -= size
+                self.reused += 1
+            else:
+                self.allocated += 1
+        return buf if buf is not None else bytearray(size)
+
+    def release_buffer(self, buf: bytearray) -> None:
+        self._put(self._buffers.setdefault(len(buf), []), buf, len(buf))
+
+    def _put(self, free: list, obj, nbytes: int) -> None:
+        with self._lock:
+            if len(free) >= self.per_key or self._bytes + nbytes > self.budget_bytes:
+                self.dropped += 1
+                return
+            free.append(obj)
+            self._bytes += nbytes
+            self.returned += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._buffers.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "bytes": self._bytes,
+            "allocated": self.allocated,
+            "reused": self.reused,
+            "returned": self.returned,
+            "dropped": self.dropped,
+        }
+
+
+_POOL: Optional[SheetPool] = None
+
+
+def get_sheet_pool() -> SheetPool:
+    global _POOL
+    if _POOL is None or _POOL._pid != os.getpid():
+        _POOL = SheetPool(SHEET_POOL_BYTES, PER_KEY)
+    return _POOL
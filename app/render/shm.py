@@ -0,0 +1,293 @@
+# app/render/shm.py
+"""
+Передача изображений в процессы пула через разделяемую память.
+
+Пиклинг многомегабайтных байтов в `ProcessPoolExecutor` копирует их как минимум
+дважды (pickle → pipe → unpickle), а результат — ещё раз на обратном пути.
+Здесь данные кладутся в сегменты POSIX shared memory (`/dev/shm`), а между
+процессами передаются только лёгкие дескрипторы `ShmHandle` / `ImageHandle`.
+
+Владение сегментами:
+- Сегменты создаёт и удаляет веб-воркер (`SegmentArena`). Воркер пула только
+  подключается к ним (`attach`) и закрывает свою проекцию по завершении задачи.
+- Сегмент, созданный воркером пула (например, общая база для нескольких задач),
+  передаётся во владение арене через `adopt` — в том числе когда задача
+  завершилась уже после таймаута (`RenderPool.run(on_orphan=...)`): такой
+  сегмент сразу удаляется.
+- Арена помнит время создания каждого сегмента; всё, что живёт дольше
+  `RENDER_SHM_LEAK_SECONDS`, считается утечкой — пишем в лог и удаляем.
+  Сегменты в аренде (`lease_bytes`/`lease_output`) утечкой не считаются,
+  сколько бы ни шёл рендер (постер — до таймаута финала на каждый лист):
+  их удаляет сам блок `with` по завершении.
+"""
+from __future__ import annotations
+import io
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, NamedTuple, Optional
+
+from PIL import Image
+
+SHM_DIR = "/dev/shm"
+
+
+class ShmHandle(NamedTuple):
+    """Сырые байты в сегменте: имя сегмента и длина полезных данных."""
+    name: str
+    size: int
+
+
+class ImageHandle(NamedTuple):
+    """Декодированное изображение в сегменте (raw-пиксели без заголовков)."""
+    name: str
+    mode: str
+    width: int
+    height: int
+
+
+class BufferOverflow(Exception):
+    """Результат не помещается в выделенный выходной сегмент."""
+
+
+# ---------------------- Сторона воркера пула ----------------------
+
+class Mapping:
+    """Проекция чужого сегмента в адресное пространство процесса.
+
+    Подключаемся через mmap файла в /dev/shm, а не через `SharedMemory(name)`:
+    до Python 3.13 подключение регистрирует сегмент в resource_tracker
+    процесса, и тот пытается удалить его при своём завершении.
+    """
+
+    def __init__(self, name: str):
+        fd = os.open(os.path.join(SHM_DIR, name), os.O_RDWR)
+        try:
+            self.mmap = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self.mmap)
+
+    def close(self) -> None:
+        try:
+            self.buf.release()
+            self.mmap.close()
+        except BufferError:
+            # На память ещё ссылается изображение из `open_image` —
+            # проекция освободится вместе с ним
+            pass
+
+
+@contextmanager
+def attach(name: str) -> Iterator[Mapping]:
+    m = Mapping(name)
+    try:
+        yield m
+    finally:
+        m.close()
+
+
+def open_image(view: memoryview, handle: ImageHandle) -> Image.Image:
+    """Изображение поверх памяти сегмента — без копирования пикселей."""
+    return Image.frombuffer(handle.mode, (handle.width, handle.height), view, "raw", handle.mode, 0, 1)
+
+
+class ShmWriter(io.RawIOBase):
+    """Файлоподобная запись прямо в сегмент (для `Image.save`)."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        n = len(b)
+        end = self._pos + n
+        if end > len(self._view):
+            raise BufferOverflow(f"{end} > {len(self._view)}")
+        self._view[self._pos:end] = b
+        self._pos = end
+        self.size = max(self.size, end)
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()  # иначе mmap сегмента нельзя закрыть
+        super().close()
+
+
+def create_image_segment(img: Image.Image) -> ImageHandle:
+    """Создать сегмент с пикселями `img` (в процессе пула); владельца назначает `adopt`."""
+    data = img.tobytes()
+    shm = SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        shm.buf[:len(data)] = data
+        return ImageHandle(shm.name, img.mode, img.width, img.height)
+    finally:
+        shm.close()
+
+
+# ---------------------- Сторона владельца (веб-воркер) ----------------------
+
+class _Segment(NamedTuple):
+    shm: SharedMemory
+    created: float
+    label: str
+    pinned: bool = False  # долгоживущие (кеш) — не считаются утечкой
+    leased: bool = False  # в аренде у блока `with` — удалится по его завершении
+
+
+class SegmentArena:
+    def __init__(self, budget_bytes: int, leak_seconds: float):
+        self.budget_bytes = budget_bytes
+        self.leak_seconds = leak_seconds
+        self._segments: Dict[str, _Segment] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._last_leak_check = time.monotonic()
+        self.created_total = 0
+        self.leaked_total = 0
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(s.shm.size for s in self._segments.values())
+
+    def fits(self, size: int) -> bool:
+        return self.used_bytes + size <= self.budget_bytes
+
+    def create(self, size: int, label: str, leased: bool = False) -> SharedMemory:
+        self._maybe_check_leaks()
+        shm = SharedMemory(create=True, size=max(1, size))
+        with self._lock:
+            self._segments[shm.name] = _Segment(shm, time.monotonic(), label, leased=leased)
+            self.created_total += 1
+        return shm
+
+    def adopt(self, name: str, label: str, pinned: bool = False) -> int:
+        """Взять во владение сегмент, созданный другим процессом; вернуть его размер."""
+        shm = SharedMemory(name=name)
+        with self._lock:
+            self._segments[name] = _Segment(shm, time.monotonic(), label, pinned)
+        return shm.size
+
+    def has(self, name: str) -> bool:
+        return name in self._segments
+
+    def put_bytes(self, data, label: str = "bytes", leased: bool = False) -> ShmHandle:
+        n = len(data)
+        shm = self.create(n, label, leased)
+        shm.buf[:n] = data
+        return ShmHandle(shm.name, n)
+
+    def read(self, name: str, size: int) -> bytes:
+        return bytes(self._segments[name].shm.buf[:size])
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            seg = self._segments.pop(name, None)
+        if seg is None:
+            return
+        seg.shm.close()
+        try:
+            seg.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def lease_bytes(self, data, label: str = "input") -> Iterator[ShmHandle]:
+        h = self.put_bytes(data, label, leased=True)
+        try:
+            yield h
+        finally:
+            self.release(h.name)
+
+    @contextmanager
+    def lease_output(self, capacity: int, label: str = "output") -> Iterator[ShmHandle]:
+        # Страницы tmpfs выделяются лениво: большой запас по ёмкости почти ничего не стоит
+        shm = self.create(capacity, label, leased=True)
+        try:
+            yield ShmHandle(shm.name, capacity)
+        finally:
+            self.release(shm.name)
+
+    def check_leaks(self) -> int:
+        """Удалить сегменты старше `leak_seconds` (кроме кеша и арендованных); вернуть их количество."""
+        deadline = time.monotonic() - self.leak_seconds
+        with self._lock:
+            stale = [(n, s) for n, s in self._segments.items()
+                     if not s.pinned and not s.leased and s.created < deadline]
+        for name, seg in stale:
+            _warn(f"🧹 Утечка shared memory: {name} ({seg.label}, {seg.shm.size} B) — удаляем")
+            self.release(name)
+        self.leaked_total += len(stale)
+        return len(stale)
+
+    def _maybe_check_leaks(self) -> None:
+        now = time.monotonic()
+        if now - self._last_leak_check >= min(self.leak_seconds, 60.0):
+            self._last_leak_check = now
+            self.check_leaks()
+
+    def release_all(self) -> None:
+        if os.getpid() != self._pid:
+            return  # сегменты родителя после fork не наши
+        with self._lock:
+            names = list(self._segments)
+        if names:
+            _warn(f"🧹 При остановке осталось {len(names)} сегментов shared memory — удаляем")
+        for name in names:
+            self.release(name)
+
+    def stats(self) -> dict:
+        return {
+            "segments": len(self._segments),
+            "bytes": self.used_bytes,
+            "created_total": self.created_total,
+            "leaked_total": self.leaked_total,
+        }
+
+
+def _warn(msg: str) -> None:
+    # Логгер приложения импортируем лениво: модуль грузится и в процессах пула
+    from app.utils.logger import logger
+    logger.warning(msg)
+
+
+_ARENA: Optional[SegmentArena] = None
+
+
+def get_arena() -> SegmentArena:
+    global _ARENA
+    if _ARENA is None or _ARENA._pid != os.getpid():
+        from app.core.config import get_render_settings
+        cfg = get_render_settings()
+        _ARENA = SegmentArena(
+            budget_bytes=cfg.RENDER_SHM_BUDGET_MB * 1024 * 1024,
+            leak_seconds=cfg.RENDER_SHM_LEAK_SECONDS,
+        )
+    return _ARENA
+
+
+def release_all() -> None:
+    if _ARENA is not None:
+        _ARENA.release_all()
@@ -0,0 +1,146 @@
+# app/render/strips.py
+"""
+Полосовой (strip) рендер финала с ограниченным пиковым потреблением памяти.
+
+Обычный `build_final_to` держит одновременно несколько полноразмерных копий
+листа: L после масштабирования, 1-бит результат (в Pillow — байт на пиксель)
+и буфер кодировщика. Для A3/600 DPI это ~70 Мпикс на копию.
+
+Здесь лист собирается горизонтальными полосами по `STRIP_ROWS` строк:
+- тоновая таблица (`tone_lut`) считается один раз по гистограмме всего оригинала;
+- фильтры применяются к полосе оригинала с запасом строк (`filter_halo`) —
+  внутри полосы результат совпадает с обработкой целого кадра;
+- масштабирование LANCZOS берёт из оригинала только строки, попадающие в окно
+  фильтра для строк выходной полосы (`resize(..., box=...)`);
+- упорядоченный дизеринг и порог — поэлементные, фаза матрицы Bayer сдвигается
+  на номер строки;
+- Floyd–Steinberg переносит состояние между полосами через хвост предыдущей
+  полосы: последние `FS_WARMUP_ROWS` строк дизерятся ещё раз перед новой полосой
+  и отбрасываются. Ошибка на стыке накоплена «как в целом кадре», швов нет,
+  но побитно результат может отличаться от `convert("1")` всего листа;
+- полосы не зависят друг от друга и считаются в пуле потоков (`app.render.parallel`)
+  с ограниченным окном; результат не зависит от числа потоков;
+- BMP, PNG и TIFF кодируются потоково по мере готовности полос (`app.render.encoders`).
+
+Пиковая память — оригинал (он уже в памяти/кеше) плюс несколько полос листа,
+независимо от формата листа и DPI. JPEG потоково не кодируется — для него
+остаётся обычный путь.
+"""
+from __future__ import annotations
+import math
+import os
+from typing import BinaryIO, Iterator, Literal, Optional, Tuple
+
+from PIL import Image
+
+from app.render.pipeline import (RESAMPLE, ProcState, a_series_pixels, a_series_pixels_oriented, apply_dither,
+                                 apply_filters, build_final_to, fill_box, filter_halo, final_filename, to_gray,
+                                 tone_lut)
+from app.render.encoders import STREAM_FORMATS, STRIP_ROWS, open_writer
+from app.render.parallel import ordered_map
+from app.render.sheet_pool import get_sheet_pool
+
+# Лист больше этого числа пикселей рендерится полосами (A4/600 ≈ 35 Мпикс, A3/300 ≈ 17 Мпикс)
+STRIP_MIN_PIXELS = int(os.getenv("RENDER_STRIP_MIN_PIXELS", 20_000_000))
+# Сколько строк предыдущей полосы «прогревают» ошибку Floyd–Steinberg
+FS_WARMUP_ROWS = int(os.getenv("RENDER_FS_WARMUP_ROWS", 32))
+
+LANCZOS_SUPPORT = 3.0
+
+
+def use_strips(st: ProcState, size: Literal["A4", "A3"], fp: BinaryIO) -> bool:
+    """Полосовой путь: большой лист, потоковый формат и файл с произвольным доступом (BMP пишется снизу вверх)."""
+    w, h = a_series_pixels(size, st.dpi)
+    return (
+        STRIP_ROWS > 0
+        and w * h >= STRIP_MIN_PIXELS
+        and st.out_format.lower() in STREAM_FORMATS
+        and fp.seekable()
+    )
+
+
+# ---------------------- Сборка листа ----------------------
+
+def sheet_bands(
+    img: Image.Image, st: ProcState, size: Literal["A4", "A3"], base: Optional[Image.Image] = None,
+) -> Tuple[Tuple[int, int], Iterator[Tuple[int, Image.Image]]]:
+    """Размер листа и полосы 1-бит листа `(y0, полоса)` по порядку; полосы можно вернуть в пул.
+
+    `base` — уже обработанный оригинал (`adjust_image_base`), если он посчитан
+    заранее (экспорт нескольких листов): тогда полоса просто вырезается из него.
+    """
+    landscape = img.width > img.height
+    tw, th = a_series_pixels_oriented(size, st.dpi, landscape)
+    box = fill_box(img.size, (tw, th))
+    return (tw, th), region_bands(img, st, box, (tw, th), base)
+
+
+def region_bands(
+    img: Image.Image, st: ProcState, box: Tuple[float, float, float, float], target: Tuple[int, int],
+    base: Optional[Image.Image] = None,
+) -> Iterator[Tuple[int, Image.Image]]:
+    """Область `box` оригинала (координаты могут быть дробными), отмасштабированная в `target`
+    и отдизеренная, — полосами `(y0, полоса)` по порядку."""
+    gray = to_gray(img)
+    lut = tone_lut(gray, st) if base is None else None
+    halo = filter_halo(st)
+
+    tw, th = target
+    bx0, by0, bx1, by1 = box
+    # Целые границы обрезки оригинала; дробный остаток уходит в box у resize
+    cx0, cx1 = math.floor(bx0), min(gray.width, math.ceil(bx1))
+    cy0, cy1 = math.floor(by0), min(gray.height, math.ceil(by1))
+    scale = (by1 - by0) / th
+    support = LANCZOS_SUPPORT * max(scale, 1.0)
+
+    def adjusted(y0: int, y1: int) -> Image.Image:
+        # Строки [y0, y1) обработанного оригинала в пределах обрезки
+        if base is not None:
+            return base.crop((cx0, y0, cx1, y1))
+        a, b = max(0, y0 - halo), min(gray.height, y1 + halo)
+        chunk = gray.crop((0, a, gray.width, b))
+        if lut is not None:
+            chunk = chunk.point(lut)
+        chunk = apply_filters(chunk, st)
+        return chunk.crop((cx0, y0 - a, cx1, y1 - a))
+
+    fs = st.dither not in ("ordered", "none")
+    pool = get_sheet_pool()
+
+    def render_band(oy0: int) -> Image.Image:
+        oy1 = min(th, oy0 + STRIP_ROWS)
+        # FS: строки перед полосой дизерятся ещё раз и отбрасываются — ошибка на стыке «прогрета»
+        wy0 = max(0, oy0 - FS_WARMUP_ROWS) if fs else oy0
+        # Окно LANCZOS для строк [wy0, oy1) — с запасом в строку на округление
+        s0 = max(cy0, math.floor(by0 + wy0 * scale - support) - 1)
+        s1 = min(cy1, math.ceil(by0 + oy1 * scale + support) + 1)
+        band = adjusted(s0, s1).resize(
+            (tw, oy1 - wy0), RESAMPLE, box=(bx0 - cx0, by0 + wy0 * scale - s0, bx1 - cx0, by0 + oy1 * scale - s0),
+        )
+        bw = apply_dither(band, st.dither, wy0)
+        pool.release(band)
+        if wy0 != oy0:
+            bw, full = bw.crop((0, oy0 - wy0, tw, bw.height)), bw
+            pool.release(full)
+        return bw
+
+    # Полосы независимы — считаются в пуле потоков, отдаются по порядку
+    bands = range(0, th, STRIP_ROWS)
+    return zip(bands, ordered_map(render_band, bands))
+
+
+def build_final_strips_to(img: Image.Image, st: ProcState, size: Literal["A4", "A3"], fp: BinaryIO) -> str:
+    """То же, что `build_final_to` (fill + авто-альбомная ориентация), но полосами."""
+    fmt = st.out_format.lower()
+    if fmt not in STREAM_FORMATS:
+        return build_final_to(img, st, size, fp)
+
+    (tw, th), bands = sheet_bands(img, st, size)
+    writer = open_writer(fmt, fp, tw, th, st.dpi, STRIP_ROWS, st.dither)
+    pool = get_sheet_pool()
+    for oy0, bw in bands:
+        writer.write(bw, oy0)
+        pool.release(bw)
+    writer.close()
+
+    return final_filename(st, size)
@@ -0,0 +1,114 @@
+# app/render/tasks.py
+"""
+Точки входа, которые выполняются в процессах пула рендеринга.
+
+Источник — байты (маленькие файлы дешевле пиклить), `ShmHandle` с оригиналом
+в разделяемой памяти или `ImageHandle` с уже декодированным изображением из
+кеша. Результат пишется в выходной сегмент или во временный файл (путь), если
+они переданы; тогда возвращается только длина записанных данных.
+"""
+from __future__ import annotations
+import io
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterator, Literal, Tuple, TypeVar, Union
+
+from PIL import Image
+
+from app.render.export import build_export_to, export_capacity
+from app.render.laser import build_laser_to
+from app.render.pipeline import LASER_FORMATS, ProcState, build_final_to, build_preview_to, final_capacity
+from app.render.poster import PosterSpec, build_poster_to, poster_capacity
+from app.render.sheet_pool import get_sheet_pool
+from app.render.shm import BufferOverflow, ImageHandle, ShmHandle, ShmWriter, attach, create_image_segment, open_image
+from app.render.strips import build_final_strips_to, use_strips
+
+Source = Union[bytes, ShmHandle, ImageHandle]
+Output = Union[ShmHandle, str, None]  # выходной сегмент, путь к файлу или ничего (вернуть байты)
+Result = Union[bytes, int]  # байты результата или длина, записанная в выход
+T = TypeVar("T")
+
+
+def _decode(fp) -> Image.Image:
+    # Конвейер начинается с grayscale(RGB) — храним сразу L: втрое меньше памяти,
+    # а повторный перевод L→RGB→L даёт те же значения
+    with Image.open(fp) as img:
+        return img.convert("RGB").convert("L")
+
+
+@contextmanager
+def _source(src: Source) -> Iterator[Image.Image]:
+    if isinstance(src, ImageHandle):
+        with attach(src.name) as m:
+            yield open_image(m.buf, src)
+    elif isinstance(src, ShmHandle):
+        with attach(src.name) as m:
+            # mmap — файлоподобный объект: Pillow декодирует прямо из сегмента
+            yield _decode(m.mmap)
+    else:
+        yield _decode(io.BytesIO(src))
+
+
+def _emit(out: Output, render: Callable[[BinaryIO], T], capacity: int = 0) -> Tuple[Result, T]:
+    if isinstance(out, str):
+        # Большой финал — сразу в файл, откуда его и загрузят в Telegram
+        with open(out, "wb") as fp:
+            value = render(fp)
+            return fp.seek(0, io.SEEK_END), value
+    if out is not None:
+        with attach(out.name) as m:
+            with ShmWriter(m.buf[:out.size]) as writer:
+                try:
+                    value = render(writer)
+                    return writer.size, value
+                except BufferOverflow:
+                    pass  # не влезло — отдаём байтами через pickle
+    if capacity:
+        # Буфер известного размера из пула процесса вместо растущего BytesIO
+        pool = get_sheet_pool()
+        buf = pool.buffer(capacity)
+        try:
+            with ShmWriter(memoryview(buf)) as writer:
+                try:
+                    value = render(writer)
+                    return memoryview(buf)[:writer.size].tobytes(), value
+                except BufferOverflow:
+                    pass
+        finally:
+            pool.release_buffer(buf)
+    bio = io.BytesIO()
+    value = render(bio)
+    return bio.getvalue(), value
+
+
+def decode_task(src: Union[bytes, ShmHandle]) -> ImageHandle:
+    """Декодировать оригинал в новый сегмент (для кеша декодированных изображений)."""
+    with _source(src) as img:
+        return create_image_segment(img)
+
+
+def preview_task(src: Source, out: Output, st: ProcState) -> Tuple[Result, str]:
+    with _source(src) as img:
+        return _emit(out, lambda fp: build_preview_to(img, st, fp))
+
+
+def final_task(src: Source, out: Output, st: ProcState, size: Literal["A4", "A3"]) -> Tuple[Result, str]:
+    def render(fp: BinaryIO) -> str:
+        if st.out_format.lower() in LASER_FORMATS:
+            # Программа для лазера — всегда полосами, текст пишется по мере готовности полос
+            return build_laser_to(img, st, size, fp)
+        # Большие листы — полосами, с потоковым кодированием (пиковая память ~ несколько полос)
+        build = build_final_strips_to if use_strips(st, size, fp) else build_final_to
+        return build(img, st, size, fp)
+
+    with _source(src) as img:
+        return _emit(out, render, final_capacity(st, size))
+
+
+def export_task(src: Source, out: Output, st: ProcState) -> Tuple[Result, str]:
+    with _source(src) as img:
+        return _emit(out, lambda fp: build_export_to(img, st, fp), export_capacity(st))
+
+
+def poster_task(src: Source, out: Output, st: ProcState, spec: PosterSpec) -> Tuple[Result, str]:
+    with _source(src) as img:
+        return _emit(out, lambda fp: build_poster_to(img, st, spec, fp), poster_capacity(st, spec))
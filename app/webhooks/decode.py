@@ -0,0 +1,47 @@
+# app/webhooks/decode.py
+"""
+Быстрый разбор тела вебхука.
+
+- Тип апдейта (`message`, `callback_query`, …) читается регулярным выражением
+  из начала тела: Telegram кладёт `update_id` первым, и следом — ключ события.
+  Апдейты типов, на которые нет хендлеров, отбрасываются без разбора JSON.
+  Если начало тела другое — тип неизвестен, апдейт разбирается полностью.
+  Оттуда же — `update_id` для отсева повторных доставок (`app.db.updates`).
+- Остальные валидируются прямо из байтов (`parse_update`: `model_validate_json`, без
+  промежуточных словарей `json.loads`) и сразу с контекстом бота: иначе
+  `Dispatcher.feed_update` сам пересоздаёт апдейт через `model_dump` и
+  повторную валидацию.
+
+Оба шага вызывает `handle_webhook` (`run.py`), и их же меряет
+`python -m scripts.bench.webhook`.
+"""
+from __future__ import annotations
+import re
+from typing import Collection, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import Update
+from pydantic import ValidationError
+
+_HEAD = re.compile(rb'\s*\{\s*"update_id"\s*:\s*(-?\d+)\s*,\s*"([a-z_]+)"\s*:')
+
+
+def update_head(body: bytes) -> Optional[Tuple[int, str]]:
+    """`(update_id, тип)` по началу тела или None, если тело начинается не как у Telegram."""
+    m = _HEAD.match(body)
+    return (int(m.group(1)), m.group(2).decode()) if m else None
+
+
+def is_unhandled(head: Optional[Tuple[int, str]], used: Collection[str]) -> bool:
+    """True — тип апдейта известен, и хендлеров на него нет (можно ответить 200 сразу)."""
+    return head is not None and head[1] not in used
+
+
+def parse_update(body: bytes, bot: Bot) -> Update:
+    """Апдейт из байтов тела, сразу с контекстом бота; при ошибке — `ValidationError`."""
+    return Update.model_validate_json(body, context={"bot": bot})
+
+
+def is_json_error(ve: ValidationError) -> bool:
+    """Ошибка `model_validate_json` — битый JSON (400), а не неподходящий апдейт (422)."""
+    return any(err["type"] == "json_invalid" for err in ve.errors())
@@ -0,0 +1,107 @@
+# app/webhooks/queue.py
+"""
+Быстрое подтверждение вебхука: апдейт — в очередь, ответ 200 — сразу.
+
+Без очереди `handle_webhook` держит HTTP-запрос открытым, пока хендлер не
+закончит: финал A3 рендерится десятки секунд, Telegram не дожидается ответа
+и доставляет тот же апдейт повторно. В режиме `WEBHOOK_ACK_FAST` апдейт
+только разбирается и проверяется, кладётся в ограниченную очередь процесса
+(`WEBHOOK_QUEUE_SIZE`), и запрос сразу получает 200; очередь разбирают
+`WEBHOOK_QUEUE_WORKERS` задач (как `handle_as_tasks` при polling — апдейты
+обрабатываются параллельно).
+
+- Очередь полна — апдейт не принят (ответ 429), Telegram доставит его позже:
+  память воркера не растёт без предела.
+- Ошибки хендлеров после подтверждения уже не вернуть Telegram — они
+  логируются и считаются в `failed`.
+- При остановке (`stop`) новые апдейты не принимаются, а принятые
+  дорабатываются до `WEBHOOK_DRAIN_TIMEOUT` секунд; что не успело — в лог.
+- `stats()` — глубина очереди, её пик, обрабатываемые сейчас и счётчики.
+"""
+from __future__ import annotations
+import asyncio
+from typing import Awaitable, Callable, List
+
+from aiogram.types import Update
+
+from app.utils.logger import logger
+
+Handle = Callable[[Update], Awaitable[int]]
+
+
+class UpdateQueue:
+    def __init__(self, handle: Handle, size: int, workers: int):
+        self.handle = handle
+        self.workers = max(1, workers)
+        self._queue: asyncio.Queue[Update] = asyncio.Queue(maxsize=max(1, size))
+        self._tasks: List[asyncio.Task] = []
+        self._closed = False
+        self._inflight = 0
+        self._peak = 0
+        self._accepted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+        logger.info(f"Webhook queue: {self.workers} workers, up to {self._queue.maxsize} pending updates")
+
+    def submit(self, update: Update) -> bool:
+        """Поставить апдейт в очередь; False — очередь полна или закрыта."""
+        if self._closed:
+            self._rejected += 1
+            return False
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self._rejected += 1
+            logger.warning(f"Webhook queue is full ({self._queue.maxsize}), update {update.update_id} rejected")
+            return False
+        self._accepted += 1
+        self._peak = max(self._peak, self._queue.qsize())
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            update = await self._queue.get()
+            self._inflight += 1
+            try:
+                status = await self.handle(update)
+            except Exception as e:
+                logger.error(f"Webhook queue: update {update.update_id} failed: {e}", exc_info=True)
+                status = 500
+            finally:
+                self._inflight -= 1
+                self._queue.task_done()
+            self._processed += 1
+            if status != 200:
+                self._failed += 1
+
+    async def stop(self, timeout: float) -> None:
+        """Перестать принимать апдейты и доработать принятые (не дольше `timeout` секунд)."""
+        self._closed = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook queue: drain timed out, {self._queue.qsize()} queued and "
+                           f"{self._inflight} running updates dropped")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "peak": self._peak,
+            "inflight": self._inflight,
+            "workers": self.workers,
+            "accepted": self._accepted,
+            "rejected": self._rejected,
+            "processed": self._processed,
+            "failed": self._failed,
+            "closed": self._closed,
+        }
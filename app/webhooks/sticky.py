@@ -0,0 +1,189 @@
+# app/webhooks/sticky.py
+"""
+Липкая маршрутизация апдейтов: каждый пользователь обрабатывается «своим» воркером.
+
+gunicorn раздаёт POST-запросы вебхука воркерам как придётся, и кеши в памяти
+процесса (декодированные оригиналы, превью) размазываются по всем воркерам —
+в основном промахи. В липком режиме воркер, принявший апдейт, вычисляет
+владельца пользователя и, если это не он сам, передаёт сырое тело апдейта
+владельцу через его Unix-сокет; ответ (HTTP-статус) возвращается обратно.
+
+- Владелец — rendezvous (HRW) хеш `user_id` по живым воркерам: при уходе
+  воркера переезжают только его пользователи, при возвращении — возвращаются.
+- Живые воркеры — по сокетам `<WEBHOOK_STICKY_DIR>/<prefix><WORKER_ID>.sock`
+  (список перечитывается раз в `REFRESH_SEC`); воркер, к которому не удалось
+  подключиться, на `DEAD_SEC` исключается из расчёта.
+- Если до владельца не достучаться, апдейт обрабатывается на месте: липкость —
+  оптимизация, а не условие корректности. Ошибка после отправки — ответ 502:
+  тело уже у владельца, и обработка могла начаться, поэтому здесь апдейт не
+  обрабатывается, а повторная доставка Telegram отсекается по `update_id`
+  (`app.db.updates`).
+
+Протокол сокета: запрос — длина (`<I`) и тело апдейта, ответ — статус (`<H`).
+Соединения к соседям переиспользуются.
+"""
+from __future__ import annotations
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.utils.logger import logger
+
+REFRESH_SEC = 2.0
+DEAD_SEC = 5.0
+MAX_IDLE_CONNECTIONS = 4
+
+_LEN = struct.Struct("<I")
+_STATUS = struct.Struct("<H")
+
+Process = Callable[[bytes], Awaitable[int]]
+Conn = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+def update_user_id(data: Dict[str, Any]) -> Optional[int]:
+    """Пользователь апдейта (`from` события, иначе чат) или None."""
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        who = value.get("from") or value.get("user") or value.get("chat")
+        if isinstance(who, dict) and isinstance(who.get("id"), int):
+            return who["id"]
+    return None
+
+
+def _score(user_id: int, worker: str) -> int:
+    digest = hashlib.blake2b(f"{user_id}:{worker}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def owner_of(user_id: int, workers: List[str]) -> str:
+    """Rendezvous-хеш: воркер с наибольшим весом для пары (пользователь, воркер)."""
+    return max(workers, key=lambda w: _score(user_id, w))
+
+
+class StickyDispatcher:
+    def __init__(self, worker_id: str, socket_dir: str, prefix: str, process: Process, timeout: float):
+        self.worker_id = worker_id
+        self.socket_dir = socket_dir
+        self.prefix = prefix
+        self.process = process
+        self.timeout = timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._live: List[str] = [worker_id]
+        self._live_at = 0.0
+        self._dead: Dict[str, float] = {}
+        self._idle: Dict[str, List[Conn]] = {}
+        self._peers: Set[asyncio.StreamWriter] = set()  # входящие соединения от соседей
+
+    def _path(self, worker: str) -> str:
+        return os.path.join(self.socket_dir, f"{self.prefix}{worker}.sock")
+
+    # ---------------------- Сервер владельца ----------------------
+
+    async def start(self) -> None:
+        path = self._path(self.worker_id)
+        try:
+            os.unlink(path)  # сокет прежнего процесса с тем же WORKER_ID
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._serve, path)
+        logger.info(f"Sticky dispatch: worker {self.worker_id} listens on {path}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            try:
+                os.unlink(self._path(self.worker_id))
+            except FileNotFoundError:
+                pass
+            for writer in list(self._peers):
+                writer.close()  # сервер сам не закрывает уже принятые соединения
+            await self._server.wait_closed()
+            self._server = None
+        for conns in self._idle.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._peers.add(writer)
+        try:
+            while True:
+                (size,) = _LEN.unpack(await reader.readexactly(_LEN.size))
+                body = await reader.readexactly(size)
+                status = await self.process(body)
+                writer.write(_STATUS.pack(status))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    # ---------------------- Маршрутизация ----------------------
+
+    def live_workers(self) -> List[str]:
+        now = time.monotonic()
+        if now - self._live_at > REFRESH_SEC:
+            head, tail = len(self.prefix), len(".sock")
+            found = {os.path.basename(p)[head:-tail] for p in glob.glob(self._path("*"))}
+            found.add(self.worker_id)
+            self._live, self._live_at = sorted(found), now
+        return [w for w in self._live if w == self.worker_id or self._dead.get(w, 0.0) < now]
+
+    async def dispatch(self, body: bytes, user_id: Optional[int]) -> int:
+        """Обработать апдейт здесь или у воркера-владельца; вернуть HTTP-статус."""
+        if user_id is None:
+            return await self.process(body)
+        owner = owner_of(user_id, self.live_workers())
+        if owner == self.worker_id:
+            return await self.process(body)
+        try:
+            conn = await self._connect(owner)
+        except OSError as e:
+            # Владелец недоступен (перезапуск) — пользователи переедут к остальным
+            logger.warning(f"Sticky dispatch: worker {owner} unavailable ({e}), handling locally")
+            self._dead[owner] = time.monotonic() + DEAD_SEC
+            return await self.process(body)
+        reader, writer = conn
+        try:
+            writer.write(_LEN.pack(len(body)) + body)
+            await writer.drain()
+            (status,) = _STATUS.unpack(await asyncio.wait_for(reader.readexactly(_STATUS.size), self.timeout))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError) as e:
+            # Тело уже у владельца (возможно, ещё рендерится) — не дублируем ни здесь, ни при повторе
+            logger.error(f"Sticky dispatch: forwarding to worker {owner} failed: {e!r}")
+            writer.close()
+            self._dead[owner] = time.monotonic() + DEAD_SEC
+            return 502
+        self._release(owner, conn)
+        return status
+
+    async def _connect(self, worker: str) -> Conn:
+        idle = self._idle.get(worker)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return await asyncio.open_unix_connection(self._path(worker))
+
+    def _release(self, worker: str, conn: Conn) -> None:
+        idle = self._idle.setdefault(worker, [])
+        if len(idle) < MAX_IDLE_CONNECTIONS:
+            idle.append(conn)
+        else:
+            conn[1].close()
+
+
+def parse_user_id(body: bytes) -> Optional[int]:
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    return update_user_id(data) if isinstance(data, dict) else None
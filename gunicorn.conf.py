@@ -1,11 +1,53 @@
 # gunicorn.conf.py
 import multiprocessing
+import os
+import subprocess
+import sys
 
 bind = "0.0.0.0:49556"
 workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "uvicorn.workers.UvicornWorker"
 timeout = 120
+graceful_timeout = 90  # > WEBHOOK_DRAIN_TIMEOUT: очередь апдейтов успевает доработать
 loglevel = "info"
 preload_app = True
 accesslog = "-"
-errorlog = "-"
\ No newline at end of file
+errorlog = "-"
+
+# Демон рендеринга — один на хост, общий для всех uvicorn-воркеров (RENDER_MODE=daemon)
+_render_daemon = None
+
+
+def on_starting(server):
+    global _render_daemon
+    # Общий кеш состояния пользователей — с чистого листа (записям прошлого запуска не доверяем)
+    from app.db import state_cache
+    state_cache.reset()
+
+    from app.core.config import get_render_settings
+    cfg = get_render_settings()
+    if cfg.RENDER_MODE == "daemon" and cfg.RENDER_DAEMON_SPAWN:
+        _render_daemon = subprocess.Popen([sys.executable, "-m", "app.render.daemon"])
+        server.log.info(f"Render daemon started (pid {_render_daemon.pid})")
+
+
+# Стабильные номера воркеров (WORKER_ID): перезапущенный воркер получает номер
+# умершего — липкая маршрутизация апдейтов (app.webhooks.sticky) возвращает ему
+# тех же пользователей, а setup_webhook выполняет ровно один воркер "0"
+def pre_fork(server, worker):
+    # server.WORKERS — живые воркеры (умершие уже убраны мастером): берём наименьший свободный номер
+    used = {getattr(w, "worker_id", None) for w in server.WORKERS.values()}
+    worker.worker_id = next(i for i in range(len(used) + 1) if i not in used)
+
+
+def post_fork(server, worker):
+    os.environ["WORKER_ID"] = str(worker.worker_id)
+
+
+def on_exit(server):
+    if _render_daemon is not None and _render_daemon.poll() is None:
+        _render_daemon.terminate()
+        try:
+            _render_daemon.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _render_daemon.kill()
@@ -1,10 +1,12 @@
 # app/run.py
 import os
+import secrets
+import time
 import uvicorn
 from aiogram.exceptions import TelegramAPIError
 from aiogram.types import Update
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, Request
 from fastapi.exceptions import HTTPException
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -12,17 +14,30 @@ from fastapi.staticfiles import StaticFiles
 from pydantic import ValidationError
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.core.config import BASE_PATH, debug_mode, get_cors_settings, get_webhooks_setting, get_project_path_settings
-from app.bot import bot, dp, setup_webhook, remove_webhook, start_polling
+from app.core.config import BASE_PATH, admin_token_env, debug_mode, get_cors_settings, get_webhooks_setting, get_project_path_settings
+from app.bot import ALLOWED_UPDATES, bot, dp, setup_webhook, remove_webhook, start_polling
+from app.db import aio as db_aio
+from app.db import aio_events, aio_stats, aio_updates, backend as db_backend, maintenance as db_maintenance, state_cache
+from app.render import service as render_service
 from app.utils.logger import logger
 from app.webhooks.handlers import router
+from app.webhooks.decode import is_json_error, is_unhandled, parse_update, update_head
+from app.webhooks.queue import UpdateQueue
+from app.webhooks.sticky import StickyDispatcher, parse_user_id
 
+# Липкая маршрутизация апдейтов по воркерам (WEBHOOK_STICKY); None — обрабатываем на месте
+_STICKY = None
+# Очередь апдейтов с быстрым подтверждением (WEBHOOK_ACK_FAST); None — ответ после обработки
+_QUEUE = None
 
 
 @asynccontextmanager
 async def lifespan(application: FastAPI):
+    global _STICKY, _QUEUE
     if debug_mode():
         import asyncio
+        state_cache.reset()  # один процесс: таблица прошлого запуска не нужна
+        db_maintenance.start()
         asyncio.create_task(start_polling())
     else:
         # Только первый Gunicorn worker выполняет setup_webhook
@@ -31,9 +46,31 @@ async def lifespan(application: FastAPI):
         if worker_id is None or worker_id == "0":
             logger.info(f"🐙*** {worker_id} ВОРКЕР GUVICORN ВЫПОЛНЯЕТ setup_webhook ***")
             await setup_webhook()
+            db_maintenance.start()  # обслуживание БД — тоже в одном воркере
+        cfg = get_webhooks_setting()
+        if cfg.WEBHOOK_ACK_FAST:
+            _QUEUE = UpdateQueue(feed_update, cfg.WEBHOOK_QUEUE_SIZE, cfg.WEBHOOK_QUEUE_WORKERS)
+            _QUEUE.start()
+        if cfg.WEBHOOK_STICKY and worker_id is not None:
+            _STICKY = StickyDispatcher(worker_id, cfg.WEBHOOK_STICKY_DIR, cfg.WEBHOOK_STICKY_PREFIX,
+                                       process_update, cfg.WEBHOOK_STICKY_TIMEOUT)
+            await _STICKY.start()
 
     yield
 
+    if _STICKY is not None:
+        await _STICKY.stop()
+    if _QUEUE is not None:
+        # Принятые (уже подтверждённые) апдейты дорабатываем, пока пул рендеринга и БД живы
+        await _QUEUE.stop(get_webhooks_setting().WEBHOOK_DRAIN_TIMEOUT)
+
+    await db_maintenance.stop()
+    render_service.shutdown()
+    await aio_stats.close()  # накопленные счётчики статистики — в БД до остановки писателя
+    await aio_events.close()  # и журнал использования
+    await db_backend.close()
+    db_aio.shutdown()
+
     if not debug_mode():
         # Только первый worker убирает вебхук
         worker_id = os.getenv("WORKER_ID")
@@ -72,42 +109,78 @@ for route, path in get_project_path_settings().static_mounts.items():
 app.include_router(router)
 
 
+_STATUS_DETAIL = {
+    400: "Malformed JSON data",
+    422: "Invalid update format",
+    429: "Too many pending updates",
+    502: "Telegram API error",
+    503: "Database operation failed",
+    500: "Internal server error",
+}
+# Ответы, при которых обработка апдейта точно не начиналась: только тогда
+# отметка update_id снимается и повторная доставка будет обработана
+_NOT_STARTED = frozenset({400, 422, 429})
+
+
+async def process_update(body: bytes) -> int:
+    """Разобрать и обработать апдейт; вернуть HTTP-статус (общий путь для своих и пересланных)."""
+    # 1. Валидация прямо из байтов, сразу с ботом (`app.webhooks.decode`)
+    try:
+        update = parse_update(body, bot)
+    except ValidationError as ve:
+        if is_json_error(ve):
+            logger.error(f"JSON parsing error: {ve}")
+            return 400
+        logger.error(f"Validation error: {ve}")
+        return 422
+
+    # 2. Обработка обновления: сейчас или в очереди (тогда ответ — сразу)
+    if _QUEUE is not None:
+        return 200 if _QUEUE.submit(update) else 429
+    return await feed_update(update)
+
+
+async def feed_update(update: Update) -> int:
+    """Обработать разобранный апдейт; вернуть HTTP-статус."""
+    try:
+        await dp.feed_update(bot, update)
+    except TelegramAPIError as te:
+        logger.error(f"Telegram API error: {te}")
+        return 502
+    except SQLAlchemyError as se:
+        logger.critical(f"Database error: {se}")
+        return 503
+    except Exception as exp:
+        logger.error(f"Unexpected processing error: {exp}")
+        return 500
+    return 200
+
+
+async def _dispatch(body: bytes) -> int:
+    if _STICKY is not None:
+        # Липкий режим: апдейт обрабатывает воркер-владелец пользователя
+        return await _STICKY.dispatch(body, parse_user_id(body))
+    return await process_update(body)
+
+
 @app.post(get_webhooks_setting().WEBHOOK_PATH)
 async def handle_webhook(request: Request):
     try:
-        # 1. Парсинг входящего JSON
-        try:
-            json_data = await request.json()
-            update = Update.model_validate(json_data)
-        except ValidationError as ve:
-            logger.error(f"Validation error: {ve}")
-            raise HTTPException(status_code=422, detail="Invalid update format")
-        except Exception as exp:
-            logger.error(f"JSON parsing error: {exp}")
-            raise HTTPException(status_code=400, detail="Malformed JSON data")
-
-        # 2. Обработка обновления
-        try:
-            await dp.feed_update(bot, update)
-        except TelegramAPIError as te:
-            logger.error(f"Telegram API error: {te}")
-            raise HTTPException(
-                status_code=502,
-                detail=f"Telegram API error: {te.message}"
-            )
-        except SQLAlchemyError as se:
-            logger.critical(f"Database error: {se}")
-            await request.app.state.db_session.rollback()
-            raise HTTPException(
-                status_code=503,
-                detail="Database operation failed"
-            )
-        except Exception as exp:
-            logger.error(f"Unexpected processing error: {exp}")
-            raise HTTPException(
-                status_code=500,
-                detail="Internal server error"
-            )
+        body = await request.body()
+        head = update_head(body)
+        update_id = head[0] if head is not None and get_webhooks_setting().WEBHOOK_DEDUP else None
+        if is_unhandled(head, ALLOWED_UPDATES):
+            # Тип, на который нет хендлеров (подписка не успела смениться), — без разбора
+            status = 200
+        elif update_id is not None and not await aio_updates.claim(update_id):
+            # Повторная доставка (в этот или другой воркер): апдейт уже обработан или обрабатывается
+            status = 200
+        else:
+            status = await _dispatch(body)
+            if status in _NOT_STARTED and update_id is not None:
+                await aio_updates.release(update_id)  # Telegram повторит — повтор должен пройти
+        if status != 200:
+            raise HTTPException(status_code=status, detail=_STATUS_DETAIL.get(status, "Internal server error"))
 
         return JSONResponse(
             status_code=200,
@@ -131,6 +204,46 @@ async def handle_webhook(request: Request):
 def health():
     return {"status": "ok"}
 
+
+def _check_admin(x_admin_token: str) -> None:
+    """Эндпоинты /admin/* выключены без ADMIN_API_TOKEN и требуют его в X-Admin-Token."""
+    token = admin_token_env()
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(x_admin_token.encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.get("/admin/usage", tags=["Admin"])
+async def admin_usage(
+    grain: str = "hour",
+    since: float | None = None,
+    until: float | None = None,
+    group_by: str = "",
+    x_admin_token: str = Header(default=""),
+):
+    """
+    Сводки журнала использования (`app.db.events`) за `[since, until)` (unix-время;
+    по умолчанию — последние сутки) по корзинам `grain` (`hour`/`day`),
+    сгруппированные по `group_by` (через запятую: kind,size,dpi,fmt,dither,status).
+    """
+    _check_admin(x_admin_token)
+    until = time.time() if until is None else until
+    since = until - 86400 if since is None else since
+    dims = [d.strip() for d in group_by.split(",") if d.strip()]
+    try:
+        rows = await aio_events.rollups(grain, since, until, dims)
+    except ValueError as ve:
+        raise HTTPException(status_code=422, detail=str(ve))
+    return {"grain": grain, "since": since, "until": until, "group_by": dims, "rows": rows}
+
+
+@app.get("/admin/updates", tags=["Admin"])
+async def admin_updates(x_admin_token: str = Header(default="")):
+    """Очередь апдейтов воркера, принявшего запрос (`app.webhooks.queue`); null — режим выключен."""
+    _check_admin(x_admin_token)
+    return {"worker_id": os.getenv("WORKER_ID"), "queue": _QUEUE.stats() if _QUEUE is not None else None}
+
 if __name__ == "__main__":
     import asyncio
     import sys
@@ -0,0 +1,59 @@
+# scripts/bench/common.py
+"""Общие помощники бенчмарков: замер времени, тестовые изображения, таблица результатов."""
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from PIL import Image, ImageFilter
+
+
+def timeit(fn: Callable[[], object], repeat: int = 3) -> float:
+    """Медиана времени `repeat` запусков, мс (первый прогон — прогрев, не учитывается)."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def sample_photo(width: int, height: int, mode: str = "RGB") -> Image.Image:
+    """Синтетическое «фото»: шум с размытием поверх градиента — фильтры и сжатие работают как на реальных снимках."""
+    noise = Image.effect_noise((width, height), 64).filter(ImageFilter.GaussianBlur(2))
+    gradient = Image.linear_gradient("L").resize((width, height))
+    gray = Image.blend(noise, gradient, 0.5)
+    return gray.convert(mode) if mode != "L" else gray
+
+
+def parser(description: str) -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument("--repeat", type=int, default=3, help="запусков на замер (медиана)")
+    p.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    return p
+
+
+def report(title: str, rows: List[Dict[str, object]], as_json: bool = False) -> None:
+    """Таблица Markdown (её можно вставить в PR) или JSON для сравнения прогонов."""
+    if as_json:
+        print(json.dumps({"bench": title, "rows": rows}, ensure_ascii=False, indent=2))
+        return
+    if not rows:
+        return
+    cols = list(rows[0])
+    cells = [[_fmt(r[c]) for c in cols] for r in rows]
+    widths = [max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(cols)]
+    print(f"\n### {title}\n")
+    print("| " + " | ".join(c.ljust(w) for c, w in zip(cols, widths)) + " |")
+    print("|" + "|".join("-" * (w + 2) for w in widths) + "|")
+    for row in cells:
+        print("| " + " | ".join(v.ljust(w) for v, w in zip(row, widths)) + " |")
+
+
+def _fmt(v: object) -> str:
+    if isinstance(v, float):
+        return f"{v:.2f}"
+    return str(v)
@@ -0,0 +1,72 @@
+# scripts/bench/db_calls.py
+"""
+Бенчмарк вызовов БД состояния и статистики: вызовов в секунду, новое соединение vs долгоживущее.
+
+    python -m scripts.bench.db_calls [--calls 2000] [--users 100]
+
+«tap» — то, что делает бот на одно нажатие кнопки настройки: `get_state`,
+`update_fields`, `record_setting_change` и снова `get_state`. Базы — во
+временном каталоге, заполненные `--users` пользователями.
+"""
+from __future__ import annotations
+import os
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from app.core.config import get_database_settings
+from app.db import connection
+from app.db import state as state_db
+from app.db import stats as stats_db
+from scripts.bench.common import parser, report
+
+
+def _tap(uid: int) -> None:
+    state_db.get_state(uid)
+    state_db.update_fields(uid, brightness=1.1)
+    stats_db.record_setting_change(uid)
+    state_db.get_state(uid)
+
+
+def _rate(fn: Callable[[int], None], calls: int, users: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(calls):
+        fn(i % users)
+    return calls / (time.perf_counter() - t0)
+
+
+def main() -> None:
+    p = parser(__doc__.strip().splitlines()[0])
+    p.add_argument("--calls", type=int, default=2000)
+    p.add_argument("--users", type=int, default=100)
+    args = p.parse_args()
+
+    ops: Dict[str, Callable[[int], None]] = {
+        "get_state": state_db.get_state,
+        "update_fields": lambda uid: state_db.update_fields(uid, dither="ordered"),
+        "record_output": stats_db.record_output,
+        "get_user_stats": stats_db.get_user_stats,
+        "tap": _tap,
+    }
+    rows: List[Dict[str, object]] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        state_db.init(os.path.join(tmp, "state.db"))
+        stats_db.init(os.path.join(tmp, "stats.db"))
+        for uid in range(args.users):
+            state_db.ensure_user(uid)
+        results: Dict[str, Dict[str, float]] = {}
+        for mode, persistent in (("per call", "0"), ("persistent", "1")):
+            os.environ["SQLITE_PERSISTENT"] = persistent
+            get_database_settings.cache_clear()
+            for name, fn in ops.items():
+                fn(0)  # прогрев: соединение и кеш запросов
+                results.setdefault(name, {})[mode] = max(_rate(fn, args.calls, args.users) for _ in range(args.repeat))
+            connection.close()
+        for name, r in results.items():
+            rows.append({"call": name, "per call, /s": r["per call"], "persistent, /s": r["persistent"],
+                         "speedup": r["persistent"] / r["per call"]})
+    report("SQLite calls per second", rows, args.json)
+
+
+if __name__ == "__main__":
+    main()
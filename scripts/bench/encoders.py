@@ -0,0 +1,93 @@
+# scripts/bench/encoders.py
+"""
+Бенчмарк кодировщиков 1-бит листа: размер и время кодирования по DPI.
+
+    python -m scripts.bench.encoders [--size A4] [--dpi 150 300 600]
+
+Для каждого DPI и типа дизеринга кодируется один и тот же лист всеми
+вариантами (Pillow «как было» и кодировщики `app.render.encoders`);
+отмечается вариант, который выбирает `auto`.
+"""
+from __future__ import annotations
+import io
+import zlib
+from typing import Callable, Dict, List
+
+from PIL import Image
+
+from app.render import encoders as enc
+from app.render.pipeline import (ProcState, a_series_pixels_oriented, adjust_image_base, apply_dither,
+                                 fit_to_aspect)
+from scripts.bench.common import parser, report, sample_photo, timeit
+
+
+def _stream(make: Callable[[io.BytesIO, Image.Image], enc.SheetWriter]) -> Callable[[Image.Image], bytes]:
+    def run(bw: Image.Image) -> bytes:
+        bio = io.BytesIO()
+        writer = make(bio, bw)
+        for y0 in range(0, bw.height, enc.STRIP_ROWS):
+            writer.write(bw.crop((0, y0, bw.width, min(bw.height, y0 + enc.STRIP_ROWS))), y0)
+        writer.close()
+        return bio.getvalue()
+    return run
+
+
+def _pillow(**params) -> Callable[[Image.Image], bytes]:
+    def run(bw: Image.Image) -> bytes:
+        bio = io.BytesIO()
+        bw.save(bio, **params)
+        return bio.getvalue()
+    return run
+
+
+def variants(dpi: int) -> Dict[str, Callable[[Image.Image], bytes]]:
+    out: Dict[str, Callable[[Image.Image], bytes]] = {
+        "bmp (Pillow)": _pillow(format="BMP", dpi=(dpi, dpi)),
+        "png (Pillow, level 6)": _pillow(format="PNG", dpi=(dpi, dpi)),
+        "tiff raw (Pillow)": _pillow(format="TIFF", dpi=(dpi, dpi)),
+        "tiff g4 (Pillow)": _pillow(format="TIFF", compression="group4", dpi=(dpi, dpi)),
+    }
+    for name, strategy in (("default", zlib.Z_DEFAULT_STRATEGY), ("rle", zlib.Z_RLE)):
+        for row_filter in ("none", "up", "adaptive"):
+            for level in (6, 9):
+                out[f"png {row_filter}/{name}/{level}"] = _stream(
+                    lambda bio, bw, s=strategy, f=row_filter, lv=level:
+                    enc.PngWriter(bio, bw.width, bw.height, dpi, level=lv, strategy=s, row_filter=f))
+    for compression in ("group4", "deflate"):
+        out[f"tiff {compression} strips"] = _stream(
+            lambda bio, bw, c=compression: enc.TiffWriter(bio, bw.width, bw.height, dpi, enc.STRIP_ROWS, c))
+    return out
+
+
+def auto_label(dither: str) -> List[str]:
+    strategy = "rle" if enc.png_strategy(dither) == zlib.Z_RLE else "default"
+    return [f"png {enc.PNG_FILTER}/{strategy}/{enc.PNG_LEVEL}", f"tiff {enc.tiff_compression(dither)} strips"]
+
+
+def main() -> None:
+    p = parser(__doc__.strip().splitlines()[0])
+    p.add_argument("--size", default="A4", choices=["A4", "A3"])
+    p.add_argument("--dpi", type=int, nargs="+", default=[150, 300, 600])
+    args = p.parse_args()
+
+    src = sample_photo(3000, 2000)
+    rows: List[Dict[str, object]] = []
+    for dpi in args.dpi:
+        for dither in ("fs", "ordered", "none"):
+            st = ProcState(dpi=dpi, dither=dither)
+            target = a_series_pixels_oriented(args.size, dpi, True)
+            bw = apply_dither(fit_to_aspect(adjust_image_base(src, st), target, "fill"), dither)
+            chosen = auto_label(dither)
+            baseline = None
+            for name, fn in variants(dpi).items():
+                size = len(fn(bw))
+                baseline = baseline or size
+                rows.append({
+                    "dpi": dpi, "dither": dither, "encoder": name + (" ← auto" if name in chosen else ""),
+                    "KB": size / 1024, "ms": timeit(lambda: fn(bw), args.repeat), "vs bmp": baseline / size,
+                })
+    report(f"1-bit encoders, {args.size}", rows, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# scripts/bench/export.py
+"""
+Бенчмарк экспорта: все листы архивом против отдельных финалов.
+
+    python -m scripts.bench.export [--dpi 300 600] [--dither fs ordered]
+
+Отдельные финалы — `final_task` на каждый размер и формат из `EXPORT_FORMATS`;
+экспорт — один `export_task`. Печатается процессорное время и проверяется,
+что файлы в архиве совпадают с отдельными финалами.
+"""
+from __future__ import annotations
+import io
+import time
+import zipfile
+from dataclasses import replace
+from typing import Dict, List
+
+from app.render.export import EXPORT_FORMATS, EXPORT_SIZES
+from app.render.pipeline import ProcState
+from app.render.tasks import export_task, final_task
+from scripts.bench.common import parser, report, sample_photo
+
+
+def main() -> None:
+    p = parser(__doc__.strip().splitlines()[0])
+    p.add_argument("--dpi", type=int, nargs="+", default=[300, 600])
+    p.add_argument("--dither", nargs="+", default=["fs", "ordered"])
+    args = p.parse_args()
+
+    bio = io.BytesIO()
+    sample_photo(4000, 3000).save(bio, "JPEG", quality=90)
+    data = bio.getvalue()
+    rows: List[Dict[str, object]] = []
+    for dpi in args.dpi:
+        for dither in args.dither:
+            st = ProcState(dpi=dpi, dither=dither, contrast=1.3, denoise_size=3)
+            t0 = time.process_time()
+            finals = {}
+            for size in EXPORT_SIZES:
+                for fmt in EXPORT_FORMATS:
+                    res, name = final_task(data, None, replace(st, out_format=fmt), size)
+                    finals[name] = res
+            separate = time.process_time() - t0
+            t0 = time.process_time()
+            archive, _ = export_task(data, None, st)
+            combined = time.process_time() - t0
+            with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+                identical = sorted(zf.namelist()) == sorted(finals) and all(zf.read(n) == finals[n] for n in finals)
+            rows.append({
+                "dpi": dpi, "dither": dither, "files": len(finals),
+                "separate CPU, s": separate, "export CPU, s": combined, "saving": separate / combined,
+                "zip, KB": len(archive) / 1024, "identical": identical,
+            })
+    report(f"export all ({', '.join(EXPORT_SIZES)} × {', '.join(EXPORT_FORMATS)})", rows, args.json)
+
+
+if __name__ == "__main__":
+    main()
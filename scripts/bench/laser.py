@@ -0,0 +1,73 @@
+# scripts/bench/laser.py
+"""
+Бенчмарк программ для лазера (G-code, SVG): размер программы и скорость генерации по DPI.
+
+    python -m scripts.bench.laser [--size A4] [--dpi 150 300 600]
+
+Лист строится полосами, как в боте; программа пишется в счётчик байт (на диск
+ничего не попадает). Время — полный путь: обработка, дизеринг и текст.
+Для сравнения — размер того же листа в BMP и PNG.
+"""
+from __future__ import annotations
+import io
+from dataclasses import replace
+from typing import Dict, List
+
+from app.render.laser import build_laser_to, row_runs
+from app.render.pipeline import ProcState
+from app.render.strips import build_final_strips_to, sheet_bands
+from scripts.bench.common import parser, report, sample_photo, timeit
+
+
+class _Counter(io.RawIOBase):
+    """Файл, который только считает записанные байты."""
+
+    def __init__(self) -> None:
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.size += len(b)
+        return len(b)
+
+
+def _size(fn) -> int:
+    sink = _Counter()
+    fn(sink)
+    return sink.size
+
+
+def main() -> None:
+    p = parser(__doc__.strip().splitlines()[0])
+    p.add_argument("--size", default="A4", choices=["A4", "A3"])
+    p.add_argument("--dpi", type=int, nargs="+", default=[150, 300, 600])
+    args = p.parse_args()
+
+    src = sample_photo(3000, 2000, "L")
+    rows: List[Dict[str, object]] = []
+    for dpi in args.dpi:
+        for dither in ("fs", "ordered", "none"):
+            st = ProcState(dpi=dpi, dither=dither)
+            (w, h), bands = sheet_bands(src, st, args.size)
+            runs = sum(len(r) for _, band in bands for r in row_runs(band))
+            raster = {}
+            for fmt in ("bmp", "png"):
+                bio = io.BytesIO()  # BMP пишется снизу вверх — нужен файл с произвольным доступом
+                build_final_strips_to(src, replace(st, out_format=fmt), args.size, bio)
+                raster[fmt] = bio.tell()
+            for fmt in ("gcode", "svg"):
+                laser = replace(st, out_format=fmt)
+                size = _size(lambda fp: build_laser_to(src, laser, args.size, fp))
+                ms = timeit(lambda: _size(lambda fp: build_laser_to(src, laser, args.size, fp)), args.repeat)
+                rows.append({
+                    "dpi": dpi, "dither": dither, "format": fmt, "runs": runs, "MB": size / 2**20,
+                    "vs bmp": size / raster["bmp"], "vs png": size / raster["png"],
+                    "ms": ms, "Mpx/s": w * h / ms / 1000,
+                })
+    report(f"laser programs, {args.size}", rows, args.json)
+
+
+if __name__ == "__main__":
+    main()
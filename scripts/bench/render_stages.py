@@ -0,0 +1,86 @@
+# scripts/bench/render_stages.py
+"""
+Бенчмарк стадий конвейера: один поток против полос в пуле потоков.
+
+    python -m scripts.bench.render_stages [--size A3] [--dpi 600] [--threads 0]
+
+Для каждой стадии печатается время в одном потоке, время с полосами и
+ускорение; заодно проверяется, что результат побитно совпадает.
+"""
+from __future__ import annotations
+import io
+import os
+from typing import Callable, Dict, List
+
+from PIL import Image
+
+from app.render import parallel
+from app.render.pipeline import (RESAMPLE, ProcState, a_series_pixels, adjust_image_base, apply_dither,
+                                 apply_filters, tone_lut)
+from app.render.strips import build_final_strips_to
+from scripts.bench.common import parser, report, sample_photo, timeit
+
+
+def stages(sheet: Image.Image, st: ProcState) -> Dict[str, Callable[[], Image.Image]]:
+    lut = tone_lut(sheet, st)
+    return {
+        "tone LUT (point)": lambda: parallel.band_map(sheet, lambda b, _y: b.point(lut)),
+        "sharpen 3×3": lambda: parallel.band_map(
+            sheet, lambda b, _y: apply_filters(b, ProcState(sharpness=2.0)), 1),
+        "median 5×5": lambda: parallel.band_map(
+            sheet, lambda b, _y: apply_filters(b, ProcState(sharpness=1.0, denoise_size=5)), 2),
+        "gaussian r=1.2": lambda: parallel.band_map(
+            sheet, lambda b, _y: apply_filters(b, ProcState(sharpness=1.0, blur_radius=1.2)), 9),
+        "adjust_image_base": lambda: adjust_image_base(sheet, st),
+        "dither ordered": lambda: apply_dither(sheet, "ordered"),
+        "dither threshold": lambda: apply_dither(sheet, "none"),
+    }
+
+
+def main() -> None:
+    p = parser(__doc__.strip().splitlines()[0])
+    p.add_argument("--size", default="A3", choices=["A4", "A3"])
+    p.add_argument("--dpi", type=int, default=600)
+    p.add_argument("--threads", type=int, default=0, help="потоков для параллельного прогона (0 — по числу ядер)")
+    args = p.parse_args()
+
+    st = ProcState(contrast=1.3, gamma=1.2, sharpness=2.0, denoise_size=3, blur_radius=0.8, dpi=args.dpi)
+    w, h = a_series_pixels(args.size, args.dpi)
+    sheet = sample_photo(w // 4, h // 4, "L").resize((w, h), RESAMPLE)
+
+    rows: List[Dict[str, object]] = []
+    threads = args.threads or os.cpu_count() or 1
+    for name, fn in stages(sheet, st).items():
+        parallel.set_threads(1)
+        serial_out = fn()
+        serial = timeit(fn, args.repeat)
+        parallel.set_threads(threads)
+        identical = fn().tobytes() == serial_out.tobytes()
+        banded = timeit(fn, args.repeat)
+        rows.append({
+            "stage": name, "1 thread, ms": serial, f"{threads} threads, ms": banded,
+            "speed-up": serial / banded, "bit-identical": identical,
+        })
+
+    # Полосовой финал целиком: полосы в пуле потоков против одного потока
+    src = sample_photo(4000, 3000)
+    for dither in ("fs", "ordered"):
+        final_st = ProcState(dpi=args.dpi, dither=dither, out_format="bmp")
+        outs, times = {}, {}
+        for n in (1, threads):
+            parallel.set_threads(n)
+            bio = io.BytesIO()
+            build_final_strips_to(src, final_st, args.size, bio)
+            outs[n] = bio.getvalue()
+            times[n] = timeit(lambda: build_final_strips_to(src, final_st, args.size, io.BytesIO()), args.repeat)
+        rows.append({
+            "stage": f"final strips ({dither})", "1 thread, ms": times[1], f"{threads} threads, ms": times[threads],
+            "speed-up": times[1] / times[threads], "bit-identical": outs[1] == outs[threads],
+        })
+
+    parallel.set_threads(0)
+    report(f"render stages, {args.size}/{args.dpi} dpi ({w}×{h}), {threads} threads", rows, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# scripts/bench/sheet_pool.py
+"""
+Бенчмарк пула листовых буферов: серия финалов с пулом и без.
+
+    python -m scripts.bench.sheet_pool [--renders 20] [--size A4] [--dpi 300]
+
+Каждый вариант запускается в отдельном процессе (чистый RSS); печатаются
+время на рендер, прирост пикового RSS и счётчики пула.
+"""
+from __future__ import annotations
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from scripts.bench.common import parser, report, sample_photo
+
+
+def child(renders: int, size: str, dpi: int) -> None:
+    from app.render.pipeline import ProcState
+    from app.render.sheet_pool import get_sheet_pool
+    from app.render.tasks import final_task
+
+    bio = io.BytesIO()
+    sample_photo(3000, 2000).save(bio, "JPEG", quality=90)
+    data = bio.getvalue()
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    for i in range(renders):
+        fmt = ("bmp", "jpg", "png")[i % 3]
+        dither = ("ordered", "fs")[i % 2]
+        final_task(data, None, ProcState(dpi=dpi, out_format=fmt, dither=dither), size)
+    elapsed = (time.perf_counter() - t0) * 1000 / renders
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024
+    print(json.dumps({"ms_per_render": elapsed, "peak_rss_mb": peak, **get_sheet_pool().stats()}))
+
+
+def main() -> None:
+    p = parser(__doc__.strip().splitlines()[0])
+    p.add_argument("--renders", type=int, default=20)
+    p.add_argument("--size", default="A4", choices=["A4", "A3"])
+    p.add_argument("--dpi", type=int, default=300)
+    p.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = p.parse_args()
+    if args.child:
+        child(args.renders, args.size, args.dpi)
+        return
+
+    rows = []
+    for label, budget in (("без пула", "0"), ("с пулом", os.getenv("RENDER_SHEET_POOL_MB", "192"))):
+        env = {**os.environ, "RENDER_SHEET_POOL_MB": budget}
+        cmd = [sys.executable, "-m", "scripts.bench.sheet_pool", "--child",
+               "--renders", str(args.renders), "--size", args.size, "--dpi", str(args.dpi)]
+        res = json.loads(subprocess.check_output(cmd, env=env).decode().strip().splitlines()[-1])
+        rows.append({"mode": label, **res})
+    report(f"sheet pool, {args.renders} finals {args.size}/{args.dpi} dpi", rows, args.json)
+
+
+if __name__ == "__main__":
+    main()
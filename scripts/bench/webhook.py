@@ -0,0 +1,79 @@
+# scripts/bench/webhook.py
+"""
+Бенчмарк разбора апдейта вебхука: процессорное время на апдейт до вызова хендлеров.
+
+    python -m scripts.bench.webhook [--calls 20000]
+
+«before» — прежний путь: `json.loads`, `Update.model_validate` без бота и
+пересоздание апдейта в `Dispatcher.feed_update` (`model_dump` и повторная
+валидация с контекстом бота). «after» — то, что делает `handle_webhook`
+(`run.py`) до хендлеров: `update_head`, отсев типов без хендлеров по
+`app.bot.ALLOWED_UPDATES` и `parse_update` с ботом приложения.
+"""
+from __future__ import annotations
+import json
+import time
+from typing import Callable, Dict, List
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from app.bot import ALLOWED_UPDATES, bot
+from app.webhooks.decode import is_unhandled, parse_update, update_head
+from scripts.bench.common import parser, report
+
+_USER = {"id": 123456789, "is_bot": False, "first_name": "Ivan", "username": "ivan", "language_code": "ru"}
+_CHAT = {"id": 123456789, "first_name": "Ivan", "username": "ivan", "type": "private"}
+_PHOTO = [{"file_id": f"AgACAgIAAxkBAAIB{i}", "file_unique_id": f"AQAD{i}", "file_size": 1000 * i,
+           "width": 90 * i, "height": 60 * i} for i in range(1, 5)]
+_MESSAGE = {"message_id": 42, "from": _USER, "chat": _CHAT, "date": 1700000000}
+
+SAMPLES: Dict[str, dict] = {
+    "message (text)": {"message": {**_MESSAGE, "text": "/start"}},
+    "message (photo)": {"message": {**_MESSAGE, "photo": _PHOTO}},
+    "callback_query": {"callback_query": {"id": "4382bfdwdsb323b2d9", "from": _USER, "chat_instance": "-7",
+                                          "data": "adj:brightness:+",
+                                          "message": {**_MESSAGE, "photo": _PHOTO, "caption": "Превью"}}},
+    "edited_message": {"edited_message": {**_MESSAGE, "text": "/start", "edit_date": 1700000001}},
+    "chat_member": {"chat_member": {"chat": _CHAT, "from": _USER, "date": 1700000000,
+                                    "old_chat_member": {"status": "member", "user": _USER},
+                                    "new_chat_member": {"status": "kicked", "user": _USER, "until_date": 0}}},
+}
+
+
+def _before(body: bytes, bot: Bot) -> object:
+    update = Update.model_validate(json.loads(body))
+    return Update.model_validate(update.model_dump(), context={"bot": bot})
+
+
+def _after(body: bytes, bot: Bot) -> object:
+    if is_unhandled(update_head(body), ALLOWED_UPDATES):
+        return None
+    return parse_update(body, bot)
+
+
+def _us_per_call(fn: Callable[[bytes, Bot], object], body: bytes, bot: Bot, calls: int) -> float:
+    t0 = time.process_time()
+    for _ in range(calls):
+        fn(body, bot)
+    return (time.process_time() - t0) / calls * 1e6
+
+
+def main() -> None:
+    p = parser(__doc__.strip().splitlines()[0])
+    p.add_argument("--calls", type=int, default=20000)
+    args = p.parse_args()
+
+    rows: List[Dict[str, object]] = []
+    for name, payload in SAMPLES.items():
+        # Как присылает Telegram: update_id первым
+        body = json.dumps({"update_id": 100500, **payload}, ensure_ascii=False).encode()
+        before = min(_us_per_call(_before, body, bot, args.calls) for _ in range(args.repeat))
+        after = min(_us_per_call(_after, body, bot, args.calls) for _ in range(args.repeat))
+        rows.append({"update": name, "bytes": len(body), "before, µs": before, "after, µs": after,
+                     "speedup": before / after, "handled": name.split()[0] in ALLOWED_UPDATES})
+    report("Webhook update decoding, CPU per update", rows, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# tests/conftest.py
+"""
+Общие фикстуры тестов.
+
+Окружение выставляется до импорта `app`: файлы SQLite, логи и фото — во
+временном каталоге, а не в `app/db/storage`.
+
+`backend` — каждый тест с ним выполняется на обоих бэкендах хранения:
+SQLite во временном каталоге и PostgreSQL в отдельной схеме `pyro_tests`,
+которая пересоздаётся для каждого теста. Какой PostgreSQL (`pg_dsn`):
+- `PG_DSN` из окружения, если задан явно;
+- иначе БД из `deploy/compose.service.pstgr.yml` (`make docker-pstgr-up`),
+  если она слушает;
+- иначе встроенный сервер `pgserver` (из `.[dev]`) во временном каталоге —
+  поднимается один раз на сессию, Docker не нужен.
+Если ни одного нет, PostgreSQL-варианты пропускаются, а в CI (`CI` задан) —
+падают: бэкенд не должен молча остаться непроверенным.
+"""
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import logging
+import os
+import shutil
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="pyro-tests-")
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("WEBHOOK_SECRET_KEY", "test")
+os.environ["SQLITE_DB_PATH"] = _TMP
+os.environ["BASE_LOGS_PATH"] = os.path.join(_TMP, "logs")
+os.environ["STATE_CACHE_NAME"] = f"pyro_print_tests_{os.getpid()}"
+
+_PG_DSN_SET = "PG_DSN" in os.environ
+
+import pytest
+
+from app.core.config import get_database_settings
+
+PG_SCHEMA = "pyro_tests"
+
+
+def _with_search_path(dsn: str) -> str:
+    # Неизвестные asyncpg параметры DSN уходят в настройки сервера
+    return f"{dsn}{'&' if '?' in dsn else '?'}search_path={PG_SCHEMA}"
+
+
+async def _sqlite_backend(tmp_path, monkeypatch):
+    from app.db import backend as backend_mod
+    monkeypatch.setattr(backend_mod, "state_storage", lambda: str(tmp_path / "state.db"))
+    monkeypatch.setattr(backend_mod, "stats_storage", lambda: str(tmp_path / "stats.db"))
+    return backend_mod.SqliteBackend()
+
+
+def _no_postgres(reason: str) -> None:
+    if os.getenv("CI"):
+        pytest.fail(f"PostgreSQL is required in CI: {reason}")
+    pytest.skip(reason)
+
+
+async def _reachable(dsn: str) -> bool:
+    import asyncpg
+    try:
+        conn = await asyncpg.connect(dsn, timeout=3)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError):
+        return False
+    await conn.close()
+    return True
+
+
+@pytest.fixture(scope="session")
+def pg_dsn():
+    """DSN PostgreSQL для тестов; встроенный сервер живёт до конца сессии."""
+    try:
+        import asyncpg  # noqa: F401
+    except ImportError:
+        _no_postgres("asyncpg is not installed")
+    dsn = get_database_settings().PG_DSN
+    # Фикстура запрашивается из асинхронной — проверяем в отдельном потоке со своим циклом
+    with concurrent.futures.ThreadPoolExecutor(1) as ex:
+        reachable = _PG_DSN_SET or ex.submit(asyncio.run, _reachable(dsn)).result()
+    if reachable:
+        yield dsn
+        return
+    try:
+        import pgserver
+    except ImportError:
+        _no_postgres(f"PostgreSQL is not available at {dsn} and pgserver is not installed (pip install -e .[dev])")
+    # Его atexit пишет в лог уже после закрытия потоков pytest
+    logging.getLogger("pgserver").setLevel(logging.WARNING)
+    # Короткий путь: в нём Unix-сокет сервера (предел — 108 байт)
+    data_dir = tempfile.mkdtemp(prefix="pyro-pg-")
+    server = pgserver.get_server(data_dir, cleanup_mode="stop")
+    try:
+        yield server.get_uri()
+    finally:
+        server.cleanup()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+async def _postgres_backend(tmp_path, monkeypatch, dsn):
+    import asyncpg
+    try:
+        conn = await asyncpg.connect(dsn, timeout=3)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        _no_postgres(f"PostgreSQL is not available at {dsn}: {e}")
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {PG_SCHEMA} CASCADE; CREATE SCHEMA {PG_SCHEMA};")
+    finally:
+        await conn.close()
+    monkeypatch.setenv("PG_DSN", _with_search_path(dsn))
+    monkeypatch.setenv("BLOB_STORE_DIR", str(tmp_path / "blobs"))
+    get_database_settings.cache_clear()
+    from app.db import postgres
+    monkeypatch.setattr(postgres, "blob_storage", lambda: str(tmp_path / "blobs"))
+    return postgres.PostgresBackend()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+async def backend(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        be = await _sqlite_backend(tmp_path, monkeypatch)
+    else:
+        be = await _postgres_backend(tmp_path, monkeypatch, request.getfixturevalue("pg_dsn"))
+    yield be
+    await be.close()
+    get_database_settings.cache_clear()
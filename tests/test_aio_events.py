@@ -0,0 +1,28 @@
+# tests/test_aio_events.py
+"""Журнал использования (`app.db.aio_events`): запись пачкой и возврат неудачной пачки в буфер."""
+from __future__ import annotations
+import time
+
+from app.core.config import get_database_settings
+from app.db import aio_events
+
+
+async def test_events_reach_rollups(backend, monkeypatch):
+    monkeypatch.setattr(aio_events, "get_backend", lambda: backend)
+    monkeypatch.setattr(aio_events, "_BUFFER", aio_events._new_buffer())
+    since = time.time() - 3600
+    for _ in range(3):
+        aio_events.record("final", "A4", 300, "bmp", "fs", "ok", 0.5, user_id=7)
+    await aio_events.flush()
+    rows = await aio_events.rollups("hour", since, time.time() + 3600, ["kind"])
+    assert sum(r["events"] for r in rows if r["kind"] == "final") == 3
+
+
+async def test_requeue_keeps_order_and_limit(monkeypatch):
+    monkeypatch.setenv("EVENTS_MAX_PENDING", "3")
+    get_database_settings.cache_clear()
+    try:
+        assert aio_events._requeue([1, 2], [3, 4]) == [2, 3, 4]
+        assert aio_events._requeue([1], [2]) == [1, 2]
+    finally:
+        get_database_settings.cache_clear()
@@ -0,0 +1,63 @@
+# tests/test_aio_stats.py
+"""Буфер статистики (`app.db.aio_stats`): чтение во время сброса и повтор неудачного сброса."""
+from __future__ import annotations
+import asyncio
+
+from app.core.config import get_database_settings
+from app.db import aio_stats
+
+UID = 2002
+
+
+async def test_read_during_flush_is_not_double_counted(backend, monkeypatch):
+    committed = asyncio.Event()
+    release = asyncio.Event()
+    apply = backend.apply_deltas
+
+    async def slow_apply(rows):
+        # Пачка уже в БД, а сброс ещё не вернулся
+        await apply(rows)
+        committed.set()
+        await release.wait()
+
+    monkeypatch.setattr(backend, "apply_deltas", slow_apply)
+    monkeypatch.setattr(aio_stats, "get_backend", lambda: backend)
+    buf = aio_stats._new_buffer()
+    monkeypatch.setattr(aio_stats, "_BUFFER", buf)
+
+    await backend.stats_ensure_user(UID)
+    await aio_stats.record_output(UID, 3)
+    flush = asyncio.create_task(buf.flush())
+    await committed.wait()
+    read = asyncio.create_task(aio_stats.get_user_stats(UID))
+    await asyncio.sleep(0.05)
+    release.set()
+    await flush
+    assert (await read)["outputs_count"] == 3
+
+
+async def test_failed_flush_retries_on_timer_only(backend, monkeypatch):
+    calls = 0
+
+    async def failing_apply(rows):
+        nonlocal calls
+        calls += 1
+        raise OSError("disk is gone")
+
+    monkeypatch.setattr(backend, "apply_deltas", failing_apply)
+    monkeypatch.setattr(aio_stats, "get_backend", lambda: backend)
+    buf = aio_stats._new_buffer()
+    monkeypatch.setattr(aio_stats, "_BUFFER", buf)
+    size = get_database_settings().STATS_FLUSH_USERS
+
+    for uid in range(size):
+        await aio_stats.record_output(uid)
+    await asyncio.gather(*buf._tasks)
+    assert calls == 1
+    # Всё вернулось в буфер, и новые записи не запускают сброс за сбросом
+    for uid in range(size, size + 50):
+        await aio_stats.record_output(uid)
+    await asyncio.sleep(0)
+    assert not buf._tasks and calls == 1
+    assert len(buf.pending) == size + 50 and buf._timer is not None
+    buf._timer.cancel()
@@ -0,0 +1,138 @@
+# tests/test_backends.py
+"""Одни и те же операции хранения на `SqliteBackend` и `PostgresBackend` (фикстура `backend`)."""
+from __future__ import annotations
+import time
+
+import pytest
+
+from app.core.config import get_database_settings
+
+UID = 1001
+
+
+async def test_ensure_user_defaults(backend):
+    assert await backend.read_scalars(UID) is None
+    await backend.ensure_user(UID)
+    await backend.ensure_user(UID)  # повторно — без ошибки
+    rec = await backend.read_scalars(UID)
+    assert rec["brightness"] == 1.0
+    assert rec["dither"] == "fs" and rec["dpi"] == 300 and rec["out_format"] == "bmp"
+    assert rec["invert"] is False and rec["has_image"] is False
+
+
+async def test_adjust_returns_new_state(backend):
+    await backend.ensure_user(UID)
+    # Без фото при need_image — ничего не меняется
+    assert await backend.adjust(UID, "brightness", 0.1, True) is None
+    before = await backend.read_scalars(UID)
+    rec = await backend.adjust(UID, "brightness", 0.1, False)
+    assert rec["brightness"] == pytest.approx(1.1)
+    assert rec["version"] == before["version"] + 1
+    # Ограничение ADJUST_LIMITS
+    rec = await backend.adjust(UID, "brightness", 100.0, False)
+    assert rec["brightness"] == pytest.approx(3.0)
+    assert await backend.read_scalars(UID) == rec
+
+
+async def test_adjust_unknown_user(backend):
+    assert await backend.adjust(UID + 1, "brightness", 0.1, False) is None
+
+
+async def test_cycle_returns_new_state(backend):
+    await backend.ensure_user(UID)
+    rec = await backend.cycle(UID, "dpi", (300, 600, 1200), 300, False)
+    assert rec["dpi"] == 600
+    rec = await backend.cycle(UID, "dither", ("fs", "ordered", "none"), "fs", False)
+    assert rec["dither"] == "ordered"
+    await backend.cycle(UID, "dpi", (300, 600, 1200), 300, False)
+    rec = await backend.cycle(UID, "dpi", (300, 600, 1200), 300, False)
+    assert rec["dpi"] == 300  # по кругу
+    # Текущего значения нет среди вариантов — fallback
+    rec = await backend.cycle(UID, "dpi", (100, 200), 200, False)
+    assert rec["dpi"] == 200
+
+
+async def test_toggle_returns_new_state(backend):
+    await backend.ensure_user(UID)
+    assert (await backend.toggle(UID, "invert", False))["invert"] is True
+    assert (await backend.toggle(UID, "invert", False))["invert"] is False
+
+
+async def test_image_roundtrip(backend):
+    await backend.ensure_user(UID)
+    await backend.update_fields(UID, last_image_bytes=b"\x89PNG" + b"0" * 100)
+    rec = await backend.read_scalars(UID)
+    assert rec["has_image"] is True
+    assert await backend.get_image(UID) == b"\x89PNG" + b"0" * 100
+    # С фото need_image не мешает
+    assert (await backend.adjust(UID, "contrast", 0.5, True))["contrast"] == pytest.approx(1.5)
+
+
+async def test_apply_deltas(backend):
+    now = time.time()
+    await backend.apply_deltas([(UID, 2, 1, now), (UID + 1, 0, 3, now)])
+    await backend.apply_deltas([(UID, 1, 0, now)])
+    a = await backend.read_user_stats(UID)
+    b = await backend.read_user_stats(UID + 1)
+    assert (a["outputs_count"], a["settings_changes_count"]) == (3, 1)
+    assert (b["outputs_count"], b["settings_changes_count"]) == (0, 3)
+
+
+async def test_claim_update_dedup(backend):
+    now = time.time()
+    assert await backend.claim_update(42, now) is True
+    assert await backend.claim_update(42, now) is False
+    await backend.release_update(42)
+    assert await backend.claim_update(42, now) is True
+    await backend.claim_update(43, now - 100)
+    assert await backend.purge_updates(now - 50) == 1
+    assert await backend.claim_update(43, now) is True
+
+
+async def test_album_claim(backend):
+    await backend.album_add_item("g1", 2, UID, "file-b")
+    added = await backend.album_add_item("g1", 1, UID, "file-a")
+    await backend.album_add_item("g1", 1, UID, "file-a")  # повтор элемента — без дубля
+    assert await backend.album_last_added("g1") == pytest.approx(added, abs=1.0)
+    assert [it["file_id"] for it in await backend.album_items("g1")] == ["file-a", "file-b"]
+    assert await backend.album_claim("g1") is True
+    assert await backend.album_claim("g1") is False
+    assert await backend.album_claim("g2") is True
+
+
+async def _photos(backend, sizes):
+    """Пользователи 0..n-1 с фото заданных размеров; `image_used_at` = 10, 20, … (по порядку LRU)."""
+    for uid, size in enumerate(sizes):
+        await backend.ensure_user(uid)
+        await backend.update_fields(uid, last_image_bytes=b"x" * size)
+        await backend.touch_image(uid, 10.0 * (uid + 1))
+
+
+async def test_evict_images_ttl_counts_toward_budget(backend):
+    await _photos(backend, [5, 50, 50, 50])
+    # Всего 155 байт, бюджет 150: удаления фото 0 по TTL уже достаточно
+    evicted = await backend.evict_images(15.0, 150, 10)
+    assert sorted(uid for uid, _ in evicted) == [0]
+    assert all(rec["has_image"] is False for _, rec in evicted)
+    assert (await backend.read_scalars(1))["has_image"] is True
+
+
+async def test_evict_images_budget_lru(backend):
+    await _photos(backend, [50, 50, 50, 50])
+    # Без TTL-кандидатов: самые давние, пока объём выше бюджета
+    assert sorted(uid for uid, _ in await backend.evict_images(0.0, 120, 10)) == [0, 1]
+    assert await backend.evict_images(0.0, 120, 10) == []
+    assert await backend.get_image(2) == b"x" * 50
+
+
+async def test_evict_images_limit(backend):
+    await _photos(backend, [10, 10, 10])
+    assert len(await backend.evict_images(1e9, 0, 2)) == 2
+    assert [uid for uid, _ in await backend.evict_images(1e9, 0, 2)] == [2]
+
+
+async def test_vacuum_step(backend):
+    await _photos(backend, [20000] * 4)
+    await backend.evict_images(1e9, 0, 10)
+    # Новая БД SQLite — в auto_vacuum=INCREMENTAL: после шага свободных страниц не остаётся
+    assert await backend.vacuum_step(1000) == 0
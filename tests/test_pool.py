@@ -0,0 +1,83 @@
+# tests/test_pool.py
+"""`RenderPool.run`: таймаут, переполнение очереди и пересоздание пула после падения процесса."""
+from __future__ import annotations
+import asyncio
+import os
+import time
+
+import pytest
+
+from app.render.pool import RenderError, RenderPool, RenderQueueFull, RenderTimeout
+
+
+def _sleep(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+def _crash() -> None:
+    os._exit(1)
+
+
+@pytest.fixture
+def pool():
+    # fork — процессы стартуют мгновенно; задачам здесь не нужен чистый интерпретатор
+    p = RenderPool(workers=1, queue_size=0, mp_context="fork")
+    yield p
+    p.shutdown()
+
+
+async def _drained(p: RenderPool) -> None:
+    for _ in range(100):
+        if not p.inflight:
+            return
+        await asyncio.sleep(0.05)
+
+
+async def test_run_returns_result(pool):
+    assert await pool.run(_sleep, 0.0, timeout=10) == 0.0
+    assert pool.inflight == 0
+
+
+async def test_timeout_keeps_slot_until_task_finishes(pool):
+    with pytest.raises(RenderTimeout):
+        await pool.run(_sleep, 0.5, timeout=0.05)
+    # Брошенная задача ещё выполняется — и занимает место в очереди
+    assert pool.inflight == 1
+    with pytest.raises(RenderQueueFull):
+        await pool.run(_sleep, 0.0, timeout=10)
+    await _drained(pool)
+    assert pool.inflight == 0
+    assert await pool.run(_sleep, 0.0, timeout=10) == 0.0
+
+
+async def test_queue_full_rejects_without_waiting(pool):
+    running = asyncio.create_task(pool.run(_sleep, 0.3, timeout=10))
+    await asyncio.sleep(0)
+    started = time.monotonic()
+    with pytest.raises(RenderQueueFull):
+        await pool.run(_sleep, 0.0, timeout=10)
+    assert time.monotonic() - started < 0.1
+    assert await running == 0.3
+
+
+async def test_cancelled_wait_cancels_queued_task():
+    p = RenderPool(workers=1, queue_size=1, mp_context="fork")
+    try:
+        running = asyncio.create_task(p.run(_sleep, 0.3, timeout=10))
+        queued = asyncio.create_task(p.run(_sleep, 0.3, timeout=10))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        await running
+        await _drained(p)
+        assert p.inflight == 0
+    finally:
+        p.shutdown()
+
+
+async def test_broken_pool_is_recreated(pool):
+    with pytest.raises(RenderError, match="crashed"):
+        await pool.run(_crash, timeout=10)
+    assert await pool.run(_sleep, 0.0, timeout=10) == 0.0
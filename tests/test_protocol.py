@@ -0,0 +1,65 @@
+# tests/test_protocol.py
+"""Кадры протокола демона рендеринга: запись и чтение, отказ на чужих и битых заголовках."""
+from __future__ import annotations
+import asyncio
+import json
+
+import pytest
+
+from app.render import protocol
+from app.render.pipeline import ProcState
+from app.render.protocol import HEADER, MAX_META, Op, ProtocolError
+from app.render.shm import ShmHandle
+
+
+def _reader(*chunks: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    reader.feed_eof()
+    return reader
+
+
+async def test_roundtrip_with_payload():
+    meta = {"key": "abc", "out": protocol.handle_to_meta(ShmHandle("psm_1", 4096))}
+    parts = protocol.encode(Op.PREVIEW, 0xFFFFFFFF, meta, b"\x00\x01payload")
+    assert len(parts) == 3  # payload не склеивается с заголовком
+    frame = await protocol.read_frame(_reader(b"".join(parts)))
+    assert frame == (Op.PREVIEW, 0xFFFFFFFF, meta, b"\x00\x01payload")
+    assert protocol.handle_from_meta(frame.meta["out"]) == ShmHandle("psm_1", 4096)
+
+
+async def test_roundtrip_without_payload_and_frames_back_to_back():
+    data = b"".join([*protocol.encode(Op.PING, 1), *protocol.encode(Op.OK, 1, {"pid": 7})])
+    reader = _reader(data)
+    assert await protocol.read_frame(reader) == (Op.PING, 1, {}, b"")
+    assert await protocol.read_frame(reader) == (Op.OK, 1, {"pid": 7}, b"")
+    with pytest.raises(asyncio.IncompleteReadError):
+        await protocol.read_frame(reader)
+
+
+@pytest.mark.parametrize("magic, version, meta_len", [
+    (b"XX", protocol.VERSION, 2),
+    (protocol.MAGIC, protocol.VERSION + 1, 2),
+    (protocol.MAGIC, protocol.VERSION, MAX_META + 1),
+])
+async def test_bad_header_is_rejected(magic, version, meta_len):
+    header = HEADER.pack(magic, version, Op.PING, 1, meta_len, 0)
+    with pytest.raises(ProtocolError):
+        await protocol.read_frame(_reader(header, b"{}"))
+
+
+async def test_truncated_frame():
+    parts = protocol.encode(Op.FINAL, 3, {"size": "A4"}, b"x" * 100)
+    with pytest.raises(asyncio.IncompleteReadError):
+        await protocol.read_frame(_reader(b"".join(parts)[:-1]))
+
+
+def test_state_meta_roundtrip():
+    st = ProcState(brightness=1.2, dither="atkinson", dpi=600, out_format="png", last_image_bytes=b"img")
+    meta = protocol.state_to_meta(st)
+    assert "last_image_bytes" not in meta
+    json.dumps(meta)  # уходит в кадр как JSON
+    back = protocol.state_from_meta(json.loads(json.dumps(meta)))
+    assert back.brightness == 1.2 and back.dither == "atkinson" and back.dpi == 600 and back.out_format == "png"
+    assert back.last_image_bytes is None
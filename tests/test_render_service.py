@@ -0,0 +1,110 @@
+# tests/test_render_service.py
+"""
+Рендеринг через демон (`RENDER_MODE=daemon`, по умолчанию): запрос и ответ по
+сокету, а без демона — маленький запасной пул веб-воркера, а не пул по числу ядер.
+"""
+from __future__ import annotations
+import io
+import shutil
+import tempfile
+
+import pytest
+from PIL import Image
+
+from app.core.config import get_render_settings
+from app.render import protocol, service
+from app.render.cache import DecodedCache
+from app.render.daemon import RenderDaemon
+from app.render.pipeline import ProcState
+from app.render.pool import RenderError, RenderPool, RenderQueueFull, RenderUnavailable
+from app.render.protocol import Op
+from app.render.shm import SegmentArena
+
+
+def _png() -> bytes:
+    bio = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 120, 40)).save(bio, "PNG")
+    return bio.getvalue()
+
+
+@pytest.fixture
+def no_daemon(tmp_path, monkeypatch):
+    """Продакшен-режим с недоступным демоном; синглтоны сервиса — свои на тест."""
+    monkeypatch.setenv("TYPE_NETWORK", "server")
+    monkeypatch.setenv("RENDER_SOCKET_PATH", str(tmp_path / "absent.sock"))
+    monkeypatch.delenv("RENDER_MODE", raising=False)
+    get_render_settings.cache_clear()
+    for name in ("_LOCAL", "_FALLBACK", "_CLIENT", "_PREVIEWS"):
+        monkeypatch.setattr(service, name, None)
+    yield
+    if service._FALLBACK is not None:
+        service._FALLBACK.pool.shutdown()
+    get_render_settings.cache_clear()
+
+
+async def test_daemon_down_uses_small_fallback_pool(no_daemon):
+    assert get_render_settings().RENDER_MODE == "daemon"
+    preview = await service.render_preview(_png(), ProcState(), user_id=1)
+    assert preview.data
+    assert service._LOCAL is None  # пул по числу ядер не создавался
+    assert service._FALLBACK.pool.workers == get_render_settings().RENDER_FALLBACK_WORKERS == 1
+
+
+async def test_daemon_down_without_fallback_is_busy(no_daemon, monkeypatch):
+    monkeypatch.setenv("RENDER_FALLBACK_WORKERS", "0")
+    get_render_settings.cache_clear()
+    with pytest.raises(RenderQueueFull):
+        await service.render_preview(_png(), ProcState(), user_id=1)
+    assert service._LOCAL is None and service._FALLBACK is None
+
+
+@pytest.fixture
+async def daemon(monkeypatch):
+    """Демон на временном сокете (путь короткий — предел Unix-сокета 108 байт) и сервис, настроенный на него."""
+    tmp = tempfile.mkdtemp(prefix="pyro-sock-")
+    path = f"{tmp}/render.sock"
+    monkeypatch.setenv("TYPE_NETWORK", "server")
+    monkeypatch.setenv("RENDER_SOCKET_PATH", path)
+    get_render_settings.cache_clear()
+    for name in ("_LOCAL", "_FALLBACK", "_CLIENT", "_PREVIEWS"):
+        monkeypatch.setattr(service, name, None)
+    arena = SegmentArena(budget_bytes=64 << 20, leak_seconds=300.0)
+    d = RenderDaemon(service.LocalRenderer(RenderPool(workers=1, queue_size=2, mp_context="fork"), arena,
+                                           DecodedCache(arena, 16 << 20)), path)
+    await d.start()
+    yield d
+    if service._CLIENT is not None:
+        service._CLIENT.shutdown()
+    await d.stop()
+    get_render_settings.cache_clear()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+async def test_daemon_roundtrip(daemon):
+    client = service._get_client()
+    assert (await client.request(Op.PING, {})).meta["pid"]
+    data, filename = await client.preview(_png(), ProcState())
+    local, local_name = await daemon.renderer.preview(_png(), ProcState())
+    assert (data, filename) == (local, local_name)
+    # Ошибка демона приходит клиенту исключением
+    with pytest.raises(RenderError, match="unsupported"):
+        await client.request(Op.OK, {"st": protocol.state_to_meta(ProcState())})
+
+
+async def test_render_preview_goes_through_daemon(daemon):
+    preview = await service.render_preview(_png(), ProcState(), user_id=1)
+    assert preview.data
+    assert service._LOCAL is None and service._FALLBACK is None
+    assert daemon.renderer.pool.inflight == 0
+
+
+async def test_daemon_stop_falls_back(daemon):
+    client = service._get_client()
+    await client.request(Op.PING, {})
+    await daemon.stop()
+    with pytest.raises(RenderUnavailable):
+        await client.request(Op.PING, {})
+    preview = await service.render_preview(_png(), ProcState(brightness=1.5), user_id=1)
+    assert preview.data
+    assert service._LOCAL is None and service._FALLBACK is not None
+    service._FALLBACK.pool.shutdown()
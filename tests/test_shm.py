@@ -0,0 +1,76 @@
+# tests/test_shm.py
+"""Уборка утечек `SegmentArena`: сегменты в аренде не удаляются, сколько бы ни шёл рендер,
+а сегмент декодирования, завершившегося после таймаута, не остаётся в /dev/shm."""
+from __future__ import annotations
+import asyncio
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from app.core.config import get_render_settings
+from app.render import service
+from app.render.cache import DecodedCache
+from app.render.pool import RenderPool, RenderTimeout
+from app.render.shm import SHM_DIR, ImageHandle, SegmentArena, create_image_segment
+
+
+def _exists(name: str) -> bool:
+    return os.path.exists(os.path.join(SHM_DIR, name))
+
+
+def test_leased_segments_survive_leak_check():
+    arena = SegmentArena(budget_bytes=1 << 20, leak_seconds=0.0)
+    try:
+        with arena.lease_bytes(b"x" * 100) as src, arena.lease_output(4096) as out:
+            assert arena.check_leaks() == 0
+            assert _exists(src.name) and _exists(out.name)
+        assert not _exists(src.name) and not _exists(out.name)
+    finally:
+        arena.release_all()
+
+
+def test_unleased_segment_is_reaped():
+    arena = SegmentArena(budget_bytes=1 << 20, leak_seconds=0.0)
+    try:
+        lost = arena.put_bytes(b"y" * 100)
+        assert arena.check_leaks() == 1
+        assert not _exists(lost.name)
+        assert arena.stats()["leaked_total"] == 1
+    finally:
+        arena.release_all()
+
+
+def _slow_decode(src) -> ImageHandle:
+    # Выполняется в процессе пула: декодирование, которое не уложилось в таймаут
+    time.sleep(1.0)
+    return create_image_segment(Image.new("RGB", (256, 256)))
+
+
+def _segments() -> set:
+    return {n for n in os.listdir(SHM_DIR) if n.startswith("psm_")}
+
+
+async def test_late_decoded_segment_is_released(monkeypatch):
+    monkeypatch.setenv("RENDER_PREVIEW_TIMEOUT", "0.2")
+    get_render_settings.cache_clear()
+    monkeypatch.setattr(service, "decode_task", _slow_decode)
+    arena = SegmentArena(budget_bytes=1 << 20, leak_seconds=300.0)
+    pool = RenderPool(workers=1, queue_size=0)
+    renderer = service.LocalRenderer(pool, arena, DecodedCache(arena, 1 << 20))
+    try:
+        before = _segments()
+        with pytest.raises(RenderTimeout):
+            await renderer._decoded(b"original", "key")
+        for _ in range(300):  # spawn-процесс пула стартует несколько секунд
+            await asyncio.sleep(0.1)
+            if not pool.inflight:
+                break
+        await asyncio.sleep(0.1)  # колбэк доходит до цикла событий через call_soon_threadsafe
+        assert _segments() - before == set()
+        assert arena.stats()["segments"] == 0
+    finally:
+        pool.shutdown()
+        arena.release_all()
+        get_render_settings.cache_clear()
@@ -0,0 +1,58 @@
+# tests/test_state_cache.py
+"""Согласованность `StateCache`: заполнение после промаха не должно пережить запись в БД."""
+from __future__ import annotations
+
+import pytest
+
+from app.db.state_cache import StateCache
+
+
+def _rec(version: int, has_image: bool) -> dict:
+    return {
+        "brightness": 1.0, "contrast": 1.0, "gamma": 1.0, "sharpness": 1.0, "invert": False,
+        "dither": "fs", "dpi": 300, "denoise_size": 0, "blur_radius": 0.0, "out_format": "bmp",
+        "has_image": has_image, "version": version,
+    }
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = StateCache(str(tmp_path / "state_cache"), slots=1)  # один слот — все пользователи в нём
+    yield c
+    c.close()
+
+
+def test_fill_after_invalidate_of_empty_slot_is_dropped(cache):
+    # Читатель: промах, чтение БД (ещё без фото)...
+    miss, seq = cache.lookup(1)
+    assert miss is None
+    stale = _rec(version=1, has_image=False)
+    # ...писатель: фото сохранено в БД, запись кеша сброшена...
+    cache.invalidate(1)
+    # ...читатель кладёт прочитанное до записи — не должно попасть в кеш
+    cache.fill(1, stale, seq)
+    assert cache.get(1) is None
+
+
+def test_fill_after_invalidate_of_foreign_slot_is_dropped(cache):
+    cache.put(2, _rec(version=5, has_image=True))
+    miss, seq = cache.lookup(1)
+    assert miss is None
+    cache.invalidate(1)
+    cache.fill(1, _rec(version=1, has_image=False), seq)
+    assert cache.get(1) is None
+    assert cache.get(2) == _rec(version=5, has_image=True)  # чужая запись цела
+
+
+def test_fill_without_concurrent_write(cache):
+    _, seq = cache.lookup(1)
+    cache.fill(1, _rec(version=3, has_image=True), seq)
+    assert cache.get(1) == _rec(version=3, has_image=True)
+    cache.invalidate(1)
+    assert cache.get(1) is None
+
+
+def test_put_keeps_newer_version(cache):
+    cache.put(1, _rec(version=4, has_image=True))
+    cache.put(1, _rec(version=3, has_image=False))
+    assert cache.get(1)["version"] == 4
@@ -0,0 +1,100 @@
+# tests/test_webhook_dedup.py
+"""
+Отсев повторных доставок в `handle_webhook` (`run.py`): апдейт забирается по
+`update_id`, повтор получает 200 без обработки, а отметка снимается только
+если обработка точно не начиналась (400/422/429).
+"""
+from __future__ import annotations
+import json
+from typing import List
+
+import pytest
+from fastapi.testclient import TestClient
+
+import run
+from app.core.config import get_webhooks_setting
+from app.db import aio_updates
+from app.db import backend as backend_mod
+
+PATH = get_webhooks_setting().WEBHOOK_PATH
+
+
+def _body(update_id: int, kind: str = "message") -> bytes:
+    # Как присылает Telegram: update_id первым, следом — тип события
+    return json.dumps({"update_id": update_id, kind: {"message_id": 1, "date": 0,
+                                                     "chat": {"id": 1, "type": "private"}}}).encode()
+
+
+@pytest.fixture
+def webhook(tmp_path, monkeypatch):
+    """TestClient без lifespan (без вебхука Telegram); обработка подменена — возвращает заданные статусы."""
+    monkeypatch.setattr(backend_mod, "state_storage", lambda: str(tmp_path / "state.db"))
+    monkeypatch.setattr(backend_mod, "stats_storage", lambda: str(tmp_path / "stats.db"))
+    be = backend_mod.SqliteBackend()
+    monkeypatch.setattr(aio_updates, "get_backend", lambda: be)
+    monkeypatch.setattr(aio_updates, "_SEEN", {})
+    statuses: List[int] = []
+    calls: List[bytes] = []
+
+    async def dispatch(body: bytes) -> int:
+        calls.append(body)
+        return statuses.pop(0) if statuses else 200
+
+    monkeypatch.setattr(run, "_dispatch", dispatch)
+    client = TestClient(run.app, raise_server_exceptions=False)
+    client.statuses, client.calls = statuses, calls
+    yield client
+    client.close()
+
+
+def test_duplicate_is_acknowledged_without_processing(webhook):
+    assert webhook.post(PATH, content=_body(1)).status_code == 200
+    assert webhook.post(PATH, content=_body(1)).status_code == 200
+    assert webhook.post(PATH, content=_body(2)).status_code == 200
+    assert len(webhook.calls) == 2
+
+
+def test_duplicate_in_other_worker(webhook, monkeypatch):
+    assert webhook.post(PATH, content=_body(1)).status_code == 200
+    # Другой воркер: своей памяти нет, отсекает общая таблица
+    monkeypatch.setattr(aio_updates, "_SEEN", {})
+    assert webhook.post(PATH, content=_body(1)).status_code == 200
+    assert len(webhook.calls) == 1
+
+
+@pytest.mark.parametrize("status", [400, 422, 429])
+def test_not_started_releases_claim(webhook, status):
+    webhook.statuses.append(status)
+    assert webhook.post(PATH, content=_body(1)).status_code == status
+    # Telegram повторит — повтор обрабатывается
+    assert webhook.post(PATH, content=_body(1)).status_code == 200
+    assert len(webhook.calls) == 2
+
+
+@pytest.mark.parametrize("status", [500, 502, 503])
+def test_possibly_started_keeps_claim(webhook, status):
+    webhook.statuses.append(status)
+    assert webhook.post(PATH, content=_body(1)).status_code == status
+    assert webhook.post(PATH, content=_body(1)).status_code == 200
+    assert len(webhook.calls) == 1
+
+
+def test_unhandled_type_is_dropped_without_claim(webhook):
+    kind = "chat_join_request"
+    assert kind not in run.ALLOWED_UPDATES
+    assert webhook.post(PATH, content=_body(1, kind)).status_code == 200
+    assert webhook.calls == []
+    # update_id не забран: тот же номер с нужным типом обрабатывается
+    assert webhook.post(PATH, content=_body(1)).status_code == 200
+    assert len(webhook.calls) == 1
+
+
+def test_dedup_disabled(webhook, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_DEDUP", "false")
+    get_webhooks_setting.cache_clear()
+    try:
+        webhook.post(PATH, content=_body(1))
+        webhook.post(PATH, content=_body(1))
+    finally:
+        get_webhooks_setting.cache_clear()
+    assert len(webhook.calls) == 2